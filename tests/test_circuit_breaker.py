@@ -0,0 +1,77 @@
+import threading
+import truenas_collector
+from truenas_collector import TrueNasCollector, CircuitBreaker
+
+class Response(object):
+    status_code = 200
+    def __init__(self, content):
+        self.content = content
+
+def opened(breaker):
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    breaker.open_until = 0
+
+def test_one_trial_call_at_a_time():
+    breaker = CircuitBreaker(1)
+    opened(breaker)
+    assert breaker.allow()
+    # The prober itself may retry, after failover for instance
+    assert breaker.allow()
+    others = []
+    thread = threading.Thread(target=lambda: others.append(breaker.allow()))
+    thread.start()
+    thread.join()
+    assert others == [False]
+    assert breaker.rejected == 1
+    breaker.success()
+    thread = threading.Thread(target=lambda: others.append(breaker.allow()))
+    thread.start()
+    thread.join()
+    assert others == [False, True]
+
+def test_failed_trial_call_reopens():
+    breaker = CircuitBreaker(1)
+    opened(breaker)
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.prober is None
+
+def test_others_get_the_last_good_response_during_the_trial(monkeypatch):
+    collector = TrueNasCollector('localhost:1', 'u', 'p', circuit_breaker=1)
+    collector.last_good['widget'] = (0, ['stale'])
+    breaker = collector.breakers['widget'] = CircuitBreaker(1)
+    opened(breaker)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+    def get(url, **kwargs):
+        calls.append(url)
+        started.set()
+        release.wait(5)
+        return Response(b'[{"name": "fresh"}]')
+    monkeypatch.setattr(truenas_collector.requests, 'get', get)
+
+    results = []
+    probe = threading.Thread(target=lambda: results.append(collector.request('widget')))
+    probe.start()
+    assert started.wait(5)
+    assert collector.request('widget') == ['stale']
+    release.set()
+    probe.join()
+    assert len(calls) == 1
+    assert results == [[{'name': 'fresh'}]]
+    assert breaker.state == CircuitBreaker.CLOSED
+
+def test_trial_call_that_raises_reopens(monkeypatch):
+    collector = TrueNasCollector('localhost:1', 'u', 'p', circuit_breaker=1)
+    breaker = collector.breakers['widget'] = CircuitBreaker(1)
+    opened(breaker)
+    monkeypatch.setattr(truenas_collector.requests, 'get', lambda url, **kwargs: Response(b'not json'))
+    try:
+        collector.request('widget')
+    except ValueError:
+        pass
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.prober is None
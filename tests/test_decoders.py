@@ -0,0 +1,51 @@
+import gc, json
+import truenas_collector
+from truenas_collector import TrueNasCollector, JSON_DECODERS
+
+class Response(object):
+    status_code = 200
+    def __init__(self, content):
+        self.content = content
+
+def test_fastest_decoder_by_default():
+    assert list(JSON_DECODERS)[-1] == 'json'
+    collector = TrueNasCollector('localhost:1', 'u', 'p')
+    assert collector.json_decoder == list(JSON_DECODERS)[0]
+    assert collector.json_loads is JSON_DECODERS[collector.json_decoder]
+
+def test_decoder_chosen_and_reloaded():
+    collector = TrueNasCollector('localhost:1', 'u', 'p', json_decoder='json')
+    assert collector.json_loads is json.loads
+    collector.reconfigure({'json_decoder': None})
+    assert collector.json_loads is JSON_DECODERS[list(JSON_DECODERS)[0]]
+
+def test_decoders_agree():
+    body = json.dumps([{'name': 'tank/ä', 'used': {'parsed': 2**40}}]).encode()
+    assert all(loads(body) == json.loads(body) for loads in JSON_DECODERS.values())
+
+def test_gc_paused_only_for_large_bodies(monkeypatch):
+    collector = TrueNasCollector('localhost:1', 'u', 'p')
+    bodies = {
+        'small': b'[1]',
+        'large': b'[' + b'1,'*600000 + b'1]',
+        'broken': b'[' + b' '*1048576 + b'broken',
+    }
+    monkeypatch.setattr(truenas_collector.requests, 'get',
+        lambda url, **kwargs: Response(bodies[url.rsplit('/', 1)[1]]))
+    enabled = []
+    def loads(content):
+        enabled.append(gc.isenabled())
+        return json.loads(content)
+    collector.json_loads = loads
+
+    assert gc.isenabled()
+    assert collector.request('small') == [1]
+    assert len(collector.request('large')) == 600001
+    assert enabled == [True, False]
+    assert gc.isenabled()
+    try:
+        collector.request('broken')
+    except ValueError:
+        pass
+    assert enabled[2] is False
+    assert gc.isenabled()
@@ -0,0 +1,42 @@
+import time
+from truenas_collector import TrueNasCollector, parse_records
+
+INVENTORY = [
+    {'name': 'sda', 'serial': 'S1', 'type': 'SSD', 'model': 'M1', 'size': 1},
+    {'name': 'sdb', 'serial': 'S2', 'type': 'HDD', 'model': 'M2', 'size': 2},
+]
+
+def collector_with(monkeypatch, temperatures, **kwargs):
+    collector = TrueNasCollector('localhost:1', 'u', 'p', **kwargs)
+    calls = []
+    def request(apipath, data=None, params=None):
+        calls.append((apipath, data))
+        if apipath == 'disk':
+            return parse_records('disk', INVENTORY)
+        return temperatures.pop(0)
+    monkeypatch.setattr(collector, 'request', request)
+    return (collector, calls)
+
+def samples(collector):
+    return {(sample.labels['name'], sample.labels['serial'], sample.labels['model']): sample.value
+        for sample in collector._collect_disk_temperatures()[0].samples}
+
+def test_one_call_for_all_disks(monkeypatch):
+    (collector, calls) = collector_with(monkeypatch, [{'sda': 31, 'sdb': None, 'sdc': 40}])
+    # sdb is in standby, sdc isn't in the inventory
+    assert samples(collector) == {('sda', 'S1', 'M1'): 31, ('sdc', '', ''): 40}
+    assert calls == [('disk/temperatures', {'names': [], 'powermode': 'STANDBY'}), ('disk', None)]
+
+def test_cached_between_calls(monkeypatch):
+    (collector, calls) = collector_with(monkeypatch, [{'sda': 31}, {'sda': 35}], cache_disk_temperatures=60)
+    assert samples(collector) == {('sda', 'S1', 'M1'): 31}
+    assert samples(collector) == {('sda', 'S1', 'M1'): 31}
+    assert [apipath for (apipath, data) in calls].count('disk/temperatures') == 1
+    collector.last_disk_temperatures_time = time.monotonic() - 60
+    assert samples(collector) == {('sda', 'S1', 'M1'): 35}
+
+def test_failed_call_keeps_the_last_temperatures(monkeypatch):
+    (collector, calls) = collector_with(monkeypatch, [{'sda': 31}, {}], cache_disk_temperatures=0)
+    assert samples(collector) == {('sda', 'S1', 'M1'): 31}
+    assert samples(collector) == {('sda', 'S1', 'M1'): 31}
+    assert [apipath for (apipath, data) in calls].count('disk/temperatures') == 2
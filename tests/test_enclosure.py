@@ -0,0 +1,43 @@
+from truenas_collector import TrueNasCollector
+
+class FakeCollector(TrueNasCollector):
+    def request(self, apipath, data=None, params=None):
+        return self.payload
+
+def element(status, value, descriptor='Fan 1'):
+    return {'descriptor': descriptor, 'status': status, 'value': value}
+
+def enclosure(*leaves):
+    return [{'name': 'encl', 'model': 'M', 'id': 'e1',
+        'elements': {'Cooling': {str(n): leaf for (n, leaf) in enumerate(leaves, 1)}}}]
+
+def samples(collector):
+    return {(sample.name, sample.labels['metricdevice']): sample.value
+        for family in collector._collect_enclosure() for sample in family.samples}
+
+def test_status_and_readings_on_every_scrape():
+    collector = FakeCollector('localhost:1', 'u', 'p', cache_enclosure=3600)
+    collector.payload = enclosure(element('OK', '4020 RPM'))
+    assert samples(collector) == {
+        ('truenas_enclosure_health', 'Cooling 1'): 1,
+        ('truenas_enclosure_status', 'Cooling 1'): 4020.0}
+    # The fan fails: seen in the very next scrape, well within the cache time
+    collector.payload = enclosure(element('Critical', '0 RPM'))
+    assert samples(collector) == {
+        ('truenas_enclosure_health', 'Cooling 1'): 3,
+        ('truenas_enclosure_status', 'Cooling 1'): 0.0}
+
+def test_layout_is_cached_until_it_expires():
+    collector = FakeCollector('localhost:1', 'u', 'p', cache_enclosure=3600)
+    collector.payload = enclosure(element('OK', '4020 RPM'))
+    samples(collector)
+    # A new element shows up right away, a changed descriptor only once the
+    # cached layout expires
+    collector.payload = enclosure(element('OK', '4020 RPM', 'Fan A'), element('OK', '3900 RPM'))
+    labels = {family.name: [sample.labels['metricelement'] for sample in family.samples]
+        for family in collector._collect_enclosure()}
+    assert labels['truenas_enclosure_health'] == ['Fan 1', 'Fan 1']
+    collector.enclosure_topology = (collector.enclosure_topology[0] - 3600, collector.enclosure_topology[1])
+    labels = {family.name: [sample.labels['metricelement'] for sample in family.samples]
+        for family in collector._collect_enclosure()}
+    assert labels['truenas_enclosure_health'] == ['Fan A', 'Fan 1']
@@ -0,0 +1,63 @@
+from prometheus_client import generate_latest
+import datetime, ipaddress, os, subprocess, sys, threading, time
+import pytest
+import truenas_collector, truenas_collectors
+from truenas_collector import TrueNasCollector
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run(code):
+    return subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True,
+        capture_output=True, text=True).stdout
+
+def test_pull_mode_has_no_push_metrics():
+    output = run('import truenas_exporter, prometheus_client\n'
+        'print(prometheus_client.generate_latest().decode())')
+    assert 'truenas_exporter_push_' not in output
+
+class Frozen(datetime.datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return cls.fromtimestamp(1700000000, tz)
+
+class Fixed(object):
+    """ Stands in for the mock's random values """
+    def uniform(self, low, high):
+        return (low + high)/2
+
+@pytest.fixture
+def mock_truenas(monkeypatch):
+    import truenas_mock
+    # Every stats window, value and snapshot age the same on every scrape
+    monkeypatch.setattr(time, 'time', lambda: 1700000000.0)
+    for module in [truenas_collector, truenas_collectors.load('_collect_stats')]:
+        monkeypatch.setattr(module, 'datetime', Frozen)
+    server = truenas_mock.MockTrueNasServer(('localhost', 0), dict(pools=1, datasets=5, disks=4, filesystems=4, interfaces=2, replications=2, rsynctasks=1,
+        cloudsyncs=1, snapshottasks=2, snapshots=30, alerts=2, enclosures=1, enclosure_elements=4))
+    server.rng = Fixed()
+    server.socket = truenas_mock._self_signed_context().wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'localhost:{server.server_address[1]}'
+    server.shutdown()
+
+def metrics(collector):
+    # Without the exporter's own metrics, and cache ages, which go by the
+    # monotonic clock
+    return [line for line in generate_latest(collector).decode().splitlines()
+        if not line.startswith(('# ', 'truenas_exporter_')) and '_age_seconds' not in line]
+
+def test_profile_leaves_the_next_scrape_alone(mock_truenas, monkeypatch):
+    import truenas_exporter
+    settings = dict(target=mock_truenas, username='root', password='x', stats_rotate=3,
+        snapshots_interval=1, snapshots_page_size=10, snapshots_pages=1)
+    (profiled, untouched) = (TrueNasCollector(**settings), TrueNasCollector(**settings))
+    monkeypatch.setattr(truenas_exporter, 'collector', profiled, raising=False)
+    monkeypatch.setattr(truenas_exporter, 'pool', None, raising=False)
+    monkeypatch.setattr(truenas_exporter, 'debug_networks', [ipaddress.ip_network('127.0.0.0/8')], raising=False)
+
+    assert metrics(profiled) == metrics(untouched)
+    statuses = []
+    body = truenas_exporter.truenas_exporter({'PATH_INFO': '/debug/profile', 'QUERY_STRING': 'limit=1',
+        'REMOTE_ADDR': '127.0.0.1', 'REQUEST_METHOD': 'GET'}, lambda status, headers: statuses.append(status))
+    assert statuses == ['200 OK'] and b'Scrape produced' in b''.join(body)
+    assert metrics(profiled) == metrics(untouched)
@@ -0,0 +1,110 @@
+import json, threading, time
+import truenas_collector
+from truenas_collector import TrueNasCollector, ScrapeContext, failovers
+
+def test_failed_entries_are_not_shared():
+    context = ScrapeContext()
+    def fail():
+        raise ValueError
+    for name in ['a', 'b']:
+        try:
+            context.index(name, fail)
+        except ValueError:
+            pass
+    (first, second) = (context.index('a', dict), context.index('b', dict))
+    assert first == second == {}
+    assert first is not second
+
+def test_concurrent_failover_probes_once(monkeypatch):
+    collector = TrueNasCollector('a:443,b:443', 'u', 'p')
+    probes = []
+    def probe(target):
+        probes.append(target)
+        time.sleep(0.1)
+        return 'MASTER' if target == 'b:443' else None
+    monkeypatch.setattr(collector, '_probe', probe)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(collector._failover('a:443'))) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(probes) == ['a:443', 'b:443']
+    assert results == [True, True, True]
+    assert collector.target == 'b:443'
+    # A call that failed against the new address doesn't probe again
+    assert collector._failover('b:443') is False
+
+class Response(object):
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+def cluster(monkeypatch, status):
+    """ requests.get answering from status[host] = (failover/status, its HTTP status, API calls' HTTP status) """
+    calls = []
+    def get(url, **kwargs):
+        host = url.split('/')[2]
+        calls.append(url)
+        if status.get(host) is None:
+            raise truenas_collector.requests.exceptions.ConnectionError('down')
+        (state, probe_code, code) = status[host]
+        if url.endswith('/failover/status'):
+            return Response(json.dumps(state).encode(), probe_code)
+        return Response(json.dumps([{'host': host}]).encode(), code)
+    monkeypatch.setattr(truenas_collector.requests, 'get', get)
+    return calls
+
+def test_fails_over_to_the_master(monkeypatch):
+    collector = TrueNasCollector('a:443,b:443,c:443', 'u', 'p')
+    cluster(monkeypatch, {'b:443': ('BACKUP', 200, 200), 'c:443': ('MASTER', 200, 200)})
+    collector.trace_start = time.monotonic()
+    before = failovers._value.get()
+    traces = []
+    assert collector._request('alert/list', traces=traces) == [{'host': 'c:443'}]
+    assert collector.target == 'c:443'
+    assert [(trace['target'], trace['result']) for trace in traces] == \
+        [('a:443', 'connection error'), ('c:443', 'ok')]
+    assert failovers._value.get() == before + 1
+
+def test_current_master_kept_on_server_error(monkeypatch):
+    collector = TrueNasCollector('a:443,b:443', 'u', 'p')
+    calls = cluster(monkeypatch, {'a:443': ('MASTER', 200, 500), 'b:443': ('BACKUP', 200, 200)})
+    collector.trace_start = time.monotonic()
+    traces = []
+    assert collector._request('widget', traces=traces) == [{'host': 'a:443'}]
+    assert [trace['target'] for trace in traces] == ['a:443']
+    assert collector.target == 'a:443'
+    # Probed once per scrape
+    assert not collector._failover('a:443')
+    assert len([url for url in calls if url.endswith('/failover/status')]) == 2
+
+def test_any_answer_when_there_is_no_master(monkeypatch):
+    collector = TrueNasCollector('a:443,b:443', 'u', 'p')
+    cluster(monkeypatch, {'b:443': ('UNKNOWN', 401, 200)})
+    collector.trace_start = time.monotonic()
+    assert collector._failover('a:443')
+    assert collector.target == 'b:443'
+
+def test_rest_of_the_scrape_fails_fast_when_nothing_answers(monkeypatch):
+    collector = TrueNasCollector('a:443,b:443', 'u', 'p')
+    calls = cluster(monkeypatch, {})
+    collector.trace_start = time.monotonic()
+    assert collector.request('alert/list') == {}
+    probed = len(calls)
+    traces = []
+    assert collector._request('widget', traces=traces) == {}
+    assert traces[0]['result'] == 'unreachable'
+    assert len(calls) == probed
+    # A new scrape tries again
+    collector.trace_start = time.monotonic() + 1
+    collector.request('widget')
+    assert len(calls) > probed
+
+def test_probe(monkeypatch):
+    collector = TrueNasCollector('a:443,b:443', 'u', 'p')
+    cluster(monkeypatch, {'a:443': ('MASTER', 200, 200), 'b:443': ('BACKUP', 503, 200)})
+    assert collector._probe('a:443') == 'MASTER'
+    assert collector._probe('b:443') is None
+    assert collector._probe('c:443') is None
@@ -0,0 +1,59 @@
+from truenas_collector import JobTracker
+
+def job(id, state='SUCCESS', task=1, started=None, description=None):
+    return {
+        'id': id,
+        'method': 'rsynctask.run',
+        'arguments': [task],
+        'state': state,
+        'progress': {'percent': 100, 'description': description},
+        'time_started': {'$date': started if started is not None else 1000*id},
+        'time_finished': None
+    }
+
+def test_full_then_incremental_reads():
+    tracker = JobTracker(600)
+    assert tracker.params(0) is None
+    assert tracker.update([job(1), job(2, 'RUNNING')], True, 0) == {('rsynctask', 1)}
+    assert tracker.runs == {('rsynctask', 1): 1}
+    assert tracker.params(10) == {'id__gte': 2}
+
+    # The running job finishes and a new one fails
+    tracker.update([job(2, 'SUCCESS'), job(3, 'FAILED')], False, 10)
+    assert tracker.runs == {('rsynctask', 1): 3}
+    assert tracker.failures == {('rsynctask', 1): 1}
+    assert tracker.job('rsynctask', 1)['id'] == 3
+    assert tracker.params(20) == {'id__gte': 4}
+
+    # Nothing new: nothing counted again
+    tracker.update([], False, 20)
+    assert tracker.runs == {('rsynctask', 1): 3}
+
+def test_resync_does_not_count_again():
+    tracker = JobTracker(600)
+    tracker.update([job(1), job(2)], True, 0)
+    tracker.update([job(1), job(2), job(3)], True, 600)
+    assert tracker.runs == {('rsynctask', 1): 3}
+
+def test_missing_running_job_does_not_count_again():
+    # An incremental read that lacks a running job looks like a restart. The
+    # full read after it lists the same jobs, which were counted already.
+    tracker = JobTracker(600)
+    tracker.update([job(1), job(2, 'RUNNING')], True, 0)
+    tracker.update([job(1), job(3)], False, 10)
+    assert tracker.params(20) is None
+    tracker.update([job(1), job(2), job(3)], True, 20)
+    assert tracker.runs == {('rsynctask', 1): 3}
+
+def test_restart_counts_new_jobs_with_old_ids():
+    tracker = JobTracker(600)
+    tracker.update([job(1), job(2), job(3)], True, 0)
+    # Ids start over after a middleware restart, with new start times
+    tracker.update([job(1, started=10**7)], True, 600)
+    assert tracker.runs == {('rsynctask', 1): 4}
+    assert tracker.job('rsynctask', 1)['id'] == 1
+
+def test_transferred_bytes():
+    tracker = JobTracker(600)
+    tracker.update([job(1, description='Transferred: 1.5 GiB / 2 GiB, 75%')], True, 0)
+    assert tracker.transferred == {('rsynctask', 1): int(1.5*2**30)}
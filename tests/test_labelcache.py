@@ -0,0 +1,57 @@
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+from truenas_collector import TrueNasCollector, LabelCache, parse_records
+
+def test_labels_reused_until_the_object_changes():
+    cache = LabelCache(['name', 'serial'])
+    assert cache.get('sda', 'S1') is None
+    labels = cache.put('sda', 'S1', ['sda', 'S1'])
+    assert labels == {'name': 'sda', 'serial': 'S1'}
+    assert cache.get('sda', 'S1') is labels
+    # A swapped disk gets new labels
+    assert cache.get('sda', 'S2') is None
+    assert cache.put('sda', 'S2', ['sda', 'S2']) == {'name': 'sda', 'serial': 'S2'}
+
+def test_label_values_are_interned_strings():
+    cache = LabelCache(['name', 'size'])
+    (first, second) = (cache.put('a', None, [''.join(['po', 'ol']), 10]),
+                       cache.put('b', None, [''.join(['p', 'ool']), 10]))
+    assert first['name'] is second['name']
+    assert first['size'] == '10'
+
+def test_sweep_evicts_what_wasnt_seen():
+    cache = LabelCache(['name'])
+    for key in ['a', 'b']:
+        if cache.get(key) is None:
+            cache.put(key, None, [key])
+    cache.sweep()
+    assert cache.get('a') is not None
+    cache.sweep()
+    assert set(cache.entries) == {'a'}
+    cache.sweep()
+    assert cache.entries == {}
+
+def test_add_shares_the_label_dict():
+    labels = {'name': 'a'}
+    gauge = GaugeMetricFamily('truenas_test', 'test', labels=['name'])
+    counter = CounterMetricFamily('truenas_test_events', 'test', labels=['name'])
+    LabelCache.add(gauge, labels, 1)
+    LabelCache.add(counter, labels, 2)
+    assert gauge.samples[0].name == 'truenas_test'
+    assert counter.samples[0].name == 'truenas_test_events_total'
+    assert gauge.samples[0].labels is labels is counter.samples[0].labels
+
+def test_disks_labeled_once_between_scrapes(monkeypatch):
+    collector = TrueNasCollector('localhost:1', 'u', 'p')
+    inventory = [
+        {'name': 'sda', 'serial': 'S1', 'type': 'SSD', 'model': 'M', 'size': 1},
+        {'name': 'sdb', 'serial': 'S2', 'type': 'HDD', 'model': 'M', 'size': 2},
+    ]
+    monkeypatch.setattr(collector, 'request', lambda apipath: parse_records('disk', inventory))
+    first = {sample.labels['name']: sample.labels for sample in collector._collect_disks()[0].samples}
+    inventory[1] = dict(inventory[1], serial='S3')
+    second = {sample.labels['name']: sample.labels for sample in collector._collect_disks()[0].samples}
+    assert second['sda'] is first['sda']
+    assert second['sdb']['serial'] == 'S3'
+    del inventory[1]
+    collector._collect_disks()
+    assert set(collector.disk_labels.entries) == {'sda'}
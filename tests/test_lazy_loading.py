@@ -0,0 +1,34 @@
+import os, subprocess, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run(code):
+    return subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True,
+        capture_output=True, text=True).stdout
+
+def test_only_enabled_collectors_are_imported():
+    output = run('import truenas_collector, truenas_collectors, prometheus_client\n'
+        'print(sorted(module.__name__ for module in truenas_collectors.loaded()))\n'
+        'collector = truenas_collector.TrueNasCollector("localhost:1", "u", "p", collectors=["alerts", "disks"])\n'
+        'list(collector.collect())\n'
+        'print(sorted(module.__name__ for module in truenas_collectors.loaded()))\n'
+        'print(prometheus_client.generate_latest().decode())')
+    (before, after, metrics) = output.split('\n', 2)
+    assert before == '[]'
+    assert after == "['truenas_collectors.alerts', 'truenas_collectors.disks']"
+    assert 'truenas_exporter_disks_seconds' in metrics
+    assert 'truenas_exporter_stats_seconds' not in metrics
+
+def test_collectors_become_methods():
+    from truenas_collector import TrueNasCollector
+    import truenas_collectors
+    collector = TrueNasCollector('localhost:1', 'u', 'p')
+    method = collector._collect_disk_temperatures
+    assert method.__func__ is truenas_collectors.load('_collect_disks')._collect_disk_temperatures
+    assert TrueNasCollector._collect_disks.__module__ == 'truenas_collectors.disks'
+    try:
+        collector._collect_nothing
+    except AttributeError:
+        pass
+    else:
+        assert False
@@ -0,0 +1,98 @@
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing, os, signal, threading, time
+import pytest
+import truenas_workers
+from truenas_collector import RequestLimiter, SlotTimeout
+from truenas_workers import WorkerPool
+
+def test_health_jumps_ahead_of_queued_bulk():
+    limiter = RequestLimiter(1, 1)
+    order = []
+    def call(apipath, hold=0.02):
+        with limiter.slot(apipath):
+            order.append(apipath)
+            time.sleep(hold)
+
+    busy = threading.Thread(target=call, args=('disk', 0.3))
+    busy.start()
+    time.sleep(0.05)
+    # Queued while the only slot is taken: bulk first, health last
+    waiting = []
+    for apipath in ['stats/get_data', 'enclosure', 'interface', 'alert/list']:
+        waiting.append(threading.Thread(target=call, args=(apipath,)))
+        waiting[-1].start()
+        time.sleep(0.02)
+    for thread in [busy] + waiting:
+        thread.join()
+    # Calls of the same priority go in no particular order
+    assert order[:3] == ['disk', 'alert/list', 'interface']
+    assert sorted(order[3:]) == ['enclosure', 'stats/get_data']
+
+def test_bulk_limit():
+    limiter = RequestLimiter(3, 1)
+    most = [0]
+    def call(apipath):
+        with limiter.slot(apipath):
+            most[0] = max(most[0], limiter.counts[RequestLimiter.BULK])
+            time.sleep(0.02)
+    threads = [threading.Thread(target=call, args=('stats/get_data',)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert most[0] == 1
+
+def _worker(shared, process, in_flight, most):
+    limiter = RequestLimiter(2, 1, shared, process)
+    for i in range(3):
+        with limiter.slot('disk'):
+            with in_flight.get_lock():
+                in_flight.value += 1
+                most.value = max(most.value, in_flight.value)
+            time.sleep(0.02)
+            with in_flight.get_lock():
+                in_flight.value -= 1
+
+def test_limit_holds_across_processes():
+    shared = RequestLimiter.shared(4)
+    in_flight = multiprocessing.Value('i', 0)
+    most = multiprocessing.Value('i', 0)
+    processes = [multiprocessing.Process(target=_worker, args=(shared, i, in_flight, most)) for i in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert most.value == 2
+
+def test_waiting_is_bounded():
+    limiter = RequestLimiter(1, 1, timeout=0.1)
+    with limiter.slot('disk'):
+        with pytest.raises(SlotTimeout):
+            with limiter.slot('pool'):
+                pass
+    assert list(limiter.counts) == [0]*6
+    with limiter.slot('pool'):
+        pass
+
+def _hold_slot():
+    # In a worker: take the only slot and die without giving it back
+    with truenas_workers._collector.api_slot('disk'):
+        os.kill(os.getpid(), signal.SIGKILL)
+
+def test_killed_worker_gives_back_its_slot():
+    pool = WorkerPool(2, (), {'target': 'localhost:1', 'username': 'u', 'password': 'p',
+        'collectors': ['alerts', 'pool'], 'api_concurrency': 1})
+    try:
+        with pytest.raises(BrokenProcessPool):
+            pool.executors[0].submit(_hold_slot).result()
+        limiter = RequestLimiter(1, 1, pool.shared_limits['localhost:1'], 1, timeout=0.1)
+        with pytest.raises(SlotTimeout):
+            with limiter.slot('disk'):
+                pass
+        # The next call to the dead worker restarts it and frees its slot
+        assert pool._submit(0, os.getpid).result() != os.getpid()
+        with limiter.slot('disk'):
+            pass
+    finally:
+        for executor in pool.executors:
+            executor.shutdown()
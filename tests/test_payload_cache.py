@@ -0,0 +1,74 @@
+from prometheus_client import CollectorRegistry
+from prometheus_client.core import GaugeMetricFamily
+import gzip, time
+import pytest
+import truenas_exporter
+from truenas_exporter import PayloadCache, cached_metrics_app
+
+class Collections(object):
+    """ A collector counting how often it was asked """
+    def __init__(self):
+        self.count = 0
+    def collect(self):
+        self.count += 1
+        yield GaugeMetricFamily('truenas_collections', 'collections', value=self.count)
+
+@pytest.fixture
+def cache(monkeypatch):
+    registry = CollectorRegistry()
+    collections = Collections()
+    registry.register(collections)
+    monkeypatch.setattr(truenas_exporter, 'REGISTRY', registry)
+    monkeypatch.setattr(truenas_exporter, 'pool', None, raising=False)
+    monkeypatch.setattr(truenas_exporter, 'payload_cache', PayloadCache(60), raising=False)
+    clock = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: clock[0])
+    return (collections, clock)
+
+def scrape(**headers):
+    environ = {'HTTP_' + name.upper(): value for (name, value) in headers.items()}
+    response = {}
+    def start_fn(status, headers):
+        response['status'] = status
+        response['headers'] = dict(headers)
+    response['body'] = b''.join(cached_metrics_app(environ, start_fn))
+    return response
+
+def test_one_collection_per_ttl(cache):
+    (collections, clock) = cache
+    first = scrape()
+    assert b'truenas_collections 1.0' in first['body']
+    assert scrape() == first
+    assert scrape(accept_encoding='gzip')['status'] == '200 OK'
+    assert collections.count == 1
+    clock[0] += 60
+    assert b'truenas_collections 2.0' in scrape()['body']
+    assert collections.count == 2
+
+def test_gzip_is_the_same_payload(cache):
+    plain = scrape()
+    compressed = scrape(accept_encoding='gzip, deflate')
+    assert compressed['headers']['Content-Encoding'] == 'gzip'
+    assert 'Content-Encoding' not in plain['headers']
+    assert gzip.decompress(compressed['body']) == plain['body']
+    assert compressed['headers']['ETag'] == plain['headers']['ETag'][:-1] + '-gzip"'
+    assert plain['headers']['Vary'] == 'Accept, Accept-Encoding'
+
+def test_openmetrics_rendered_separately(cache):
+    plain = scrape()
+    openmetrics = scrape(accept='application/openmetrics-text; version=1.0.0')
+    assert openmetrics['headers']['Content-Type'].startswith('application/openmetrics-text')
+    assert openmetrics['body'].endswith(b'# EOF\n')
+    assert openmetrics['headers']['ETag'] != plain['headers']['ETag']
+
+def test_not_modified(cache):
+    (collections, clock) = cache
+    etag = scrape()['headers']['ETag']
+    unchanged = scrape(if_none_match=f'"other", {etag}')
+    assert unchanged['status'] == '304 Not Modified'
+    assert unchanged['body'] == b''
+    assert unchanged['headers']['ETag'] == etag
+    # The gzip rendering has its own tag
+    assert scrape(if_none_match=etag, accept_encoding='gzip')['status'] == '200 OK'
+    clock[0] += 60
+    assert scrape(if_none_match=etag)['status'] == '200 OK'
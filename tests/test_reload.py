@@ -0,0 +1,91 @@
+import os, queue, signal, socket, subprocess, sys, threading, time, urllib.request, urllib.error
+import pytest
+import truenas_mock
+from truenas_collector import TrueNasCollector, LabelCache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_reconfigure_keeps_warm_caches():
+    collector = TrueNasCollector('localhost:1', 'u', 'p', stats_rotate=1)
+    collector.disk_labels.put('sda', 'S1', ['sda', 'S1', 'SSD', 'M'])
+    collector.last_good['pool'] = (0, ['pool'])
+    collector.last_smart_result = {'sda': 'cached'}
+    assert collector.reconfigure(dict(collector.settings)) == []
+    assert collector.reconfigure({'stats_rotate': 3, 'cache_smart': 1}) == ['cache_smart', 'stats_rotate']
+    assert (collector.stats_rotate, collector.cache_smart) == (3, 3600)
+    assert 'sda' in collector.disk_labels.entries
+    assert collector.last_good == {'pool': (0, ['pool'])}
+    assert collector.last_smart_result == {'sda': 'cached'}
+
+def test_reconfigure_another_nas_starts_over():
+    collector = TrueNasCollector('localhost:1', 'u', 'p')
+    labels = collector.disk_labels
+    collector.last_good['pool'] = (0, ['pool'])
+    assert collector.reconfigure({'target': 'localhost:2'}) == ['target']
+    assert collector.target == 'localhost:2'
+    assert collector.last_good == {}
+    assert isinstance(collector.disk_labels, LabelCache) and collector.disk_labels is not labels
+
+@pytest.fixture
+def exporter(tmp_path):
+    server = truenas_mock.MockTrueNasServer(('localhost', 0), dict(pools=1, datasets=2, disks=2, filesystems=2,
+        interfaces=1, replications=1, rsynctasks=1, cloudsyncs=1, snapshottasks=1, snapshots=5, alerts=1,
+        enclosures=1, enclosure_elements=2))
+    server.socket = truenas_mock._self_signed_context().wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        port = s.getsockname()[1]
+    config = tmp_path / 'exporter.conf'
+    config.write_text(f'--target localhost:{server.server_address[1]}\n--port {port}\n' +
+        '--debug-allow 127.0.0.1\n--stats-rotate 1\n')
+    process = subprocess.Popen([sys.executable, 'truenas_exporter.py', '--config', str(config)],
+        cwd=ROOT, env=dict(os.environ, TRUENAS_USER='root', TRUENAS_PASS='x'),
+        stderr=subprocess.PIPE, text=True)
+    lines = queue.Queue()
+    threading.Thread(target=lambda: [lines.put(line) for line in process.stderr], daemon=True).start()
+    def wait_for(text):
+        while True:
+            line = lines.get(timeout=10)
+            if text in line:
+                return line.strip()
+    wait_for('Starting listening')
+    # That's printed just before the server binds its port
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            break
+        except ConnectionRefusedError:
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+    yield (process, config, port, wait_for)
+    process.kill()
+    process.wait()
+    server.shutdown()
+
+def post_reload(port):
+    request = urllib.request.Request(f'http://127.0.0.1:{port}/-/reload', method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def test_sighup_reloads(exporter):
+    (process, config, port, wait_for) = exporter
+    config.write_text(config.read_text().replace('--stats-rotate 1', '--stats-rotate 4'))
+    process.send_signal(signal.SIGHUP)
+    assert wait_for('Reloaded configuration') == 'Reloaded configuration, changed: stats_rotate'
+
+def test_reload_endpoint(exporter):
+    (process, config, port, wait_for) = exporter
+    assert post_reload(port) == 200
+    assert wait_for('Reloaded configuration') == 'Reloaded configuration, changed: nothing'
+    good = config.read_text()
+    config.write_text(good + '--limit nonsense=1\n')
+    assert post_reload(port) == 400
+    wait_for('Reload failed, keeping the current configuration')
+    config.write_text(good.replace(f'--port {port}', f'--port {port + 1}'))
+    assert post_reload(port) == 200
+    wait_for('Changing --port needs a restart')
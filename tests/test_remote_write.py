@@ -0,0 +1,85 @@
+from prometheus_client.core import GaugeMetricFamily
+import pytest
+import truenas_remote_write
+from truenas_remote_write import RemoteWriter, decode_write_request, snappy_decode
+
+class Response(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = ''
+
+class Receiver(object):
+    """ Stands in for the writer's requests session """
+    def __init__(self):
+        self.status = 200
+        self.received = []
+
+    def post(self, url, data, timeout):
+        if self.status is None:
+            raise truenas_remote_write.requests.exceptions.ConnectionError('down')
+        if self.status < 300:
+            self.received.extend(decode_write_request(snappy_decode(data)))
+        return Response(self.status)
+
+def writer(values, **kwargs):
+    def collect():
+        family = GaugeMetricFamily('truenas_test', 'Test', labels=['name'])
+        for name, value in values.items():
+            family.add_metric([name], value)
+        return [family]
+    writer = RemoteWriter('http://receiver/write', collect, retries=0, **kwargs)
+    writer.session = Receiver()
+    return writer
+
+def received(writer):
+    names = sorted(labels['name'] for (labels, samples) in writer.session.received)
+    writer.session.received = []
+    return names
+
+@pytest.fixture(autouse=True)
+def literal_snappy(monkeypatch):
+    # The receiver decodes with snappy_decode, so send what it can read
+    monkeypatch.setattr(truenas_remote_write, 'snappy_compress', None)
+
+def test_unchanged_series_are_not_sent_again():
+    values = {'a': 1, 'b': 2}
+    push = writer(values)
+    push.push()
+    assert received(push) == ['a', 'b']
+    values['b'] = 3
+    push.push()
+    assert received(push) == ['b']
+
+def test_failed_batches_are_sent_again():
+    push = writer({'a': 1, 'b': 2})
+    push.session.status = None
+    push.push()
+    push.session.status = 200
+    push.push()
+    assert received(push) == ['a', 'b']
+
+def test_rejected_batches_are_sent_again():
+    push = writer({'a': 1, 'b': 2})
+    push.session.status = 400
+    push.push()
+    push.session.status = 200
+    push.push()
+    assert received(push) == ['a', 'b']
+
+def test_buffered_batches_count_as_sent(tmp_path):
+    push = writer({'a': 1, 'b': 2}, buffer_dir=str(tmp_path))
+    push.session.status = None
+    push.push()
+    push.session.status = 200
+    push.push()
+    # From the buffer only
+    assert received(push) == ['a', 'b']
+
+def test_evicted_batches_are_sent_again(tmp_path):
+    push = writer({'a': 1, 'b': 2}, batch=1, buffer_dir=str(tmp_path), buffer_max=1)
+    push.session.status = None
+    push.push()
+    push.session.status = 200
+    push.push()
+    # 'a' was evicted from the buffer to make room for 'b'
+    assert received(push) == ['a', 'b']
@@ -0,0 +1,95 @@
+import random
+import pytest
+from truenas_remote_write import (encode_labels, encode_write_request, decode_write_request,
+    snappy_literal, snappy_decode, _varint, _read_varint)
+
+SERIES = [
+    ({'__name__': 'truenas_test', 'name': 'a'}, 1.5, 1700000000000),
+    ({'__name__': 'truenas_test', 'name': 'ünïcode'}, -0.25, 1),
+    ({'__name__': 'up'}, float('inf'), 0),
+]
+
+def encode(series):
+    return encode_write_request([(encode_labels(labels), value, timestamp)
+        for (labels, value, timestamp) in series])
+
+def test_golden_write_request():
+    # What google.protobuf serializes for the same WriteRequest
+    assert encode([({'job': 'x', '__name__': 'up'}, 1.0, 1000)]).hex() == (
+        '0a28'                                          # TimeSeries, 40 bytes
+        '0a0e' '0a085f5f6e616d655f5f' '12027570'        # Label __name__=up
+        '0a08' '0a036a6f62' '120178'                    # Label job=x
+        '120c' '09000000000000f03f' '10e807')           # Sample 1.0 @ 1000
+
+@pytest.mark.parametrize('value', [0, 1, 127, 128, 300, 2**32, 2**63 - 1])
+def test_varint_round_trip(value):
+    assert _read_varint(_varint(value), 0) == (value, len(_varint(value)))
+
+def test_write_request_round_trip():
+    assert decode_write_request(encode(SERIES)) == [
+        (labels, [(value, timestamp)]) for (labels, value, timestamp) in SERIES]
+
+@pytest.mark.parametrize('size', [0, 1, 59, 60, 61, 255, 256, 257, 65536, 65537, 200000])
+def test_snappy_literal_round_trip(size):
+    data = random.Random(size).randbytes(size)
+    assert snappy_decode(snappy_literal(data)) == data
+
+def test_snappy_decode_copies():
+    # "abcd" as a literal, then a 1-byte-offset copy of 8 bytes at distance
+    # 4 and a 2-byte-offset copy of 4 bytes at distance 2, overlapping
+    data = bytes([16, 3 << 2]) + b'abcd' + bytes([1 | (8 - 4) << 2, 4]) + bytes([2 | 3 << 2, 2, 0])
+    assert snappy_decode(data) == b'abcdabcdabcdcdcd'
+
+def reference_snappy():
+    try:
+        import snappy
+        return (snappy.compress, snappy.uncompress)
+    except ImportError:
+        cramjam = pytest.importorskip('cramjam')
+        return (lambda data: bytes(cramjam.snappy.compress_raw(data)),
+            lambda data: bytes(cramjam.snappy.decompress_raw(data)))
+
+@pytest.mark.parametrize('size', [0, 100, 65536, 200000])
+def test_snappy_against_reference(size):
+    (compress, decompress) = reference_snappy()
+    data = encode(SERIES)*(size//len(encode(SERIES)) + 1)
+    assert decompress(snappy_literal(data)) == data
+    # Real compression, with copies, decoded by snappy_decode
+    assert snappy_decode(compress(data)) == data
+
+def reference_write_request():
+    """ prometheus.WriteRequest built from a descriptor, without generated code """
+    pytest.importorskip('google.protobuf')
+    from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+    proto = descriptor_pb2.FileDescriptorProto(name='remote.proto', package='prometheus', syntax='proto3')
+    T = descriptor_pb2.FieldDescriptorProto
+    def message(name, *fields):
+        message = proto.message_type.add(name=name)
+        for (number, field, kind, type_name, repeated) in fields:
+            message.field.add(name=field, number=number, type=kind, type_name=type_name,
+                label=T.LABEL_REPEATED if repeated else T.LABEL_OPTIONAL)
+    message('Label', (1, 'name', T.TYPE_STRING, None, False), (2, 'value', T.TYPE_STRING, None, False))
+    message('Sample', (1, 'value', T.TYPE_DOUBLE, None, False), (2, 'timestamp', T.TYPE_INT64, None, False))
+    message('TimeSeries', (1, 'labels', T.TYPE_MESSAGE, '.prometheus.Label', True),
+        (2, 'samples', T.TYPE_MESSAGE, '.prometheus.Sample', True))
+    message('WriteRequest', (1, 'timeseries', T.TYPE_MESSAGE, '.prometheus.TimeSeries', True))
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(proto)
+    return message_factory.GetMessageClass(pool.FindMessageTypeByName('prometheus.WriteRequest'))
+
+def test_write_request_against_reference():
+    WriteRequest = reference_write_request()
+    request = WriteRequest.FromString(encode(SERIES))
+    assert [({label.name: label.value for label in timeseries.labels},
+            [(sample.value, sample.timestamp) for sample in timeseries.samples])
+        for timeseries in request.timeseries] == decode_write_request(encode(SERIES))
+    # Labels sorted by name, as receivers expect
+    assert [label.name for label in request.timeseries[0].labels] == ['__name__', 'name']
+
+    # And the other way around
+    request = WriteRequest()
+    timeseries = request.timeseries.add()
+    timeseries.labels.add(name='__name__', value='up')
+    timeseries.samples.add(value=2.5, timestamp=1700000000000)
+    assert decode_write_request(request.SerializeToString()) == [({'__name__': 'up'}, [(2.5, 1700000000000)])]
+    assert request.SerializeToString() == encode([({'__name__': 'up'}, 2.5, 1700000000000)])
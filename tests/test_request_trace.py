@@ -0,0 +1,34 @@
+import truenas_collector
+from truenas_collector import TrueNasCollector, ScrapeContext
+
+class Response(object):
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+def test_each_call_gets_its_own_trace(monkeypatch):
+    collector = TrueNasCollector('localhost:1', 'u', 'p')
+    def get(url, **kwargs):
+        # Another request finishing meanwhile, like a prefetch
+        collector.scrape_trace.append({'path': 'other', 'bytes': 1, 'result': 'timeout'})
+        return Response(200, b'[1, 2, 3]')
+    monkeypatch.setattr(truenas_collector.requests, 'get', get)
+
+    (result, trace) = collector.request_traced('zfs/snapshot', params={'offset': 0})
+    assert result == [1, 2, 3]
+    assert collector.scrape_trace[-1]['path'] == 'other'
+    assert (trace['path'], trace['bytes'], trace['result']) == ('zfs/snapshot', 9, 'ok')
+
+def test_memo_hits_share_the_trace(monkeypatch):
+    collector = TrueNasCollector('localhost:1', 'u', 'p')
+    calls = []
+    def get(url, **kwargs):
+        calls.append(url)
+        return Response(200, b'{"a": 1}')
+    monkeypatch.setattr(truenas_collector.requests, 'get', get)
+
+    collector.scrape = ScrapeContext()
+    first = collector.request_traced('system/info')
+    assert collector.request('system/info') == {'a': 1}
+    assert collector.request_traced('system/info')[1] is first[1]
+    assert len(calls) == 1
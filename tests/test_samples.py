@@ -0,0 +1,31 @@
+from types import SimpleNamespace
+from truenas_collectors.samples import HotSampler, RingBuffer
+
+KEY = ('aggregation-cpu-average', 'cpu-user', 'value')
+
+def sampler(interval=10):
+    sampler = HotSampler(SimpleNamespace(sample_interval=interval))
+    sampler.buffers = {KEY: RingBuffer(5)}
+    for (timestamp, value) in [(100, 1.0), (110, 5.0), (120, 2.0), (130, 3.0)]:
+        sampler.buffers[KEY].append(timestamp, value)
+    return sampler
+
+def test_window_is_the_same_for_every_reader():
+    hot = sampler()
+    assert hot.window(25, now=135) == [(KEY, [2.0, 3.0])]
+    # A second scraper, or /debug/profile, doesn't take samples away
+    assert hot.window(25, now=135) == [(KEY, [2.0, 3.0])]
+    assert hot.window(60, now=135) == [(KEY, [1.0, 5.0, 2.0, 3.0])]
+
+def test_window_only_has_what_the_buffer_kept():
+    hot = sampler()
+    for (timestamp, value) in [(140, 4.0), (150, 6.0)]:
+        hot.buffers[KEY].append(timestamp, value)
+    assert hot.window(1000, now=150) == [(KEY, [5.0, 2.0, 3.0, 4.0, 6.0])]
+
+def test_interval_is_at_least_collectds_step(capsys):
+    assert sampler(30).interval() == 30
+    hot = sampler(1)
+    assert hot.interval() == 10
+    assert hot.interval() == 10
+    assert capsys.readouterr().err.count('below collectd') == 1
@@ -0,0 +1,103 @@
+import json, threading
+import truenas_collector
+from truenas_collector import TrueNasCollector, ScrapeContext, memo_hits
+
+class Response(object):
+    status_code = 200
+    def __init__(self, content):
+        self.content = content
+
+def api(monkeypatch, release=None):
+    """ requests.get/post answering every call with its own number """
+    calls = []
+    def get(url, params=None, **kwargs):
+        calls.append(url.split('/api/v2.0/')[1])
+        if release is not None:
+            release.wait(5)
+        return Response(json.dumps([{'call': len(calls)}]).encode())
+    monkeypatch.setattr(truenas_collector.requests, 'get', get)
+    monkeypatch.setattr(truenas_collector.requests, 'post', get)
+    return calls
+
+def test_same_get_answered_once_per_scrape(monkeypatch):
+    collector = TrueNasCollector('localhost:1', 'u', 'p')
+    calls = api(monkeypatch)
+    hits = memo_hits.labels('widget')._value.get()
+    collector.scrape = ScrapeContext()
+    first = collector.request('widget')
+    assert collector.request('widget') is first
+    assert memo_hits.labels('widget')._value.get() == hits + 1
+    # Another query or a POST is another call
+    collector.request('widget', params={'limit': 1})
+    collector.request('widget', data={'x': 1})
+    collector.request('widget', data={'x': 1})
+    assert calls == ['widget']*4
+    # Nothing is shared with the next scrape
+    collector.scrape = ScrapeContext()
+    assert collector.request('widget') == [{'call': 5}]
+
+def test_concurrent_callers_wait_for_the_first(monkeypatch):
+    collector = TrueNasCollector('localhost:1', 'u', 'p')
+    release = threading.Event()
+    calls = api(monkeypatch, release)
+    collector.scrape = ScrapeContext()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(collector.request('widget'))) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == ['widget']
+    assert results == [[{'call': 1}]]*4
+
+def test_prefetch_isnt_a_memo_hit(monkeypatch):
+    collector = TrueNasCollector('localhost:1', 'u', 'p')
+    release = threading.Event()
+    calls = api(monkeypatch, release)
+    hits = memo_hits.labels('widget')._value.get()
+    collector.scrape = ScrapeContext()
+    collector.prefetch(['widget'])
+    release.set()
+    assert collector.request('widget') == [{'call': 1}]
+    assert memo_hits.labels('widget')._value.get() == hits
+    collector.request('widget')
+    assert memo_hits.labels('widget')._value.get() == hits + 1
+    assert calls == ['widget']
+
+def test_prefetch_outside_a_scrape_does_nothing(monkeypatch):
+    collector = TrueNasCollector('localhost:1', 'u', 'p')
+    calls = api(monkeypatch)
+    collector.prefetch(['widget'])
+    assert calls == []
+
+def test_disk_index_built_once_per_scrape(monkeypatch):
+    collector = TrueNasCollector('localhost:1', 'u', 'p')
+    inventory = [[{'name': 'sda', 'serial': 'S1', 'type': 'SSD', 'model': 'M', 'size': 1}], {}]
+    calls = []
+    def request(apipath, data=None, params=None):
+        calls.append(apipath)
+        return truenas_collector.parse_records('disk', inventory.pop(0))
+    monkeypatch.setattr(collector, 'request', request)
+    collector.scrape = ScrapeContext()
+    index = collector.disk_index()
+    assert collector.disk_index() is index
+    assert list(index) == ['sda'] and index['sda'].serial == 'S1'
+    assert calls == ['disk']
+    # A failed disk call in the next scrape keeps the last inventory
+    collector.scrape = ScrapeContext()
+    assert collector.disk_index() is index
+
+def test_failed_index_build_is_shared():
+    context = ScrapeContext()
+    builds = []
+    def build():
+        builds.append(1)
+        raise ValueError
+    for i in range(2):
+        try:
+            context.index('disks', build)
+        except ValueError:
+            pass
+    assert builds == [1]
+    assert context.index('disks', dict) == {}
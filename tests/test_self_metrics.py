@@ -0,0 +1,56 @@
+import builtins, gc, threading
+import truenas_collector
+from truenas_collector import TrueNasCollector, ScrapeContext, peak_rss
+
+class Response(object):
+    status_code = 200
+    def __init__(self, content):
+        self.content = content
+
+def test_gc_callback_installed_once_by_the_collector():
+    gc.callbacks[:] = [callback for callback in gc.callbacks if callback is not truenas_collector._gc_callback]
+    TrueNasCollector('localhost:1', 'u', 'p')
+    TrueNasCollector('localhost:1', 'u', 'p')
+    assert gc.callbacks.count(truenas_collector._gc_callback) == 1
+
+def test_peak_rss_only_reads(monkeypatch):
+    opened = []
+    real_open = builtins.open
+    def recording_open(path, mode='r', *args, **kwargs):
+        opened.append((path, mode))
+        return real_open(path, mode, *args, **kwargs)
+    monkeypatch.setattr(builtins, 'open', recording_open)
+    first = peak_rss()
+    assert first > 0
+    assert peak_rss() >= first
+    assert all(mode == 'r' for (path, mode) in opened)
+
+def test_prefetched_bytes_count_for_the_collector_that_asked(monkeypatch):
+    collector = TrueNasCollector('localhost:1', 'u', 'p')
+    release = threading.Event()
+    def get(url, **kwargs):
+        if url.endswith('/slow'):
+            release.wait(5)
+            return Response(b'[' + b'1, '*100 + b'1]')
+        return Response(b'[1]')
+    monkeypatch.setattr(truenas_collector.requests, 'get', get)
+
+    collector.scrape = ScrapeContext()
+    collector.trace_collection = '_collect_a'
+    collector.prefetch(['slow'])
+    # The next collector runs while the prefetch is still in flight
+    collector.trace_collection = '_collect_b'
+    collector.request('fast')
+    release.set()
+    collector.trace_collection = '_collect_a'
+    collector.request('slow')
+    assert collector.usage['_collect_a'][2] == 303
+    assert collector.usage['_collect_b'][2] == 3
+
+def test_scrape_rss():
+    collector = TrueNasCollector('localhost:1', 'u', 'p', collectors=['alerts'])
+    collector.scrape_rss = 1
+    families = {family.name: family for family in collector._collect_self()}
+    assert families['truenas_exporter_scrape_rss_bytes'].samples[0].value > 1
+    assert families['truenas_exporter_peak_rss_bytes'].samples[0].value >= \
+        families['truenas_exporter_scrape_rss_bytes'].samples[0].value
@@ -0,0 +1,57 @@
+import pytest
+from truenas_collector import StatsFilter
+
+def test_no_rules_keeps_everything():
+    stats_filter = StatsFilter()
+    assert not stats_filter
+    assert stats_filter.family('interface-ix0') == 'interface'
+    assert stats_filter.keep('interface-ix0', 'if_octets')
+
+def test_df_only_with_a_rule():
+    assert StatsFilter().family('df-mnt-tank') is None
+    assert not StatsFilter().keep('df-mnt-tank', 'df_complex-free')
+    assert not StatsFilter(['interface=ix0']).keep('df-mnt-tank', 'df_complex-free')
+    assert StatsFilter(['df=.']).family('df-mnt-tank') == 'df'
+    assert StatsFilter([], ['df=home']).family('df-mnt-tank') == 'df'
+    assert StatsFilter([], ['df/df_complex-reserved']).keep('df-mnt-tank', 'df_complex-free')
+
+def test_source_include_and_exclude():
+    stats_filter = StatsFilter(['df=^df-mnt-tank'], ['df=-home$'])
+    assert stats_filter
+    assert stats_filter.family('df-mnt-tank-data') == 'df'
+    assert stats_filter.family('df-mnt-tank-home') is None
+    assert stats_filter.family('df-mnt-scratch') is None
+    # Other families aren't affected
+    assert stats_filter.family('interface-ix0') == 'interface'
+    assert stats_filter.keep('interface-ix0', 'if_octets')
+    assert not stats_filter.keep('df-mnt-scratch', 'df_complex-free')
+
+def test_metric_rules_match_the_whole_type():
+    stats_filter = StatsFilter(['geom/geom_busy_percent-.*'], ['interface/if_errors'])
+    assert stats_filter.keep('geom_stat-da0', 'geom_busy_percent-da0')
+    assert not stats_filter.keep('geom_stat-da0', 'geom_ops_rwd-da0')
+    # fullmatch, not search
+    assert not stats_filter.keep('geom_stat-da0', 'x_geom_busy_percent-da0')
+    assert stats_filter.keep('interface-ix0', 'if_octets')
+    assert not stats_filter.keep('interface-ix0', 'if_errors')
+
+def test_several_includes_for_a_family():
+    stats_filter = StatsFilter(['interface=ix0', 'interface=ix1'])
+    assert stats_filter.family('interface-ix0') == 'interface'
+    assert stats_filter.family('interface-ix1') == 'interface'
+    assert stats_filter.family('interface-lo0') is None
+
+def test_unknown_sources_are_kept():
+    stats_filter = StatsFilter(['cpu=cpu-0'])
+    assert stats_filter.family('newthing-0') is None
+    assert stats_filter.keep('newthing-0', 'gauge')
+
+def test_verdicts_are_remembered():
+    stats_filter = StatsFilter(['df=tank'])
+    assert stats_filter.family('df-mnt-tank') == 'df'
+    assert stats_filter.sources == {'df-mnt-tank': 'df'}
+
+@pytest.mark.parametrize('rule', ['nosuchfamily=x', 'df', 'df/x=y', 'df=('])
+def test_invalid_rules(rule):
+    with pytest.raises(ValueError):
+        StatsFilter([rule])
@@ -0,0 +1,60 @@
+import time
+from prometheus_client.core import GaugeMetricFamily
+from truenas_collector import TrueNasCollector
+
+def throttled(**kwargs):
+    return TrueNasCollector('localhost:1', 'u', 'p', throttle=True, throttle_max_interval=300, **kwargs)
+
+def test_interval_grows_with_pressure():
+    collector = throttled()
+    collector.cores = 4
+    for (load, interval) in [(2, 0), (4, 0), (6, 150), (8, 300), (20, 300)]:
+        collector.load_average = load
+        collector._throttle_update()
+        assert collector.throttle_intervals == {
+            '_collect_pool_datasets': interval,
+            '_collect_stats': interval,
+        }
+
+def test_slowest_signal_wins():
+    collector = throttled(throttle_latency=2.0)
+    collector.cores = 4
+    collector.load_average = 2
+    collector.api_latency = 3
+    collector._throttle_update()
+    assert collector.throttle_pressure == {'load': 0.5, 'latency': 1.5}
+    assert collector.throttle_intervals['_collect_stats'] == 150
+
+def test_previous_metrics_served_while_stretched():
+    collector = throttled(collectors=['pool_datasets'])
+    runs = []
+    def collect_pool_datasets():
+        runs.append(1)
+        return [GaugeMetricFamily('truenas_dataset_runs', 'runs', value=len(runs))]
+    collector._collect_pool_datasets = collect_pool_datasets
+
+    def scrape():
+        return [metric for metric in collector.collect() if metric.name == 'truenas_dataset_runs'][0].samples[0].value
+    collector.api_latency = 4
+    assert scrape() == 1
+    assert scrape() == 1
+    assert len(runs) == 1
+    # Back under the threshold, every scrape refreshes again
+    collector.api_latency = 1
+    assert scrape() == 2
+    assert scrape() == 3
+
+def test_stats_keeps_probing_load_while_stretched(monkeypatch):
+    collector = throttled()
+    probes = []
+    monkeypatch.setattr(collector, '_throttle_probe_load', lambda: probes.append(1))
+    collector.throttle_intervals = {'_collect_stats': 300, '_collect_pool_datasets': 300}
+    assert not collector._throttled('_collect_stats')
+    collector.throttle_cache['_collect_stats'] = (0, [])
+    collector.throttle_cache['_collect_pool_datasets'] = (0, [])
+    monkeypatch.setattr(time, 'monotonic', lambda: 100)
+    assert collector._throttled('_collect_stats')
+    assert collector._throttled('_collect_pool_datasets')
+    assert probes == [1]
+    monkeypatch.setattr(time, 'monotonic', lambda: 300)
+    assert not collector._throttled('_collect_stats')
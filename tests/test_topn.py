@@ -0,0 +1,50 @@
+import operator
+from truenas_collector import TopN
+from truenas_collectors.enclosure import ENCLOSURE_SEVERITY, _worst_status
+
+OTHER = {'name': 'other'}
+
+def series(top):
+    return list(top.series('test', OTHER))
+
+def test_keeps_the_highest_ranked_in_response_order():
+    top = TopN(2, [operator.add])
+    for rank, name in [(5, 'a'), (9, 'b'), (1, 'c'), (7, 'd')]:
+        top.offer(rank, {'name': name}, (rank,))
+    assert series(top) == [({'name': 'b'}, (9,)), ({'name': 'd'}, (7,)), (OTHER, [6])]
+    assert top.dropped == 2
+
+def test_no_other_under_the_limit():
+    top = TopN(3, [operator.add])
+    top.offer(1, {'name': 'a'}, (1,))
+    assert series(top) == [({'name': 'a'}, (1,))]
+
+def test_ties_go_to_the_earlier_object():
+    top = TopN(1, [operator.add])
+    top.offer(1, {'name': 'a'}, (1,))
+    top.offer(1, {'name': 'b'}, (2,))
+    assert series(top) == [({'name': 'a'}, (1,)), (OTHER, [2])]
+
+def test_fold_skips_strings_and_none():
+    top = TopN(1, [max, max])
+    top.offer(9, {'name': 'kept'}, (1, 1.0))
+    top.offer(1, {'name': 'a'}, (2, 'OK'))
+    top.offer(1, {'name': 'b'}, (3, None))
+    top.offer(1, {'name': 'c'}, (1, 12.5))
+    top.offer(1, {'name': 'd'}, (1, 'Critical'))
+    assert series(top)[-1] == (OTHER, [3, 12.5])
+
+def test_fold_without_a_combine_function():
+    top = TopN(1, [operator.add, None])
+    top.offer(9, {'name': 'kept'}, (1, 4000.0))
+    top.offer(1, {'name': 'a'}, (2, 25.0))
+    top.offer(1, {'name': 'b'}, (3, 12.1))
+    assert series(top)[-1] == (OTHER, [5, None])
+    assert top.dropped == 4
+
+def test_enclosure_status_severity():
+    # Critical beats Not Installed, Swapped even though its code is lower
+    assert _worst_status(3, 5) == 3
+    assert _worst_status(1, 5) == 5
+    assert _worst_status(2, 4) == 4
+    assert sorted(ENCLOSURE_SEVERITY) == list(range(6))
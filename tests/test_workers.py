@@ -0,0 +1,20 @@
+from truenas_workers import assign_collections, AFFINITY
+
+def test_every_enabled_collector_is_assigned():
+    for workers in [1, 2, 3, 8]:
+        groups = assign_collections(workers)
+        assigned = [collection for group in groups for collection in group]
+        assert len(assigned) == len(set(assigned))
+        assert 'system_info' in ' '.join(assigned)
+        for collection, partner in AFFINITY.items():
+            assert any(collection in group and partner in group for group in groups)
+
+def test_affinity_collector_without_its_partner():
+    assert sorted(map(sorted, assign_collections(2, ['system_info', 'alerts']))) == \
+        [['_collect_alerts'], ['_collect_system_info']]
+    groups = assign_collections(2, ['rsynctask', 'cloudsync', 'disk_temperatures'])
+    assert sorted(collection for group in groups for collection in group) == \
+        ['_collect_cloudsync', '_collect_disk_temperatures', '_collect_rsynctask']
+
+def test_disabled_affinity_collector_stays_out():
+    assert assign_collections(2, ['stats']) == [['_collect_stats']]
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+# Micro-benchmarks for the exporter's hot paths, run against fixtures generated
+# by truenas_mock.py instead of a real TrueNAS. Each benchmark is a subcommand,
+# see --help.
+
+from prometheus_client.core import GaugeMetricFamily
+import argparse, contextlib, gc, json, os, random, subprocess, sys, time, tracemalloc
+import requests
+import truenas_collectors
+from truenas_collector import TrueNasCollector, JSON_DECODERS, RECORDS, parse_records
+from truenas_mock import make_payloads, stats_data
+
+SCALE = {
+    'pools': 4,
+    'datasets': 200,
+    'disks': 96,
+    'filesystems': 200,
+    'interfaces': 4,
+    'replications': 50,
+    'rsynctasks': 5,
+    'cloudsyncs': 5,
+    'snapshottasks': 50,
+    'alerts': 10,
+    'enclosures': 4,
+    'enclosure_elements': 24
+}
+
+class FixtureCollector(TrueNasCollector):
+    """ TrueNasCollector answering requests from generated payloads """
+
+    def __init__(self, payloads, **kwargs):
+        super().__init__('fixture', 'root', 'fixture', **kwargs)
+        self.payloads = payloads
+
+    def request_traced(self, apipath, data=None, params=None):
+        payload = self.payloads.get(apipath, {})
+        # The same incremental job query truenas_mock.py answers
+        if apipath == 'core/get_jobs' and params:
+            payload = [job for job in payload if job['id'] >= params.get('id__gte', 0)]
+        trace = {'path': apipath, 'status': 200, 'bytes': 0, 'result': 'ok'}
+        return (parse_records(apipath, payload), trace)
+
+def measure(name, fn, repeat):
+    """ Run fn repeat times and print time, allocation and GC figures """
+
+    # Time is measured without tracemalloc, which slows everything down a lot.
+    gc.collect()
+    collections = sum(stat['collections'] for stat in gc.get_stats())
+    start = time.perf_counter()
+    for i in range(repeat):
+        result = fn()
+    seconds = (time.perf_counter() - start)/repeat
+    collections = sum(stat['collections'] for stat in gc.get_stats()) - collections
+    del result
+
+    gc.collect()
+    tracemalloc.start()
+    result = fn()
+    (current, peak) = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count for stat in snapshot.statistics('filename'))
+    del result
+
+    print(f'{name:<32} {1000*seconds:9.2f} ms  {current/1048576:8.2f} MiB held  ' +
+        f'{peak/1048576:8.2f} MiB peak  {blocks:9d} blocks  {collections/repeat:6.1f} GCs')
+
+def _baseline_pool_datasets(datasets):
+    """ _collect_pool_datasets as it was before LabelCache, for comparison """
+    families = [GaugeMetricFamily(name, name, labels=["name", "pool", "type"])
+        for name in ['size', 'used', 'children', 'encrypted', 'locked']]
+    (size, used, children, encrypted, locked) = families
+    for dataset in datasets:
+        size.add_metric([dataset['name'], dataset['pool'], dataset['type']], dataset['available']['parsed'])
+        used.add_metric([dataset['name'], dataset['pool'], dataset['type']], dataset['used']['parsed'])
+        children.add_metric([dataset['name'], dataset['pool'], dataset['type']], len(dataset['children']))
+        encrypted.add_metric([dataset['name'], dataset['pool'], dataset['type']], int(dataset['encrypted']))
+        locked.add_metric([dataset['name'], dataset['pool'], dataset['type']], int(dataset['locked']))
+    return families
+
+def bench_labels(args):
+    """ Label set reuse in _collect_pool_datasets """
+    scale = dict(SCALE, datasets=args.datasets)
+    payloads = make_payloads(scale)
+    print(f'{args.datasets} datasets, {args.repeat} runs each')
+
+    measure('add_metric() per sample', lambda: _baseline_pool_datasets(payloads['pool/dataset']), args.repeat)
+
+    def cold():
+        collector = FixtureCollector(payloads)
+        return collector._collect_pool_datasets()
+    measure('LabelCache, cold', cold, args.repeat)
+
+    collector = FixtureCollector(payloads)
+    collector._collect_pool_datasets()
+    measure('LabelCache, warm', collector._collect_pool_datasets, args.repeat)
+
+def _fixtures(args):
+    """ Response bodies per endpoint, recorded or generated """
+
+    # A recorded fixture is the raw body of an API response saved as a .json
+    # file in a directory, e.g. with
+    #   curl -k -u root:... https://truenas/api/v2.0/pool/dataset > pool_dataset.json
+    bodies = {}
+    if args.fixtures:
+        for filename in sorted(os.listdir(args.fixtures)):
+            if filename.endswith('.json'):
+                with open(os.path.join(args.fixtures, filename), 'rb') as fixture:
+                    bodies[filename[:-5]] = fixture.read()
+        return bodies
+
+    scale = dict(SCALE, datasets=args.datasets, filesystems=args.filesystems)
+    payloads = make_payloads(scale)
+    for apipath, payload in payloads.items():
+        bodies[apipath] = json.dumps(payload).encode()
+
+    # The stats request for these sources, as _collect_stats builds it
+    class StatsCollector(FixtureCollector):
+        def _stats_request(self, sources_request):
+            self.sources_request = sources_request
+            return {'data': []}
+    collector = StatsCollector(payloads, skip_df_regex='^$')
+    with contextlib.redirect_stderr(open(os.devnull, 'w')):
+        collector._collect_stats()
+    bodies['stats/get_data'] = json.dumps(stats_data(collector.sources_request, random.Random(0))).encode()
+    return bodies
+
+def bench_decode(args):
+    """ JSON decode time per endpoint for each available decoder """
+    bodies = _fixtures(args)
+
+    def requests_json(body):
+        # What request() used to do: let requests build a str and decode it
+        response = requests.models.Response()
+        response._content = body
+        response.headers['Content-Type'] = 'application/json'
+        return response.json()
+    decoders = {'r.json()': requests_json}
+    decoders.update(JSON_DECODERS)
+
+    def without_gc(decode):
+        def decode_without_gc(body):
+            gc.disable()
+            try:
+                return decode(body)
+            finally:
+                gc.enable()
+        return decode_without_gc
+    decoders[next(iter(JSON_DECODERS)) + ' -gc'] = without_gc(next(iter(JSON_DECODERS.values())))
+
+    print(f'{"endpoint":<24} {"size":>10} ' + ' '.join(f'{name:>10}' for name in decoders))
+    totals = dict.fromkeys(decoders, 0)
+    for apipath, body in sorted(bodies.items(), key=lambda item: -len(item[1])):
+        timings = []
+        for name, decode in decoders.items():
+            start = time.perf_counter()
+            for i in range(args.repeat):
+                decode(body)
+            seconds = (time.perf_counter() - start)/args.repeat
+            totals[name] += seconds
+            timings.append(f'{1000*seconds:8.2f}ms')
+        print(f'{apipath:<24} {len(body)/1024:8.1f}KB ' + ' '.join(timings))
+    print(f'{"total":<24} {"":>10} ' + ' '.join(f'{1000*totals[name]:8.2f}ms' for name in decoders))
+
+def bench_records(args):
+    """ Memory held by API responses as decoded JSON and as records """
+    scale = dict(SCALE, datasets=args.datasets, disks=args.disks, pools=args.pools,
+        replications=args.replications)
+    payloads = make_payloads(scale)
+    # A real disk keeps a history of SMART tests, newest first
+    for result in payloads['smart/test/results']:
+        result['tests'] = [dict(result['tests'][0], num=num + 1) for num in range(args.smart_tests)]
+    decode = next(iter(JSON_DECODERS.values()))
+    print(f'{args.datasets} datasets, {args.disks} disks, {args.pools} pools, ' +
+        f'{args.replications} replications, {args.smart_tests} SMART tests per disk, ' +
+        f'{args.repeat} runs each')
+
+    for apipath in RECORDS:
+        body = json.dumps(payloads[apipath]).encode()
+        measure(f'{apipath} decoded', lambda: decode(body), args.repeat)
+        measure(f'{apipath} records', lambda: parse_records(apipath, decode(body)), args.repeat)
+
+# Run in a fresh interpreter, so nothing is imported yet
+_STARTUP = '''
+import json, sys, time
+start = time.perf_counter()
+from truenas_collector import TrueNasCollector
+imported = time.perf_counter()
+collector = TrueNasCollector('fixture', 'root', 'fixture', collectors=json.loads(sys.argv[1]))
+loaded = time.perf_counter()
+# ru_maxrss would count the parent's memory before exec, VmHWM doesn't
+with open('/proc/self/status') as status:
+    maxrss = [int(line.split()[1]) for line in status if line.startswith('VmHWM:')][0]
+print(json.dumps([imported - start, loaded - imported, maxrss,
+    len([name for name in sys.modules if name.startswith('truenas_collectors.')])]))
+'''
+
+def bench_startup(args):
+    """ Import time, load time and memory of a new exporter process """
+    sets = {'all collectors': None}
+    if args.collectors:
+        sets[args.collectors] = args.collectors.split(',')
+    for name in truenas_collectors.NAMES:
+        sets.setdefault(name, [name])
+    print(f'Best of {args.repeat} runs each')
+    print(f'{"collectors":<32} {"import":>10} {"load":>10} {"max RSS":>10} {"modules":>8}')
+    for name, collectors in sets.items():
+        runs = [json.loads(subprocess.run([sys.executable, '-c', _STARTUP, json.dumps(collectors)],
+            check=True, capture_output=True, text=True).stdout) for i in range(args.repeat)]
+        (imported, loaded, maxrss, modules) = [min(column) for column in zip(*runs)]
+        print(f'{name:<32} {1000*imported:7.2f} ms {1000*loaded:7.2f} ms ' +
+            f'{maxrss/1024:6.1f} MiB {modules:8d}')
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Benchmarks for the TrueNAS exporter against generated fixtures.')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    labels = subparsers.add_parser('labels', help=bench_labels.__doc__.strip())
+    labels.add_argument('--datasets', dest='datasets', default=20000, type=int)
+    labels.add_argument('--repeat', dest='repeat', default=5, type=int)
+    labels.set_defaults(func=bench_labels)
+
+    decode = subparsers.add_parser('decode', help=bench_decode.__doc__.strip())
+    decode.add_argument('--fixtures', dest='fixtures', default=None,
+        help='Directory of recorded API responses, named like pool_dataset.json')
+    decode.add_argument('--datasets', dest='datasets', default=5000, type=int)
+    decode.add_argument('--filesystems', dest='filesystems', default=1000, type=int)
+    decode.add_argument('--repeat', dest='repeat', default=10, type=int)
+    decode.set_defaults(func=bench_decode)
+
+    records = subparsers.add_parser('records', help=bench_records.__doc__.strip())
+    records.add_argument('--datasets', dest='datasets', default=20000, type=int)
+    records.add_argument('--disks', dest='disks', default=1000, type=int)
+    records.add_argument('--pools', dest='pools', default=8, type=int)
+    records.add_argument('--replications', dest='replications', default=500, type=int)
+    records.add_argument('--smart-tests', dest='smart_tests', default=20, type=int)
+    records.add_argument('--repeat', dest='repeat', default=5, type=int)
+    records.set_defaults(func=bench_records)
+
+    startup = subparsers.add_parser('startup', help=bench_startup.__doc__.strip())
+    startup.add_argument('--collectors', dest='collectors', default=None,
+        help='Also measure this comma-separated set of collectors')
+    startup.add_argument('--repeat', dest='repeat', default=5, type=int)
+    startup.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -1,1182 +1,1553 @@
 #!/usr/bin/env python3
 
-from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily, InfoMetricFamily
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
 from prometheus_client import Counter, Summary
+from prometheus_client.samples import Sample
 from datetime import datetime
-import requests, urllib3, sys, re
+import requests, urllib3, sys, re, random, time, heapq, json, gc, threading, contextlib, multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from types import FunctionType
+import truenas_collectors
 urllib3.disable_warnings()
 
-from pprint import pprint
+# JSON decoders that parse straight from the response bytes, fastest first.
+# requests' r.json() builds a str from the body before the stdlib parses it,
+# which is a real cost on multi-megabyte pool/dataset and stats responses.
+JSON_DECODERS = {}
+try:
+    import orjson
+    JSON_DECODERS['orjson'] = orjson.loads
+except ImportError:
+    pass
+try:
+    import ujson
+    JSON_DECODERS['ujson'] = ujson.loads
+except ImportError:
+    pass
+JSON_DECODERS['json'] = json.loads
 
 unknown_enumerations = Counter('truenas_exporter_unknown_enumerations', 'Enumerations that cannot be identified. Check the logs.')
-rsynctask_timer = Summary('truenas_exporter_rsynctask_seconds', 'Time spent making rsynctask API requests')
-cloudsync_timer = Summary('truenas_exporter_cloudsync_seconds', 'Time spent making cloudsync API requests')
-alerts_timer = Summary('truenas_exporter_alerts_seconds', 'Time spent making alerts API requests')
-disks_timer = Summary('truenas_exporter_disks_seconds', 'Time spent making disks API requests')
-interfaces_timer = Summary('truenas_exporter_interfaces_seconds', 'Time spent making interfaces API requests')
-datasets_timer = Summary('truenas_exporter_datasets_seconds', 'Time spent making datasets API requests')
-pools_timer = Summary('truenas_exporter_pools_seconds', 'Time spent making pools API requests')
-replications_timer = Summary('truenas_exporter_replications_seconds', 'Time spent making replications API requests')
-snapshots_timer = Summary('truenas_exporter_snapshots_seconds', 'Time spent making snapshots APIrequests')
-systeminfo_timer = Summary('truenas_exporter_systeminfo_seconds', 'Time spent making systeminfo API requests')
-enclosure_timer = Summary('truenas_exporter_enclosure_seconds', 'Time spent making enclosure API requests')
-smarttests_timer = Summary('truenas_exporter_smarttests_seconds', 'Time spent making SMART test API requests')
-stats_timer = Summary('truenas_exporter_stats_seconds', 'Time spent making stats API requests')
+dropped_series = Counter('truenas_exporter_dropped_series', 'Series folded into the "other" bucket by --limit', ['family'])
+failovers = Counter('truenas_exporter_failovers', 'Switches to another --target address after the current one stopped answering')
+api_queue_timer = Summary('truenas_exporter_api_queue_seconds', 'Time API calls waited for a slot under --api-concurrency', ['priority'])
+api_queue_timeouts = Counter('truenas_exporter_api_queue_timeouts', 'API calls given up because no --api-concurrency slot freed up in time', ['priority'])
+memo_hits = Counter('truenas_exporter_request_memo_hits', 'API calls answered from an identical call earlier in the same scrape', ['endpoint'])
+
+# Garbage collections and the time spent in them, counted by a gc callback so
+# the collectors' self-metrics can tell which one triggered them. The callback
+# is installed by the first TrueNasCollector, not on import.
+_gc_totals = [0, 0.0]
+_gc_started = [None]
+
+def _gc_callback(phase, info):
+    if phase == 'start':
+        _gc_started[0] = time.perf_counter()
+    elif _gc_started[0] is not None:
+        _gc_totals[0] += 1
+        _gc_totals[1] += time.perf_counter() - _gc_started[0]
+        _gc_started[0] = None
+
+def _proc_status(field):
+    """ A size from /proc/self/status in bytes, None where there is none """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])*1024
+    except OSError:
+        pass
+    return None
+
+def peak_rss():
+    """ Peak resident set size of this process in bytes since it started """
+
+    # Only read. Resetting VmHWM through /proc/self/clear_refs would be for
+    # the whole process, and anything else reading it.
+    peak = _proc_status('VmHWM')
+    if peak is None:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+    return peak
+
+def rss():
+    """ Resident set size of this process in bytes, None where unsupported """
+    return _proc_status('VmRSS')
+
+
+# Steps of collectd data asked for per stats/get_data request. The newest two
+# or three rows are usually still empty.
+STATS_ROWS = 9
+
+# Families that --limit can be applied to
+LIMIT_FAMILIES = ['datasets', 'df', 'disks', 'enclosure']
+
+class CircuitBreaker(object):
+    """ Per-endpoint circuit breaker with exponential backoff and jitter """
+
+    # After `threshold` consecutive failures, the circuit opens and calls are
+    # rejected without touching the TrueNAS for a backoff period. The backoff
+    # doubles (up to max_backoff) every time a half-open trial call fails, and
+    # is randomized by +/-50% so that endpoints don't all retry at once.
+    # Only one thread makes the half-open trial call. Until it finishes, the
+    # others are rejected as if the circuit were still open.
+
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+    def __init__(self, threshold, base_backoff = 15, max_backoff = 300):
+        self.threshold = threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.backoff = base_backoff
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.rejected = 0
+        self.open_until = 0
+        # Thread making the half-open trial call
+        self.prober = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """ Whether a call to this endpoint should be made right now """
+        with self.lock:
+            if self.state == CircuitBreaker.OPEN:
+                if time.monotonic() < self.open_until:
+                    self.rejected += 1
+                    return False
+                self.state = CircuitBreaker.HALF_OPEN
+                self.prober = threading.get_ident()
+            elif self.state == CircuitBreaker.HALF_OPEN and self.prober != threading.get_ident():
+                self.rejected += 1
+                return False
+            return True
+
+    def success(self):
+        with self.lock:
+            self.state = CircuitBreaker.CLOSED
+            self.failures = 0
+            self.backoff = self.base_backoff
+            self.prober = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == CircuitBreaker.HALF_OPEN:
+                self.backoff = min(2*self.backoff, self.max_backoff)
+                self.prober = None
+            elif self.failures < self.threshold:
+                return
+            self.state = CircuitBreaker.OPEN
+            self.open_until = time.monotonic() + self.backoff*random.uniform(0.5, 1.5)
+
+    def abandoned(self):
+        """ The calling thread's trial call ended without success() or failure() """
+        if self.state == CircuitBreaker.HALF_OPEN and self.prober == threading.get_ident():
+            self.failure()
+
+class SlotTimeout(Exception):
+    """ No RequestLimiter slot freed up in time """
+
+class RequestLimiter(object):
+    """ Limit on API calls in flight to one target, by priority """
+
+    # The middleware answers API calls from a small pool of workers, and a
+    # stats/get_data or enclosure call can hold one for seconds. At most
+    # `limit` calls are in flight at once, and at most `bulk_limit` of them
+    # bulk ones. A free slot goes to a waiting health call before any
+    # inventory call, and to an inventory call before any bulk call, so
+    # alerts and pool health don't queue behind the sampler and stats.
+
+    HEALTH = 0
+    INVENTORY = 1
+    BULK = 2
+    NAMES = ['health', 'inventory', 'bulk']
+    # Everything else is inventory
+    PRIORITIES = {
+        'alert/list': HEALTH,
+        'pool': HEALTH,
+        'system/info': HEALTH,
+        'network/configuration': HEALTH,
+        'stats/get_data': BULK,
+        'enclosure': BULK,
+        'zfs/snapshot': BULK
+    }
+
+    def __init__(self, limit, bulk_limit, shared=None, process=0, timeout=60):
+        self.limit = limit
+        self.bulk_limit = bulk_limit
+        # Seconds to wait for a slot before giving up on the call, so calls
+        # don't hang forever on counts nobody gives back
+        self.timeout = timeout
+        # Calls in flight, then calls waiting, per priority. With --workers
+        # these are shared() by all worker processes, so the limit holds for
+        # the exporter as a whole. Each process keeps its own six counts in
+        # there, so those of a process that died can be given back.
+        if shared:
+            (self.condition, self.counts) = shared
+        else:
+            self.condition = threading.Condition()
+            self.counts = [0]*6
+        self.offset = 6*process
+
+    @classmethod
+    def priority(cls, apipath):
+        return cls.PRIORITIES.get(apipath, cls.INVENTORY)
+
+    @staticmethod
+    def shared(processes=1):
+        """ Counts and their condition for limiters in several processes """
+        return (multiprocessing.Condition(), multiprocessing.Array('i', 6*processes, lock=False))
+
+    @staticmethod
+    def release(shared, process, timeout=5):
+        """ Give back the slots of a process that died, False if that's impossible """
+
+        # If it died holding the lock, nobody will get it again
+        (condition, counts) = shared
+        if not condition.acquire(True, timeout):
+            return False
+        try:
+            for index in range(6*process, 6*process + 6):
+                counts[index] = 0
+            condition.notify_all()
+        finally:
+            condition.release()
+        return True
+
+    def _total(self, index):
+        return sum(self.counts[index::6])
+
+    def _free(self, priority):
+        if sum(self._total(index) for index in range(3)) >= self.limit or \
+                any(self._total(3 + index) for index in range(priority)):
+            return False
+        return priority != RequestLimiter.BULK or self._total(priority) < self.bulk_limit
+
+    @contextlib.contextmanager
+    def slot(self, apipath):
+        """ Wait for a slot for a call to apipath and hold it """
+        priority = self.priority(apipath)
+        started = time.monotonic()
+        deadline = started + self.timeout
+        if not self.condition.acquire(True, self.timeout):
+            raise SlotTimeout(f'No --api-concurrency slot for {apipath} within {self.timeout}s')
+        try:
+            self.counts[self.offset + 3 + priority] += 1
+            while not self._free(priority):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.counts[self.offset + 3 + priority] -= 1
+                    self.condition.notify_all()
+                    raise SlotTimeout(f'No --api-concurrency slot for {apipath} within {self.timeout}s')
+                self.condition.wait(remaining)
+            self.counts[self.offset + 3 + priority] -= 1
+            self.counts[self.offset + priority] += 1
+        finally:
+            self.condition.release()
+        api_queue_timer.labels(self.NAMES[priority]).observe(time.monotonic() - started)
+        try:
+            yield
+        finally:
+            if self.condition.acquire(True, self.timeout):
+                try:
+                    self.counts[self.offset + priority] -= 1
+                    self.condition.notify_all()
+                finally:
+                    self.condition.release()
+
+class LabelCache(object):
+    """ Label sets reused between scrapes, keyed by object identity """
+
+    # The same datasets, disks and replications come back on every scrape, and
+    # GaugeMetricFamily.add_metric() builds a new label dict for every sample
+    # of every one of them. Instead, the label dict for an object (keyed by
+    # dataset name, disk, replication id...) is built once with interned
+    # strings, and add() appends samples that share it. get() compares `check`
+    # so that a changed object gets new labels from put(). Objects that
+    # weren't seen since the last sweep() are evicted.
+
+    def __init__(self, labelnames):
+        self.labelnames = labelnames
+        self.entries = {}
+        self.seen = set()
+
+    def get(self, key, check=None):
+        """ The shared label dict for key, or None if put() is needed """
+        self.seen.add(key)
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != check:
+            return None
+        return entry[1]
+
+    def put(self, key, check, values):
+        """ Build and remember the label dict for key """
+        labels = dict(zip(self.labelnames, [sys.intern(str(value)) for value in values]))
+        self.entries[key] = (check, labels)
+        return labels
+
+    def sweep(self):
+        """ Evict entries for objects that are gone """
+        for key in self.entries.keys() - self.seen:
+            del self.entries[key]
+        self.seen = set()
+
+    @staticmethod
+    def add(family, labels, value):
+        """ add_metric() without copying the label dict """
+        if family.type == 'counter':
+            family.samples.append(Sample(family.name + '_total', labels, value, None))
+        else:
+            family.samples.append(Sample(family.name, labels, value, None))
+
+class TopN(object):
+    """ The N highest-ranked series of a family, and an 'other' bucket """
+
+    # Objects are offered one at a time while walking an API response, and
+    # only the N with the highest rank are kept in a min-heap. Whatever falls
+    # out of the heap is folded into a single 'other' series right away, with
+    # one combine function (e.g. operator.add or max) per value column, so
+    # memory stays bounded by N no matter how many objects there are. A
+    # column whose combine function is None isn't folded, and values that
+    # aren't numbers are left out of the fold.
+
+    def __init__(self, limit, combine):
+        self.limit = limit
+        self.combine = combine
+        self.heap = []
+        self.offered = 0
+        self.other = None
+        self.dropped = 0
+
+    def offer(self, rank, labels, values):
+        self.offered += 1
+        # Ties go to the earlier object, and since offered is unique, labels
+        # and values are never compared
+        item = (rank, -self.offered, labels, values)
+        if len(self.heap) < self.limit:
+            heapq.heappush(self.heap, item)
+            return
+        if item[:2] > self.heap[0][:2]:
+            item = heapq.heapreplace(self.heap, item)
+        self._fold(item[3])
+
+    def _fold(self, values):
+        if self.other is None:
+            self.other = [None]*len(values)
+        for index, value in enumerate(values):
+            if value is None:
+                continue
+            self.dropped += 1
+            if self.combine[index] is None or isinstance(value, bool) or \
+                    not isinstance(value, (int, float)):
+                continue
+            if self.other[index] is None:
+                self.other[index] = value
+            else:
+                self.other[index] = self.combine[index](self.other[index], value)
+
+    def series(self, family, other_labels):
+        """ (labels, values) of the kept objects in response order, then 'other' """
+        dropped_series.labels(family).inc(self.dropped)
+        for (rank, offered, labels, values) in sorted(self.heap, key=lambda item: item[1], reverse=True):
+            yield (labels, values)
+        if self.other is not None:
+            yield (other_labels, self.other)
+
+class StatsFilter(object):
+    """ Include/exclude rules for collectd sources and metrics, per family """
+
+    # Rules are FAMILY=REGEX, matched against source names like
+    # df-mnt-tank-home or interface-ix0, or FAMILY/METRIC, matched against
+    # the whole collectd type like if_octets or geom_busy_percent-da0 (METRIC
+    # is a regex too). With any include rule for a family, only what matches
+    # one is kept, and anything matching an exclude rule is dropped. OPT_IN
+    # families are dropped altogether unless they have a rule. All the
+    # rules for a family are compiled into one regex up front, and the
+    # verdict for each source is remembered, so classifying a source on
+    # later scrapes is a single dict lookup.
+
+    # Source name prefix (up to the first '-') to family
+    PREFIXES = {
+        'aggregation': 'cpu',
+        'cpu': 'cpu',
+        'cputemp': 'temperature',
+        'ctl': 'ctl',
+        'df': 'df',
+        'disk': 'disk',
+        'geom_stat': 'geom',
+        'interface': 'interface',
+        'load': 'load',
+        'memory': 'memory',
+        'nfsstat': 'nfs',
+        'processes': 'processes',
+        'swap': 'swap',
+        'uptime': 'uptime',
+        'zfs_arc': 'zfs_arc',
+        'zfs_arc_v2': 'zfs_arc'
+    }
+    FAMILIES = sorted(set(PREFIXES.values()))
+    # Families only requested when there is a rule for them. df can get
+    # really slow with a lot of filesystems mounted.
+    OPT_IN = ['df']
+
+    def __init__(self, includes = (), excludes = ()):
+        source_patterns = {}
+        metric_patterns = {}
+        for (kind, rules) in [(0, includes), (1, excludes)]:
+            for rule in rules:
+                (family, pattern) = rule.split('=', 1) if '=' in rule else (rule, None)
+                (family, metric) = family.split('/', 1) if '/' in family else (family, None)
+                if family not in self.FAMILIES or (metric is None) == (pattern is None):
+                    raise ValueError(f'Invalid stats filter {rule}')
+                if metric is None:
+                    source_patterns.setdefault(family, ([], []))[kind].append(pattern)
+                else:
+                    metric_patterns.setdefault(family, ([], []))[kind].append(metric)
+        try:
+            self.source_rules = {family: self._compile(patterns) for family, patterns in source_patterns.items()}
+            self.metric_rules = {family: self._compile(patterns) for family, patterns in metric_patterns.items()}
+        except re.error as e:
+            raise ValueError(f'Invalid stats filter regex: {e}')
+        self.sources = {}
+
+    @staticmethod
+    def _compile(patterns):
+        return tuple(re.compile('|'.join(f'(?:{pattern})' for pattern in kind)) if kind else None
+            for kind in patterns)
+
+    @staticmethod
+    def _match(rule, text, method):
+        if rule is None:
+            return True
+        (include, exclude) = rule
+        return (include is None or method(include, text) is not None) and \
+            (exclude is None or method(exclude, text) is None)
+
+    def __bool__(self):
+        return bool(self.source_rules or self.metric_rules)
+
+    def family(self, source):
+        """ Family of a source, or None if it's unknown or filtered out """
+        try:
+            return self.sources[source]
+        except KeyError:
+            pass
+        family = self.PREFIXES.get(source.split('-', 1)[0])
+        if family in self.OPT_IN and family not in self.source_rules and family not in self.metric_rules:
+            family = None
+        elif family is not None and not self._match(self.source_rules.get(family), source, re.Pattern.search):
+            family = None
+        if len(self.sources) > 100000:
+            # Sources come and go, don't remember them forever
+            self.sources = {}
+        self.sources[source] = family
+        return family
+
+    def keep(self, source, metric):
+        """ Whether to request one stats_list item """
+        family = self.family(source)
+        if family is None:
+            return source.split('-', 1)[0] not in self.PREFIXES
+        return self._match(self.metric_rules.get(family), metric, re.Pattern.fullmatch)
+
+class JobTracker(object):
+    """ Latest job of each replication, rsync and cloudsync task """
+
+    # core/get_jobs lists every job the middleware has run since it started
+    # (or the last 999 of them): snapshots, cron jobs, certificate renewals
+    # and so on. Rather than reading all the tasks with their embedded jobs on
+    # every scrape, only jobs from the oldest unfinished one on are fetched,
+    # and the latest job of each task is kept here in a trimmed down form,
+    # along with run, failure and transferred byte counts. Every `resync`
+    # seconds the whole list is fetched again, which is also how a middleware
+    # restart is noticed: job ids start over from 1 after one.
+
+    # Job method to task type. The task id is the first argument.
+    METHODS = {
+        'replication.run': 'replication',
+        'rsynctask.run': 'rsynctask',
+        'cloudsync.sync': 'cloudsync'
+    }
+    FINISHED = ['SUCCESS', 'FAILED', 'ABORTED']
+    # Progress descriptions like rclone's "Transferred: 1.234 GiB / 2 GiB, 61%"
+    # or "Sending 3 of 5: tank/home@auto-1 (1.2 GiB / 3 GiB)"
+    TRANSFERRED = re.compile(r'([\d.]+)\s*([KMGTP]i?)?B(?:ytes)?\s*/\s*[\d.]+\s*(?:[KMGTP]i?)?B')
+    UNITS = {None: 1, 'K': 10**3, 'M': 10**6, 'G': 10**9, 'T': 10**12, 'P': 10**15,
+        'Ki': 2**10, 'Mi': 2**20, 'Gi': 2**30, 'Ti': 2**40, 'Pi': 2**50}
+
+    def __init__(self, resync):
+        self.resync = resync
+        self.last_sync = None
+        self.last_id = 0
+        self.running = set()
+        # Bumped on a middleware restart so that newer jobs win over older
+        # ones with higher ids
+        self.generation = 0
+        self.latest = {}
+        # (id, start time) of the finished jobs already counted. After a
+        # restart, or what looked like one, the jobs from before it are seen
+        # again and must not be counted twice.
+        self.counted = set()
+        self.runs = {}
+        self.failures = {}
+        self.transferred = {}
+
+    def params(self, now):
+        """ core/get_jobs query for the next poll, None to fetch all jobs """
+        if self.last_sync is None or now - self.last_sync >= self.resync:
+            return None
+        return {'id__gte': min(self.running, default=self.last_id + 1)}
+
+    def update(self, jobs, full, now):
+        """ Fold in a core/get_jobs response, returns the tasks with new jobs """
+        ids = {job['id'] for job in jobs}
+        if full:
+            self.last_sync = now
+            if ids and max(ids) < self.last_id:
+                self._restarted()
+        elif not self.running <= ids:
+            # Unfinished jobs don't go away, unless the middleware restarted.
+            # These ids may be from before or after that, so start over with
+            # the full list next time.
+            self._restarted()
+            self.last_sync = None
+            return set()
+
+        updated = set()
+        for job in sorted(jobs, key=lambda job: job['id']):
+            kind = self.METHODS.get(job['method'])
+            if kind is None or not job.get('arguments'):
+                continue
+            key = (kind, job['arguments'][0])
+            if job['id'] > self.last_id or job['id'] in self.running:
+                if job['state'] in self.FINISHED:
+                    self.running.discard(job['id'])
+                    self._count(key, job)
+                else:
+                    self.running.add(job['id'])
+            latest = self.latest.get(key)
+            if latest is None or (self.generation, job['id']) >= latest[:2]:
+                updated.add(key)
+                self.latest[key] = (self.generation, job['id'], self.trim(job))
+        if ids:
+            self.last_id = max(self.last_id, max(ids))
+        if full:
+            # Jobs the middleware no longer lists won't be seen again
+            self.counted &= {self._identity(job) for job in jobs}
+        return updated
+
+    def _count(self, key, job):
+        """ Add a finished job to its task's counters, unless it already was """
+        identity = self._identity(job)
+        if identity in self.counted:
+            return
+        self.counted.add(identity)
+        self.runs[key] = self.runs.get(key, 0) + 1
+        if job['state'] == 'FAILED':
+            self.failures[key] = self.failures.get(key, 0) + 1
+        transferred = self._transferred(job)
+        if transferred is not None:
+            self.transferred[key] = self.transferred.get(key, 0) + transferred
+
+    @staticmethod
+    def _identity(job):
+        started = job.get('time_started')
+        if isinstance(started, dict):
+            started = started.get('$date')
+        return (job['id'], started)
+
+    @staticmethod
+    def trim(job):
+        """ The parts of a job the collectors use """
+        return {
+            'id': job['id'],
+            'state': job['state'],
+            'result': job.get('result'),
+            'progress': {'percent': (job.get('progress') or {}).get('percent')},
+            'time_started': job.get('time_started'),
+            'time_finished': job.get('time_finished')
+        }
+
+    def _restarted(self):
+        self.last_id = 0
+        self.running = set()
+        self.generation += 1
+
+    def _transferred(self, job):
+        """ Bytes transferred by a job, if its progress description says """
+        description = (job.get('progress') or {}).get('description')
+        if not isinstance(description, str):
+            return None
+        match = self.TRANSFERRED.search(description)
+        if match is None:
+            return None
+        return int(float(match.group(1)) * self.UNITS[match.group(2)])
+
+    def job(self, kind, task_id):
+        """ Latest job of a task, or None if there was none since it started """
+        latest = self.latest.get((kind, task_id))
+        return latest[2] if latest else None
+
+class Record(object):
+    """ Compact, typed form of an object from an API response """
+
+    # A decoded response keeps everything the API sends: every dataset comes
+    # with a dict of parsed/rawvalue/value/source for each of its ~30 ZFS
+    # properties, every SMART result with the whole test history of a disk.
+    # The collectors only read a few fields, and some responses are held on
+    # to (the SMART cache, the disk inventory, task definitions, last good
+    # responses for --circuit-breaker). So responses from the endpoints in
+    # RECORDS are turned into lists of these right after decoding, and the
+    # decoded JSON is dropped. __slots__ leaves out the per-object __dict__.
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, items):
+        """ Records for the items of a list response """
+        return [cls.from_api(item) for item in items]
+
+    def __repr__(self):
+        return type(self).__name__ + '(' + ', '.join(
+            f'{name}={getattr(self, name)!r}' for name in self.__slots__) + ')'
+
+class Disk(Record):
+    __slots__ = ('name', 'serial', 'type', 'model', 'size')
+
+    def __init__(self, name, serial, type, model, size):
+        self.name = name
+        self.serial = serial
+        self.type = type
+        self.model = model
+        self.size = size
+
+    @classmethod
+    def from_api(cls, disk):
+        return cls(disk['name'], disk['serial'], disk['type'], disk['model'], disk['size'])
+
+class Dataset(Record):
+    __slots__ = ('name', 'pool', 'type', 'available', 'used', 'children', 'encrypted', 'locked')
+
+    def __init__(self, name, pool, type, available, used, children, encrypted, locked):
+        self.name = name
+        self.pool = sys.intern(pool)
+        self.type = sys.intern(type)
+        self.available = available
+        self.used = used
+        self.children = children
+        self.encrypted = encrypted
+        self.locked = locked
+
+    @classmethod
+    def from_api(cls, dataset):
+        return cls(dataset['name'], dataset['pool'], dataset['type'],
+            dataset['available']['parsed'], dataset['used']['parsed'],
+            len(dataset['children']), bool(dataset['encrypted']), bool(dataset['locked']))
+
+class PoolDisk(Record):
+    """ A disk in a pool's data vdevs or spares """
+    __slots__ = ('label', 'spare', 'status', 'read_errors', 'write_errors', 'checksum_errors')
+
+    def __init__(self, label, spare, status, read_errors, write_errors, checksum_errors):
+        self.label = label
+        self.spare = spare
+        self.status = status
+        self.read_errors = read_errors
+        self.write_errors = write_errors
+        self.checksum_errors = checksum_errors
+
+    @classmethod
+    def from_api(cls, disk, spare):
+        label = "None"
+        if 'disk' in disk:
+            label = disk['disk']
+        elif 'path' in disk:
+            label = disk['path']
+        stats = disk['stats']
+        return cls(label or "unlabelled", spare, disk['status'],
+            stats['read_errors'], stats['write_errors'], stats['checksum_errors'])
+
+class Pool(Record):
+    __slots__ = ('name', 'path', 'status', 'healthy', 'disks')
+
+    def __init__(self, name, path, status, healthy, disks):
+        self.name = name
+        self.path = path
+        self.status = status
+        self.healthy = healthy
+        self.disks = disks
+
+    @classmethod
+    def from_api(cls, pool):
+        disks = [PoolDisk.from_api(disk, "false")
+            for topology in pool['topology']['data'] for disk in topology['children']]
+        disks += [PoolDisk.from_api(disk, "true") for disk in pool['topology']['spare']]
+        return cls(pool['name'], pool['path'], pool['status'], bool(pool['healthy']), tuple(disks))
+
+class Replication(Record):
+    __slots__ = ('id', 'source_datasets', 'target_dataset', 'target_system', 'transport', 'finished', 'job')
+
+    def __init__(self, id, source_datasets, target_dataset, target_system, transport, finished, job):
+        self.id = id
+        self.source_datasets = source_datasets
+        self.target_dataset = target_dataset
+        self.target_system = target_system
+        self.transport = transport
+        self.finished = finished
+        self.job = job
+
+    @classmethod
+    def from_api(cls, replication):
+        if replication['transport'] == 'LOCAL':
+            target_system = 'localhost'
+        else:
+            target_system = ((replication.get('ssh_credentials') or {}).get('attributes') or {}).get('host', '')
+        # When zettarepl last finished with it, in milliseconds
+        finished = replication['state'].get('datetime', {}).get('$date')
+        job = replication.get('job')
+        return cls(replication['id'], tuple(replication['source_datasets']), replication['target_dataset'],
+            target_system, replication['transport'], finished, JobTracker.trim(job) if job else None)
+
+class SmartResult(Record):
+    """ The latest SMART test of a disk """
+    __slots__ = ('disk', 'description', 'status', 'lifetime')
+
+    def __init__(self, disk, description, status, lifetime):
+        self.disk = disk
+        self.description = description
+        self.status = status
+        self.lifetime = lifetime
+
+    @classmethod
+    def parse(cls, items):
+        # Disks that were never tested have nothing to export
+        return [cls.from_api(item) for item in items if item['tests']]
+
+    @classmethod
+    def from_api(cls, disk):
+        test = disk['tests'][0]
+        return cls(disk['disk'], test['description'], test['status'], test['lifetime'])
+
+# API paths whose responses are turned into records by request()
+RECORDS = {
+    'disk': Disk,
+    'pool': Pool,
+    'pool/dataset': Dataset,
+    'replication': Replication,
+    'smart/test/results': SmartResult
+}
+
+def parse_records(apipath, result):
+    """ A decoded response as records, if there are records for apipath """
+    record = RECORDS.get(apipath)
+    if record is None or not isinstance(result, list):
+        return result
+    return record.parse(result)
+
+class ScrapeContext(object):
+    """ API responses and indexes shared by the collectors during one scrape """
+
+    # Collectors asking for the same GET during a scrape share one API call,
+    # also when they ask at the same time: whoever comes second waits for the
+    # first call's response. POSTs like stats/get_data depend on their body
+    # and time window and are always sent. Indexes over responses, like the
+    # disks by name, are built once by whichever collector needs them first.
+    # Everything is dropped at the end of the scrape.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.responses = {}
+        self.indexes = {}
+        # Keys prefetch() claimed, which aren't memo hits for their collector
+        self.prefetched = set()
+
+    def _claim(self, table, key, failed=None):
+        """ (whether we are first, [done, result]) for a key """
+        with self.lock:
+            entry = table.get(key)
+            if entry is not None:
+                return (False, entry)
+            # A failed call leaves `failed` ({} by default) for everyone
+            # waiting on it
+            entry = table[key] = [threading.Event(), {} if failed is None else failed]
+            return (True, entry)
+
+    @staticmethod
+    def _fill(entry, fn):
+        try:
+            entry[1] = fn()
+        finally:
+            entry[0].set()
+        return entry[1]
+
+    def _once(self, table, key, fn, failed=None):
+        """ fn() the first time key is asked for, its result after that """
+        (first, entry) = self._claim(table, key, failed)
+        if first:
+            return (True, self._fill(entry, fn))
+        entry[0].wait()
+        return (False, entry[1])
+
+    @staticmethod
+    def _key(apipath, params):
+        return (apipath, json.dumps(params, sort_keys=True) if params else None)
+
+    def request(self, apipath, params, fn):
+        """ fn()'s (result, trace) for a GET, shared by the whole scrape """
+        key = self._key(apipath, params)
+        (first, result) = self._once(self.responses, key, fn, ({}, None))
+        if not first and key in self.prefetched:
+            self.prefetched.discard(key)
+        elif not first:
+            memo_hits.labels(apipath).inc()
+        return result
+
+    def prefetch(self, collector, apipaths):
+        """ Start GETs in the background for a collector to pick up later """
+        collection = collector.trace_collection
+        for apipath in apipaths:
+            key = self._key(apipath, None)
+            (first, entry) = self._claim(self.responses, key, ({}, None))
+            if first:
+                self.prefetched.add(key)
+                threading.Thread(target=self._fill, daemon=True,
+                    args=(entry, lambda apipath=apipath: collector._prefetched(collection, apipath))).start()
+
+    def index(self, name, build):
+        return self._once(self.indexes, name, build)[1]
 
 class TrueNasCollector(object):
-    def __init__(self, target, username, password, cache_smart = 24, skip_snmp = False, skip_df_regex = None):
-        self.target = target
+    # Collectors whose refresh interval is stretched by --throttle when the
+    # TrueNAS is busy
+    throttled_collections = ['_collect_pool_datasets', '_collect_stats']
+    # Collectors that report on the exporter's own state rather than on the
+    # TrueNAS, so they run in every worker process with --workers
+    process_collections = ['_collect_circuit_breakers', '_collect_throttle', '_collect_targets', '_collect_self']
+
+    def __init__(self, target, username, password, cache_smart = 24, skip_snmp = False, skip_df_regex = None, stats_rotate = 1, circuit_breaker = 0, circuit_breaker_max_backoff = 300, throttle = False, throttle_load = 1.0, throttle_latency = 2.0, throttle_max_interval = 300, limits = None, json_decoder = None, collections = None, stats_include = None, stats_exclude = None, snapshots_interval = 0, snapshots_page_size = 1000, snapshots_pages = 10, cache_disk_temperatures = 60, jobs_resync = 600, failover_timeout = 3, cache_enclosure = 60, sample_interval = 0, sample_buffer = 60, sample_window = 60, collectors = None, api_concurrency = 0, api_concurrency_bulk = 1):
+        # Kept for reconfigure() to tell what a reload changed
+        self.settings = {name: value for (name, value) in locals().items() if name != 'self'}
+        # With HA, the target can be a comma-separated list of the virtual
+        # address and the controllers' addresses. Requests go to whichever
+        # answered last.
+        self.targets = target.split(',') if target else []
+        self.target = self.targets[0] if self.targets else target
+        self.failover_timeout = failover_timeout
+        self.failover_probed = None
+        # Prefetch threads can fail over at the same time as the scrape
+        self.failover_lock = threading.Lock()
+        self.targets_down = None
+        self.served_targets = set()
+        # Give up quickly on connecting to a controller that is down, there's
+        # another one to try
+        self.timeout = (failover_timeout, 15) if len(self.targets) > 1 else 15
         self.username = username
         self.password = password
         self.skip_snmp = skip_snmp
         self.cache_smart = 60*60*cache_smart
         self.skip_df_regex = skip_df_regex
+        self.stats_filter = self._stats_filter(skip_df_regex, stats_include, stats_exclude)
         self.last_smart_result = {}
         self.last_smart_time = 0
+        self.cache_disk_temperatures = cache_disk_temperatures
+        self.last_disk_temperatures = {}
+        self.last_disk_temperatures_time = 0
+        self.disk_inventory = {}
+        self.jobs_resync = jobs_resync
+        self.job_tracker = JobTracker(jobs_resync)
+        self.jobs_polled = None
+        self.jobs_updated = set()
+        self.task_definitions = {}
+        self.stats_rotate = max(1, stats_rotate)
+        self.stats_rotation = 0
+        self.stats_rotation_cache = {}
+        self.stats_steps = {}
+        self.circuit_breaker = circuit_breaker
+        self.circuit_breaker_max_backoff = circuit_breaker_max_backoff
+        # RequestLimiter per --target address, with --api-concurrency
+        self.api_concurrency = api_concurrency
+        self.api_concurrency_bulk = api_concurrency_bulk
+        self.limiters = {}
+        # RequestLimiter.shared() counts per target and this process' index
+        # into them, set by a WorkerPool
+        self.shared_limits = {}
+        self.shared_process = 0
+        self.breakers = {}
+        self.last_good = {}
+        self.stale = {}
+        self.throttle = throttle
+        self.throttle_load = throttle_load
+        self.throttle_latency = throttle_latency
+        self.throttle_max_interval = throttle_max_interval
+        self.throttle_pressure = {'load': 0, 'latency': 0}
+        self.throttle_intervals = {}
+        self.throttle_cache = {}
+        self.load_average = None
+        self.cores = None
+        self.api_latency = None
+        self.scrape_trace = []
+        self.last_scrape_trace = []
+        self.trace_start = time.monotonic()
+        # ScrapeContext of the scrape in progress
+        self.scrape = None
+        # The collector making API calls, per thread. Prefetches carry over
+        # the one that started them.
+        self.tracing = threading.local()
+        self.trace_collection = None
+        self.disk_labels = LabelCache(["name", "serial", "type", "model"])
+        self.dataset_labels = LabelCache(["name", "pool", "type"])
+        self.pool_labels = LabelCache(["name", "path"])
+        self.pool_disk_labels = LabelCache(["name", "path", "device", "spare"])
+        self.pool_disk_error_labels = LabelCache(["name", "path", "device", "errortype"])
+        self.replication_labels = LabelCache(["sources", "target", "target_system", "transport"])
+        self.enclosure_labels = LabelCache(["devicename", "devicemodel", "metrictype", "metricdevice", "metricelement"])
+        self.cache_enclosure = cache_enclosure
+        self.enclosure_topology = None
+        self.limits = limits or {}
+        self.json_decoder = json_decoder or next(iter(JSON_DECODERS))
+        self.json_loads = JSON_DECODERS[self.json_decoder]
+        self.only_collections = collections
+        self.snapshots_interval = snapshots_interval
+        self.snapshots_page_size = snapshots_page_size
+        self.snapshots_pages = snapshots_pages
+        self.snapshot_walk = None
+        self.snapshot_walk_started = None
+        self.snapshot_inventory = {}
+        self.snapshot_inventory_time = None
+        self.sample_interval = sample_interval
+        self.sample_buffer = sample_buffer
+        self.sample_window = sample_window
+        # Started by the first scrape, so only a worker that runs
+        # _collect_samples has one
+        self.sampler = None
+        # Per collector: CPU seconds, samples, decoded bytes, GC collections,
+        # GC seconds, net allocated blocks of the last run. Decoded bytes are
+        # added by _request(), from whichever thread makes the call.
+        self.usage = {}
+        self.usage_lock = threading.Lock()
+        # Highest RSS seen after a collector in the scrape in progress
+        self.scrape_rss = None
+        if _gc_callback not in gc.callbacks:
+            gc.callbacks.append(_gc_callback)
+        # Names from truenas_collectors.NAMES to run, None for all of them
+        self.collectors = collectors
+        if target:
+            # Load the enabled collectors now rather than in the first scrape
+            for collection in self._collections():
+                getattr(self, collection)
+
+    @property
+    def trace_collection(self):
+        return getattr(self.tracing, 'collection', None)
+
+    @trace_collection.setter
+    def trace_collection(self, collection):
+        self.tracing.collection = collection
+
+    def __getattr__(self, name):
+        # Only called for attributes that don't exist (yet). Collectors are
+        # loaded from truenas_collectors on first use, and added to the class
+        # rather than to this instance so that subclasses can still override
+        # them and their helpers.
+        if name not in truenas_collectors.COLLECTORS:
+            raise AttributeError(name)
+        module = truenas_collectors.load(name)
+        for (attr, value) in vars(module).items():
+            if isinstance(value, FunctionType) and value.__module__ == module.__name__ \
+                    and value.__code__.co_varnames[:1] == ('self',):
+                setattr(TrueNasCollector, attr, value)
+        return getattr(self, name)
+
+    @staticmethod
+    def _stats_filter(skip_df_regex, stats_include, stats_exclude):
+        """ StatsFilter for --stats-include/--stats-exclude and --skip-df-regex """
+        stats_exclude = list(stats_exclude or [])
+        if skip_df_regex:
+            stats_exclude.append(f'df={skip_df_regex}')
+        return StatsFilter(stats_include or [], stats_exclude)
+
+    def reconfigure(self, settings):
+        """ Apply reloaded settings, returning the names of those that changed """
+
+        # Only the state that depends on a changed setting is rebuilt. SMART
+        # results, label sets, the job tracker, learned stats steps, last good
+        # responses and the enclosure layout all stay warm. Another target
+        # or other credentials make it another NAS though, so then everything
+        # starts over.
+        settings = dict(self.settings, **settings)
+        changed = {name for name in settings if settings[name] != self.settings[name]}
+        if not changed:
+            return []
+        if changed & {'target', 'username', 'password'}:
+            self.__init__(**settings)
+            return sorted(changed)
+        self.settings = settings
+
+        if 'skip_snmp' in changed:
+            self.skip_snmp = settings['skip_snmp']
+        if 'cache_smart' in changed:
+            self.cache_smart = 60*60*settings['cache_smart']
+        if 'cache_disk_temperatures' in changed:
+            self.cache_disk_temperatures = settings['cache_disk_temperatures']
+        if 'cache_enclosure' in changed:
+            self.cache_enclosure = settings['cache_enclosure']
+        if 'failover_timeout' in changed:
+            self.failover_timeout = settings['failover_timeout']
+            self.timeout = (self.failover_timeout, 15) if len(self.targets) > 1 else 15
+        if 'jobs_resync' in changed:
+            self.jobs_resync = settings['jobs_resync']
+            self.job_tracker.resync = settings['jobs_resync']
+        if changed & {'skip_df_regex', 'stats_include', 'stats_exclude'}:
+            self.skip_df_regex = settings['skip_df_regex']
+            self.stats_filter = self._stats_filter(settings['skip_df_regex'],
+                settings['stats_include'], settings['stats_exclude'])
+            # Don't serve sources that are filtered out now from memory
+            self.stats_rotation_cache = {}
+        if 'stats_rotate' in changed:
+            self.stats_rotate = max(1, settings['stats_rotate'])
+            self.stats_rotation = 0
+            self.stats_rotation_cache = {}
+        if changed & {'api_concurrency', 'api_concurrency_bulk'}:
+            # Calls in flight finish under the old limiters, counted in the
+            # same shared counts as the new ones with --workers
+            self.api_concurrency = settings['api_concurrency']
+            self.api_concurrency_bulk = settings['api_concurrency_bulk']
+            self.limiters = {}
+        if changed & {'circuit_breaker', 'circuit_breaker_max_backoff'}:
+            self.circuit_breaker = settings['circuit_breaker']
+            self.circuit_breaker_max_backoff = settings['circuit_breaker_max_backoff']
+            # Breakers open under the old thresholds start closed again, the
+            # last good responses are kept for the next failure
+            self.breakers = {}
+        if changed & {'throttle', 'throttle_load', 'throttle_latency', 'throttle_max_interval'}:
+            self.throttle = settings['throttle']
+            self.throttle_load = settings['throttle_load']
+            self.throttle_latency = settings['throttle_latency']
+            self.throttle_max_interval = settings['throttle_max_interval']
+            if not self.throttle:
+                self.throttle_intervals = {}
+                self.throttle_cache = {}
+        if 'limits' in changed:
+            self.limits = settings['limits'] or {}
+        if 'json_decoder' in changed:
+            self.json_decoder = settings['json_decoder'] or next(iter(JSON_DECODERS))
+            self.json_loads = JSON_DECODERS[self.json_decoder]
+        if 'collections' in changed:
+            self.only_collections = settings['collections']
+        if 'collectors' in changed:
+            # Newly enabled ones are loaded when first called
+            self.collectors = settings['collectors']
+        if 'sample_interval' in changed:
+            self.sample_interval = settings['sample_interval']
+            if not self.sample_interval:
+                # Its thread stops after the current tick
+                self.sampler = None
+        if 'sample_window' in changed:
+            self.sample_window = settings['sample_window']
+        if 'sample_buffer' in changed:
+            # Buffers of the old size are dropped with the sampler
+            self.sample_buffer = settings['sample_buffer']
+            self.sampler = None
+        if changed & {'snapshots_interval', 'snapshots_page_size', 'snapshots_pages'}:
+            self.snapshots_interval = settings['snapshots_interval']
+            self.snapshots_pages = settings['snapshots_pages']
+            if settings['snapshots_page_size'] != self.snapshots_page_size:
+                # Offsets of a walk in progress are in the old page size, so
+                # start over, keeping the inventory of the last complete walk
+                self.snapshots_page_size = settings['snapshots_page_size']
+                if self.snapshot_walk is not None:
+                    self.snapshot_walk = None
+                    self.snapshot_walk_started = None
+        return sorted(changed)
 
     def collect(self):
         metrics = []
+        self.scrape_trace = []
+        self.served_targets = set()
+        self.trace_start = time.monotonic()
+        self.scrape = ScrapeContext()
+        self.scrape_rss = None
+        if self.throttle:
+            self._throttle_update()
         for collection in self._collections(): 
             """ Collect metrics from all the _collect functions """
-            metrics = eval(f"self.{collection}()")
+            self.trace_collection = collection
+            started = (time.thread_time(), sys.getallocatedblocks(), _gc_totals[0], _gc_totals[1])
+            if self._throttled(collection):
+                metrics = self.throttle_cache[collection][1]
+            else:
+                metrics = eval(f"self.{collection}()")
+                if self.throttle and collection in self.throttled_collections:
+                    self.throttle_cache[collection] = (time.monotonic(), metrics)
+            self._usage(collection, started, metrics)
             for metric in metrics:
                 """ Return all the metrics """
                 yield metric
+        self.last_scrape_trace = self.scrape_trace
+        self.scrape = None
+
+    def _usage(self, collection, started, metrics):
+        """ Add up what one run of a collector cost """
+
+        # Only counters the interpreter keeps anyway are read, so this is
+        # cheap enough to do on every scrape. Retained blocks is the net
+        # number of memory blocks a run left allocated, which catches growth
+        # but not short-lived allocations. The RSS after each collector gives
+        # the peak of the scrape, give or take what a collector frees again
+        # before it returns.
+        (cpu, blocks, collections, gc_seconds) = started
+        with self.usage_lock:
+            usage = self._usage_entry(collection)
+            usage[0] += time.thread_time() - cpu
+            usage[1] += sum(len(metric.samples) for metric in metrics)
+            usage[3] += _gc_totals[0] - collections
+            usage[4] += _gc_totals[1] - gc_seconds
+            usage[5] = sys.getallocatedblocks() - blocks
+        current = rss()
+        if current is not None:
+            self.scrape_rss = max(self.scrape_rss or 0, current)
+
+    def _usage_entry(self, collection):
+        if collection not in self.usage:
+            self.usage[collection] = [0.0, 0, 0, 0, 0.0, 0]
+        return self.usage[collection]
 
     def _collections(self):
-        """ List of collect functions in this class to call """
-        return [x for x, y in TrueNasCollector.__dict__.items() if type(y) == FunctionType and y.__name__.startswith("_collect_")]
+        """ List of collect functions to call """
+        return [collection for collection in truenas_collectors.COLLECTORS
+            if (self.collectors is None or collection[len('_collect_'):] in self.collectors)
+            and (self.only_collections is None or collection in self.only_collections)] + self.process_collections
+
+    def _top(self, family, combine):
+        """ TopN for a family given a --limit, otherwise None """
+        if not self.limits.get(family):
+            return None
+        return TopN(self.limits[family], combine)
+
+    def _throttle_update(self):
+        """ Pick refresh intervals for the expensive collectors from NAS load """
+
+        # Two signals, each scaled so that 1.0 is the configured threshold:
+        # the 1-minute load average per core from the collectd load source,
+        # and the moving average of API GET latency measured by request().
+        # Above 1.0, the interval grows linearly to --throttle-max-interval at
+        # twice the threshold. At or below 1.0, every scrape refreshes again.
+        if self.load_average is not None and self.cores:
+            self.throttle_pressure['load'] = self.load_average / self.cores / self.throttle_load
+        if self.api_latency is not None:
+            self.throttle_pressure['latency'] = self.api_latency / self.throttle_latency
+
+        pressure = max(self.throttle_pressure.values())
+        interval = 0
+        if pressure > 1:
+            interval = min(self.throttle_max_interval, self.throttle_max_interval*(pressure - 1))
+        for collection in self.throttled_collections:
+            self.throttle_intervals[collection] = interval
+
+    def _throttled(self, collection):
+        """ Whether to serve a collector's previous metrics instead of running it """
+        if not self.throttle or collection not in self.throttle_cache:
+            return False
+        (last_run, metrics) = self.throttle_cache[collection]
+        if time.monotonic() - last_run >= self.throttle_intervals.get(collection, 0):
+            return False
+        if collection == '_collect_stats':
+            # Keep the load signal fresh with a tiny stats request, otherwise
+            # the interval could never shrink again.
+            self._throttle_probe_load()
+        return True
+
+    def _throttle_probe_load(self):
+        """ Fetch only the 1-minute load average from collectd """
+        request_timestamp = int(datetime.now().timestamp())
+        data = self._stats_request({
+            "stats_list": [{
+                "source": "load",
+                "type": "load",
+                "dataset": "shortterm"
+            }],
+            "stats-filter": {
+                "start": request_timestamp-900,
+                "end": request_timestamp
+            }
+        })
+        if len(data['data']) > 0:
+            value = self._stats_latest_data(0, data['data'])
+            if value:
+                self.load_average = float(value)
+
+    def request(self, apipath, data=None, params=None):
+        return self.request_traced(apipath, data, params)[0]
+
+    def request_traced(self, apipath, data=None, params=None):
+        """ request(), with the scrape trace record of the call that answered it """
+
+        # self.scrape_trace is shared with prefetches and other scrapes, so
+        # its last record isn't necessarily this call's. A memo hit gets the
+        # record of the call it shares. The record is None if that call
+        # raised.
+        if data is None and self.scrape is not None:
+            return self.scrape.request(apipath, params, lambda: self._request_traced(apipath, data, params))
+        return self._request_traced(apipath, data, params)
+
+    def _prefetched(self, collection, apipath):
+        """ _request_traced() on a prefetch thread, traced to collection """
+        self.trace_collection = collection
+        return self._request_traced(apipath)
+
+    def _request_traced(self, apipath, data=None, params=None):
+        traces = []
+        try:
+            result = self._request(apipath, data, params, traces)
+        except BaseException:
+            # Don't leave other threads waiting on a trial call that raised
+            breaker = self.breakers.get(apipath)
+            if breaker is not None:
+                breaker.abandoned()
+            raise
+        return (result, traces[-1])
+
+    def prefetch(self, apipaths):
+        """ Start GETs this scrape will need in the background """
+        if self.scrape is not None:
+            self.scrape.prefetch(self, apipaths)
+
+    def api_slot(self, apipath):
+        """ Context holding a --api-concurrency slot for a call to the current target """
+        if not self.api_concurrency:
+            return contextlib.nullcontext()
+        limiter = self.limiters.get(self.target)
+        if limiter is None:
+            limiter = self.limiters.setdefault(self.target,
+                RequestLimiter(self.api_concurrency, self.api_concurrency_bulk,
+                    self.shared_limits.get(self.target), self.shared_process))
+        return limiter.slot(apipath)
+
+    def disk_index(self):
+        """ Disk records by name, from this scrape's disk inventory """
+
+        # The last good inventory is kept, so a failed disk call doesn't take
+        # the serials and models off everything labeled from it.
+        def build():
+            disks = self.request('disk')
+            if disks:
+                self.disk_inventory = {disk.name: disk for disk in disks}
+            return self.disk_inventory
+        if self.scrape is None:
+            return build()
+        return self.scrape.index('disks', build)
+
+    def _request(self, apipath, data=None, params=None, traces=None):
+        request_start = time.monotonic()
+        # Another thread may fail over while this call is under way
+        target = self.target
+        # Timeline of this scrape's API calls for /debug/scrape-trace
+        trace = {
+            'collector': self.trace_collection,
+            'method': 'POST' if data else 'GET',
+            'path': apipath,
+            'target': target,
+            'start': request_start - self.trace_start,
+            'seconds': 0,
+            'status': None,
+            'bytes': 0,
+            'decode_seconds': 0,
+            'queue_seconds': 0,
+            'result': 'ok'
+        }
+        self.scrape_trace.append(trace)
+        if traces is not None:
+            # Every attempt, in order, when failover retries
+            traces.append(trace)
+
+        breaker = None
+        if self.circuit_breaker:
+            breaker = self.breakers.get(apipath)
+            if breaker is None:
+                breaker = self.breakers.setdefault(apipath,
+                    CircuitBreaker(self.circuit_breaker, max_backoff=self.circuit_breaker_max_backoff))
+            if not breaker.allow():
+                trace['result'] = 'rejected'
+                return self._request_stale(apipath, data, params)
+        if self.targets_down == self.trace_start:
+            # No --target address answered when probed during this scrape
+            trace['result'] = 'unreachable'
+            return self._request_failed(breaker, apipath, data, params)
 
-    def request(self, apipath, data=None):
         try:
-            request_path = f'https://{self.target}/api/v2.0/{apipath}'
-            if data:
-                r = requests.post(
-                    request_path,
-                    auth=(self.username, self.password),
-                    headers={'Content-Type': 'application/json'},
-                    verify=False,
-                    json=data,
-                    timeout=15
-                )
-            else:
-                r = requests.get(
-                    request_path,
-                    auth=(self.username, self.password),
-                    headers={'Content-Type': 'application/json'},
-                    verify=False,
-                    timeout=15
-                )
+            request_path = f'https://{target}/api/v2.0/{apipath}'
+            with self.api_slot(apipath):
+                trace['queue_seconds'] = time.monotonic() - request_start
+                if data:
+                    r = requests.post(
+                        request_path,
+                        auth=(self.username, self.password),
+                        headers={'Content-Type': 'application/json'},
+                        verify=False,
+                        json=data,
+                        timeout=self.timeout
+                    )
+                else:
+                    r = requests.get(
+                        request_path,
+                        auth=(self.username, self.password),
+                        headers={'Content-Type': 'application/json'},
+                        verify=False,
+                        params=params,
+                        timeout=self.timeout
+                    )
         except requests.exceptions.ReadTimeout as e:
             print(f'Timeout requesting {request_path}...', file=sys.stderr)
             print(str(e), file=sys.stderr)
-            return {}
+            trace['seconds'] = time.monotonic() - request_start
+            trace['result'] = 'timeout'
+            if self._failover(target):
+                return self._request(apipath, data, params, traces)
+            return self._request_failed(breaker, apipath, data, params)
         except requests.exceptions.ConnectionError as e:
             print(f'Connection error requesting {request_path}...',
                   file=sys.stderr)
             print(str(e), file=sys.stderr)
-            return {}
-        return r.json()
-
-    @rsynctask_timer.time()
-    def _collect_rsynctask(self):
-        rsynctask = self.request('rsynctask')
-
-        progress = GaugeMetricFamily(
-            'truenas_rsynctask_progress',
-            'Progress of last rsynctask job',
-            labels=["description", "localpath", "remotehost", "remotepath", "direction", "enabled"])
-        state = GaugeMetricFamily(
-            'truenas_rsynctask_state',
-            'Current state of rsynctask job: 0==UNKNOWN, 1==RUNNING, 2==SUCCESS, 3==FAILED',
-            labels=["description", "localpath", "remotehost", "remotepath", "direction", "enabled"])
-        elapsed = GaugeMetricFamily(
-            'truenas_rsynctask_elapsed_seconds',
-            'Elapsed time in seconds of last rsynctask job',
-            labels=["description", "localpath", "remotehost", "remotepath", "direction", "enabled"])
-
-        for sync in rsynctask:
-            if sync['job']['progress']['percent']:
-                progress.add_metric(
-                    [sync['desc'], sync['path'], sync['remotehost'], sync['remotepath'], sync['direction'], str(sync['enabled'])],
-                    sync['job']['progress']['percent']
-                )
-            state.add_metric(
-                [sync['desc'], sync['path'], sync['remotehost'], sync['remotepath'], sync['direction'], str(sync['enabled'])],
-                self._rsynctask_state_enum(sync['job']['state'])
-            )
-            if sync['job']['time_finished']:
-                elapsed.add_metric(
-                    [sync['desc'], sync['path'], sync['remotehost'], sync['remotepath'], sync['direction'], str(sync['enabled'])],
-                    sync['job']['time_finished']['$date'] - sync['job']['time_started']['$date']
-                )
-            else:
-                elapsed.add_metric(
-                    [sync['desc'], sync['path'], sync['remotehost'], sync['remotepath'], sync['direction'], str(sync['enabled'])],
-                    1000*datetime.now().timestamp() - sync['job']['time_started']['$date']
-                )
-
-
-        return [progress, state, elapsed]
-
-    def _rsynctask_state_enum(self, value):
-        if value == "RUNNING":
-            return 1
-        if value == "SUCCESS":
-            return 2
-        if value == "FAILED":
-            return 3
-
-        unknown_enumerations.inc()
-        print(f"Unknown/new rsynctask state: {value}. Needs to be added to " +
-            " TrueNasCollector._rsynctask_state_enum()", file=sys.stderr)
-        return 0
-
-    @cloudsync_timer.time()
-    def _collect_cloudsync(self):
-        cloudsync = self.request('cloudsync')
-
-        progress = GaugeMetricFamily(
-            'truenas_cloudsync_progress',
-            'Progress of last CloudSync job',
-            labels=["description", "path"])
-        state = GaugeMetricFamily(
-            'truenas_cloudsync_state',
-            'Current state of CloudSync job: 0==UNKNOWN, 1==RUNNING, 2==SUCCESS, 3==NEVER, 4==FAILED, 5==ABORTED, 6==WAITING',
-            labels=["description", "path"])
-        result = GaugeMetricFamily(
-            'truenas_cloudsync_result',
-            'Result of last CloudSync job: 0==UNKNOWN, 1==None, 2==NEVER',
-            labels=["description", "path"])
-        elapsed = GaugeMetricFamily(
-            'truenas_cloudsync_elapsed_seconds',
-            'Elapsed time in seconds of last CloudSync job',
-            labels=["description", "path"])
-
-        for sync in cloudsync:
-            if sync['job']:
-                if sync['job']['progress']['percent']:
-                    progress.add_metric(
-                        [sync['description'], sync['path']],
-                        sync['job']['progress']['percent']
-                    )
-                else:
-                    progress.add_metric(
-                        [sync['description'], sync['path']],
-                        -1
-                    )
-                state.add_metric(
-                    [sync['description'], sync['path']],
-                    self._cloudsync_state_enum(sync['job']['state'])
-                )
-                result.add_metric(
-                    [sync['description'], sync['path']],
-                    self._cloudsync_result_enum(sync['job']['result'])
-                )
-                if sync['job']['time_finished']:
-                    elapsed.add_metric(
-                        [sync['description'], sync['path']],
-                        sync['job']['time_finished']['$date'] - sync['job']['time_started']['$date'] 
-                    )
-                else:
-                    elapsed.add_metric(
-                        [sync['description'], sync['path']],
-                        1000*datetime.now().timestamp() - sync['job']['time_started']['$date']
-                    )
+            trace['seconds'] = time.monotonic() - request_start
+            trace['result'] = 'connection error'
+            if self._failover(target):
+                return self._request(apipath, data, params, traces)
+            return self._request_failed(breaker, apipath, data, params)
+        except SlotTimeout as e:
+            print(str(e), file=sys.stderr)
+            api_queue_timeouts.labels(RequestLimiter.NAMES[RequestLimiter.priority(apipath)]).inc()
+            trace['seconds'] = time.monotonic() - request_start
+            trace['queue_seconds'] = trace['seconds']
+            trace['result'] = 'queue timeout'
+            return self._request_failed(breaker, apipath, data, params)
+
+        latency = time.monotonic() - request_start
+        trace['seconds'] = latency
+        trace['status'] = r.status_code
+        trace['bytes'] = len(r.content)
+        if trace['collector'] is not None:
+            with self.usage_lock:
+                self._usage_entry(trace['collector'])[2] += trace['bytes']
+
+        if self.throttle and not data:
+            # Moving average of GET latency as a throttling signal. POSTs are
+            # only bulk stats requests, which are slow no matter what. Time
+            # spent waiting for --api-concurrency is our own doing.
+            latency -= trace['queue_seconds']
+            if self.api_latency is None:
+                self.api_latency = latency
             else:
-                state.add_metric(
-                    [sync['description'], sync['path']],
-                    self._cloudsync_state_enum("NEVER")
-                )
-                result.add_metric(
-                    [sync['description'], sync['path']],
-                    self._cloudsync_result_enum("NEVER")
-                )                
-        
-        return [progress, state, result, elapsed]
-
-    def _cloudsync_state_enum(self, value):
-        if value == "RUNNING":
-            return 1
-        if value == "SUCCESS":
-            return 2
-        if value == "NEVER":
-            return 3
-        if value == "FAILED":
-            return 4
-        if value == "ABORTED":
-            return 5
-        if value == "WAITING":
-            return 6
-
-        unknown_enumerations.inc()
-        print(f"Unknown/new CloudSync state: {value}. Needs to be added to " +
-            " TrueNasCollector._cloudsync_state_enum()", file=sys.stderr)
-        return 0
-
-    def _cloudsync_result_enum(self, value):
-        if value is None:
-            return 1
-        if value == "NEVER":
-            return 2
-
-        unknown_enumerations.inc()
-        print(f"Unknown/new CloudSync result: {value}. Needs to be added to " +
-            " TrueNasCollector._cloudsync_result_enum()", file=sys.stderr)
-        return 0
-
-    @alerts_timer.time()
-    def _collect_alerts(self):
-        alerts = self.request('alert/list')
-
-        count = GaugeMetricFamily(
-            'truenas_alerts',
-            'Current count of un-dismissed alerts',
-            labels=["node", "klass", "level"])
-
-        counts = {}
-        for alert in alerts:
-            if alert['dismissed']:
-                continue
-            key = f"{alert['klass']}_{alert['level']}_{alert['node']}"
-            if not key in counts:
-                counts[key] = 0
-            counts[key] += 1
-
-        for metric in counts:
-            (klass, level, node) = metric.split('_', 2)
-            count.add_metric(
-                [node, klass, level],
-                counts[metric]
-            )
-        return [count]
+                self.api_latency = 0.8*self.api_latency + 0.2*latency
 
-    @disks_timer.time()
-    def _collect_disks(self):
-        disks = self.request('disk')
+        if r.status_code >= 500 and self._failover(target):
+            trace['result'] = 'server error'
+            return self._request(apipath, data, params, traces)
+        self.served_targets.add(target)
 
-        metrics = GaugeMetricFamily(
-            'truenas_disk_bytes',
-            'Disk size/info inventory',
-            labels=["name", "serial", "type", "model"])
+        if breaker and r.status_code >= 500:
+            print(f'Error {r.status_code} requesting {request_path}...',
+                  file=sys.stderr)
+            trace['result'] = 'server error'
+            return self._request_failed(breaker, apipath, data, params)
+
+        decode_start = time.monotonic()
+        if len(r.content) > 1048576 and gc.isenabled():
+            # Decoding a big response creates a huge number of containers that
+            # all survive, so the garbage collector only wastes time on them
+            gc.disable()
+            try:
+                result = parse_records(apipath, self.json_loads(r.content))
+            finally:
+                gc.enable()
+        else:
+            result = parse_records(apipath, self.json_loads(r.content))
+        trace['decode_seconds'] = time.monotonic() - decode_start
+
+        if breaker:
+            breaker.success()
+            if not data and not params:
+                self.last_good[apipath] = (time.time(), result)
+            self.stale.pop(apipath, None)
+        return result
+
+    def _failover(self, failed):
+        """ Switch to another --target address if `failed`, the current one, is down """
+
+        # All the addresses are probed at once with a short timeout, at most
+        # once per scrape. A controller that says it is MASTER (or SINGLE)
+        # wins, in --target order but keeping the current one if it qualifies.
+        # Otherwise anything that answered at all will do. If nothing
+        # answered, the rest of the scrape fails fast instead of waiting out
+        # the timeout on every request. Calls failing at the same time wait
+        # for one probe, and retry if it moved on from their address.
+        with self.failover_lock:
+            if self.target != failed:
+                return True
+            if len(self.targets) < 2 or self.failover_probed == self.trace_start:
+                return False
+            self.failover_probed = self.trace_start
+            with ThreadPoolExecutor(max_workers=len(self.targets)) as executor:
+                states = dict(zip(self.targets, executor.map(self._probe, self.targets)))
+
+            candidates = [target for target in self.targets if states[target] in ['MASTER', 'SINGLE']]
+            candidates = candidates or [target for target in self.targets if states[target] is not None]
+            if not candidates:
+                print(f'No --target address answered: {", ".join(self.targets)}', file=sys.stderr)
+                self.targets_down = self.trace_start
+                return False
+            if self.target in candidates:
+                return False
+            print(f'Failing over from {self.target} to {candidates[0]} ({states[candidates[0]]})', file=sys.stderr)
+            failovers.inc()
+            self.target = candidates[0]
+            return True
+
+    def _probe(self, target):
+        """ failover/status of an address, 'UNKNOWN' if it can't say, None if it's down """
+        try:
+            r = requests.get(
+                f'https://{target}/api/v2.0/failover/status',
+                auth=(self.username, self.password),
+                headers={'Content-Type': 'application/json'},
+                verify=False,
+                timeout=self.failover_timeout
+            )
+        except requests.exceptions.RequestException:
+            return None
+        if r.status_code >= 500:
+            return None
+        try:
+            status = self.json_loads(r.content)
+        except ValueError:
+            status = None
+        return status if r.status_code == 200 and isinstance(status, str) else 'UNKNOWN'
+
+    def _request_failed(self, breaker, apipath, data, params=None):
+        """ Record a failed call with the circuit breaker, if there is one """
+        if not breaker:
+            return {}
+        breaker.failure()
+        return self._request_stale(apipath, data, params)
 
-        for disk in disks:
-            metrics.add_metric(
-                [disk['name'], disk['serial'], disk['type'], disk['model']],
-                disk['size']
-            )            
+    def _request_stale(self, apipath, data, params=None):
+        """ Last-known-good response for an endpoint we aren't calling now """
 
-        return [metrics]
+        # Only GET responses without a query are kept. POSTs like
+        # stats/get_data depend on the request body and time window, and a
+        # query like core/get_jobs' id__gte or a zfs/snapshot page on its
+        # parameters, so there is nothing sensible to serve for those.
+        if data or params or apipath not in self.last_good:
+            return {}
+        (timestamp, result) = self.last_good[apipath]
+        self.stale[apipath] = timestamp
+        return result
 
-    @interfaces_timer.time()
-    def _collect_interfaces(self):
-        if self.skip_snmp:
+    def _collect_circuit_breakers(self):
+        """ State of the per-endpoint circuit breakers used by request() """
+        if not self.circuit_breaker:
             return []
 
-        interfaces = self.request('interface')
-
-        metrics = GaugeMetricFamily(
-            'truenas_interface_state',
-            'Interface state/info inventory:  0==UNKNOWN, 1==LINK_STATE_UP, 2==LINK_STATE_DOWN',
-            labels=["name", "description", "type"])
-
-        for interface in interfaces:
-            metrics.add_metric(
-                [interface['name'], interface['description'] or "", interface['type']],
-                self._interfaces_state_enum(interface['state']['link_state'])
-            )            
-
-        return [metrics]
-
-    def _interfaces_state_enum(self, value):
-        if value == "LINK_STATE_UP":
-            return 1
-        if value == "LINK_STATE_DOWN":
-            return 2
-
-        unknown_enumerations.inc()
-        print(f"Unknown/new Interface state: {value}. Needs to be added to " +
-            " TrueNasCollector._interfaces_state_enum()", file=sys.stderr)
-        return 0
-
-    @datasets_timer.time()
-    def _collect_pool_datasets(self):
-        if self.skip_snmp:
+        state = GaugeMetricFamily(
+            'truenas_exporter_circuit_breaker_state',
+            'Circuit breaker state per API endpoint: 0=CLOSED 1=OPEN 2=HALF_OPEN',
+            labels=["endpoint"])
+        rejected = CounterMetricFamily(
+            'truenas_exporter_circuit_breaker_rejected',
+            'API calls not made because the circuit breaker was open',
+            labels=["endpoint"])
+        stale = GaugeMetricFamily(
+            'truenas_exporter_stale_data_seconds',
+            'Age of last-known-good data served in place of a failed or rejected API call',
+            labels=["endpoint"])
+
+        nowstamp = time.time()
+        for apipath, breaker in self.breakers.items():
+            state.add_metric([apipath], breaker.state)
+            rejected.add_metric([apipath], breaker.rejected)
+            if apipath in self.stale:
+                stale.add_metric([apipath], nowstamp - self.stale[apipath])
+
+        return [state, rejected, stale]
+
+    def _collect_throttle(self):
+        """ Refresh intervals chosen by --throttle and the load behind them """
+        if not self.throttle:
             return []
 
-        datasets = self.request('pool/dataset')
-
-        size = GaugeMetricFamily(
-            'truenas_pool_dataset_max_bytes',
-            'Dataset size in bytes',
-            labels=["name", "pool", "type"])
-        used = GaugeMetricFamily(
-            'truenas_pool_dataset_used_bytes',
-            'Dataset used in bytes',
-            labels=["name", "pool", "type"])
-        children = GaugeMetricFamily(
-            'truenas_pool_dataset_children',
-            'Number of children inside dataset',
-            labels=["name", "pool", "type"])
-        encrypted = GaugeMetricFamily(
-            'truenas_pool_dataset_encrypted',
-            'Dataset encryption enabled?',
-            labels=["name", "pool", "type"])
-        locked = GaugeMetricFamily(
-            'truenas_pool_dataset_locked',
-            'Dataset encryption locked?',
-            labels=["name", "pool", "type"])
-
-        for dataset in datasets:
-            size.add_metric(
-                [dataset['name'], dataset['pool'], dataset['type']],
-                dataset['available']['parsed']
-            )
-            used.add_metric(
-                [dataset['name'], dataset['pool'], dataset['type']],
-                dataset['used']['parsed']
-            )
-            children.add_metric(
-                [dataset['name'], dataset['pool'], dataset['type']],
-                len(dataset['children'])
-            )
-            encrypted.add_metric(
-                [dataset['name'], dataset['pool'], dataset['type']],
-                int(dataset['encrypted'])
-            )
-            locked.add_metric(
-                [dataset['name'], dataset['pool'], dataset['type']],
-                int(dataset['locked'])
-            )
+        intervals = GaugeMetricFamily(
+            'truenas_exporter_throttle_interval_seconds',
+            'Minimum seconds between refreshes of a collector chosen from TrueNAS load',
+            labels=["collector"])
+        pressure = GaugeMetricFamily(
+            'truenas_exporter_throttle_pressure',
+            'Load signal relative to its throttling threshold, throttled above 1',
+            labels=["signal"])
+
+        collections = self._collections()
+        for collection, interval in self.throttle_intervals.items():
+            if collection not in collections:
+                continue
+            intervals.add_metric([collection.replace('_collect_', '', 1)], interval)
+        for signal, value in self.throttle_pressure.items():
+            pressure.add_metric([signal], value)
 
-        return [size,used,children,encrypted,locked]
+        return [intervals, pressure]
 
-    @pools_timer.time()
-    def _collect_pool(self):
-        if self.skip_snmp:
+    def _collect_targets(self):
+        """ Which --target addresses answered API requests during this scrape """
+        if len(self.targets) < 2:
             return []
 
-        pools = self.request('pool')
-
-        status = GaugeMetricFamily(
-            'truenas_pool_status',
-            'Pool status: 0=UNKNOWN, 1=ONLINE',
-            labels=["name", "path"])
-        healthy = GaugeMetricFamily(
-            'truenas_pool_healthy',
-            'Pool health',
-            labels=["name", "path"])
-        disk_status = GaugeMetricFamily(
-            'truenas_pool_disk_status',
-            'Status of disk in pool: 0=UNKNOWN, 1=ONLINE',
-            labels=["name", "path", "device", "spare"])
-        disk_errors = CounterMetricFamily(
-            'truenas_pool_disk_errors',
-            'Count of errors on disk in pool',
-            labels=["name", "path", "device", "errortype"])
-
-        for pool in pools:
-            status.add_metric(
-                [pool['name'], pool['path']],
-                self._pool_health_enum(pool['status'])
-            )
-            healthy.add_metric(
-                [pool['name'], pool['path']],
-                int(pool['healthy'])
-            )
-            for topology in pool['topology']['data']:
-                for disk in topology['children']:
-                    label = "None"
-                    if 'disk' in disk:
-                        label = disk['disk']
-                    elif 'path' in disk:
-                        label = disk['path']
-                    label = label or "unlabelled"
-                    disk_status.add_metric(
-                        [pool['name'], pool['path'], label, "false"],
-                        self._pool_health_enum(disk['status'])
-                    )
-                    disk_errors.add_metric(
-                        [pool['name'], pool['path'], label, "read"],
-                        disk['stats']['read_errors']
-                    )
-                    disk_errors.add_metric(
-                        [pool['name'], pool['path'], label, "write"],
-                        disk['stats']['write_errors']
-                    )
-                    disk_errors.add_metric(
-                        [pool['name'], pool['path'], label, "checksum"],
-                        disk['stats']['checksum_errors']
-                    )
-            for disk in pool['topology']['spare']:
-                label = "None"
-                if 'disk' in disk:
-                    label = disk['disk']
-                elif 'path' in disk:
-                    label = disk['path']
-                label = label or "unlabelled"
-                disk_status.add_metric(
-                    [pool['name'], pool['path'], label, "true"],
-                    self._pool_health_enum(disk['status'])
-                )
-                disk_errors.add_metric(
-                    [pool['name'], pool['path'], label, "read"],
-                    disk['stats']['read_errors']
-                )
-                disk_errors.add_metric(
-                    [pool['name'], pool['path'], label, "write"],
-                    disk['stats']['write_errors']
-                )
-                disk_errors.add_metric(
-                    [pool['name'], pool['path'], label, "checksum"],
-                    disk['stats']['checksum_errors']
-                )
-
-        return [status, healthy, disk_status, disk_errors]
-
-    def _pool_health_enum(self, value):
-        if value == "ONLINE":
-            return 1
-        if value == "UNAVAIL":
-            return 2
-        if value == "DEGRADED":
-            return 3
-        if value == "REMOVED":
-            return 4
-        if value == "OFFLINE":
-            return 5
-
-        unknown_enumerations.inc()
-        print(f"Unknown/new Pool or Disk state: {value}. Needs to be added to " +
-            " TrueNasCollector._pool_health_enum()", file=sys.stderr)
-        return 0
-
-    @replications_timer.time()
-    def _collect_replications(self):
-        replications = self.request('replication')
-
-        state = GaugeMetricFamily(
-            'truenas_replication_state',
-            'Current replication state: 0=UNKNOWN 1=SUCCESS 2=RUNNING 3=FAILED 4=WAITING',
-            labels=["sources", "target", "target_system", "transport"])
-        last_finished = GaugeMetricFamily(
-            'truenas_replication_last_finished',
-            'Replication last finished',
-            labels=["sources", "target", "target_system", "transport"])
-        elapsed = GaugeMetricFamily(
-            'truenas_replication_last_elapsed',
-            'Last replication elapsed milliseconds',
-            labels=["sources", "target", "target_system", "transport"])
-        progress = GaugeMetricFamily(
-            'truenas_replication_progress',
-            'Current replication progress',
-            labels=["sources", "target", "target_system", "transport"])
-
-        for replication in replications:
-            if replication['transport'] == 'SSH+NETCAT':
-                labels = [
-                    ' '.join(replication['source_datasets']),
-                    replication['target_dataset'],
-                    replication['ssh_credentials']['attributes']['host'],
-                    replication['transport']
-                ]
-            elif replication['transport'] == 'LOCAL':
-                labels = [
-                    ' '.join(replication['source_datasets']),
-                    replication['target_dataset'],
-                    'localhost',
-                    replication['transport']
-                ]
-
-            if replication['job'] and 'state' in replication['job']:
-                state.add_metric(
-                    labels,
-                    self._replication_state_enum(replication['job']['state'])
-                )
-            if 'datetime' in replication['state']:
-                last_finished.add_metric(
-                    labels,
-                    replication['state']['datetime']['$date']
-                )
-            if replication['job'] is not None and 'time_started' in replication['job']:
-                if replication['job']['time_finished']:
-                    elapsed.add_metric(
-                        labels,
-                        replication['job']['time_finished']['$date'] - replication['job']['time_started']['$date']
-                    )
-                else:
-                    elapsed.add_metric(
-                        labels,
-                        1000*datetime.now().timestamp() - replication['job']['time_started']['$date']
-                    )
-            if replication['job'] is not None and replication['job']['progress']['percent']:
-                progress.add_metric(
-                    labels,
-                    replication['job']['progress']['percent']
-                )
-
-        return [state, last_finished, elapsed, progress]
-
-    def _replication_state_enum(self, value):
-        if value == "SUCCESS":
-            return 1
-        if value == "RUNNING":
-            return 2
-        if value == "FAILED":
-            return 3
-        if value == "WAITING":
-            return 4
-
-        unknown_enumerations.inc()
-        print(f"Unknown/new Replication state: {value}. Needs to be added to " +
-            " TrueNasCollector._replication_state_enum()", file=sys.stderr)
-        return 0
-
-    @snapshots_timer.time()
-    def _collect_pool_snapshot_tasks(self):
-        tasks = self.request('pool/snapshottask')
-
-        status = GaugeMetricFamily(
-            'truenas_pool_snapshot_task_status',
-            'Pool snapshot task status: 0=UNKNOWN, 1=FINISHED, 2=RUNNING, 3=ERROR, 4=PENDING, 5=HOLD',
-            labels=["dataset"])
-        timestamp = GaugeMetricFamily(
-            'truenas_pool_snapshot_task_timestamp',
-            'Pool snapshot task timestamp',
-            labels=["dataset"])
-
-        for task in tasks:
-            status.add_metric(
-                [task['dataset']],
-                self._pool_snapshottask_status_enum(task['state']['state'])
-            )
-            try:
-                if task['state']['datetime']:
-                    timestamp.add_metric(
-                        [task['dataset']],
-                        task['state']['datetime']['$date']
-                    )
-            except KeyError:
-                pass
-
-        return [status, timestamp]
-
-    def _pool_snapshottask_status_enum(self, value):
-        if value == "FINISHED":
-            return 1
-        elif value == 'RUNNING':
-            return 2
-        elif value == 'ERROR':
-            return 3
-        elif value == 'PENDING':
-            return 4
-        elif value == 'HOLD':
-            return 5
-
-        unknown_enumerations.inc()
-        print(f"Unknown/new Snapshot Task state: {value}. Needs to be added to " +
-            " TrueNasCollector._pool_snapshottask_status_enum()", file=sys.stderr)
-        return 0
-
-    @systeminfo_timer.time()
-    def _collect_system_info(self):
-        info = self.request('system/info')
-        network = self.request('network/configuration')
-
-        uptime = CounterMetricFamily(
-            'truenas_uptime',
-            'TrueNAS uptime',
-            labels=["hostname"])
-        cores = GaugeMetricFamily(
-            'truenas_cores',
-            'TrueNAS CPU core count',
-            labels=["hostname"])
-        memory = GaugeMetricFamily(
-            'truenas_memory',
-            'TrueNAS physical memory',
-            labels=["hostname"])
-        infometric = InfoMetricFamily(
-            'truenas',
-            'TrueNAS Information',
-            labels=["hostname", "version", "serial", "serial_ha", "model", "product", "manufacturer"])
-        ha = GaugeMetricFamily(
-            'truenas_ha',
-            'TrueNAS High Availability Controller Status: 0=N/A 1=hostname_1 master 2=hostname_2 master',
-            labels=["hostname", "hostname_1", "hostname_2"])
-
-        uptime.add_metric(
-            [info['hostname']],
-            info['uptime_seconds']
-        )
-        cores.add_metric(
-            [info['hostname']],
-            info['cores']
-        )
-        memory.add_metric(
-            [info['hostname']],
-            info['physmem']
-        )
-        infolabels = {
-            'hostname': info['hostname'],
-            'version': info['version'],
-            'serial': info['license']['system_serial'],
-            'serial_ha': info['license']['system_serial_ha'],
-            'model': info['license']['model'],
-            'product': info['system_product'],
-            'manufacturer': info['system_manufacturer']
-        }
-        infometric.add_metric(
-            infolabels.keys(),
-            infolabels
-        )
-        ha_status = 0
-        if network['hostname_virtual'] and network['hostname_local'] == network['hostname']:
-            ha_status = 1
-        elif network['hostname_virtual'] and network['hostname_local'] == network['hostname_b']:
-            ha_status = 2
-        ha.add_metric(
-            [info['hostname'], network['hostname'], network['hostname_b']],
-            ha_status
-        )
-
-        return [uptime, cores, memory, infometric, ha]
-
-    @enclosure_timer.time()
-    def _collect_enclosure(self):
-        enclosure = self.request('enclosure')
-
-        health_metrics = GaugeMetricFamily(
-            'truenas_enclosure_health',
-            'TrueNAS enclosure device metrics',
-            labels=["devicename", "devicemodel", "metrictype", "metricdevice", "metricelement"])
-        health_status = GaugeMetricFamily(
-            'truenas_enclosure_status',
-            'TrueNAS enclosure device health 0=UNKNOWN, 1=OK or (OK, Swapped), 2=Unknown/Not-installed 3=Critical, 4=Unsupported, 5=(Not Installed, Swapped)',
-            labels=["devicename", "devicemodel", "metrictype", "metricdevice", "metricelement"])
-
-        for device in enclosure:
-            devicename = device['name']
-            devicemodel = device['model']
-            for elementname in device['elements']:
-                metrictype = elementname
-                element = device['elements'][elementname]
-                for leafname in element:
-                    metricdevice = f"{elementname} {leafname}"
-                    leaf = element[leafname]
-                    metricelement = leaf['descriptor']
-
-                    health_metrics.add_metric(
-                        [devicename, devicemodel, metrictype, metricdevice, metricelement],
-                        self._enclosure_status_enum(leaf['status'])
-                    )
-
-                    if leaf['value'] and leaf['status'] not in ['Unknown', 'Not installed']:
-                        if metrictype == "Cooling":
-                            health_status.add_metric(
-                                [devicename, devicemodel, metrictype, metricdevice, metricelement],
-                                float(leaf['value'].split()[0])
-                            )
-                        elif metrictype == "Enclosure Services Controller Electronics":
-                            health_status.add_metric(
-                                [devicename, devicemodel, metrictype, metricdevice, metricelement],
-                                leaf['value']
-                            )
-                        elif metrictype == "Temperature Sensor":
-                            health_status.add_metric(
-                                [devicename, devicemodel, metrictype, metricdevice, metricelement],
-                                float(leaf['value'].split('C')[0])
-                            )
-                        elif metrictype == "Voltage Sensor":
-                            health_status.add_metric(
-                                [devicename, devicemodel, metrictype, metricdevice, metricelement],
-                                float(leaf['value'].split('V')[0])
-                            )
-
-        return [health_metrics, health_status]
-
-    def _enclosure_status_enum(self, value):
-        if value in ["OK", "OK, Swapped"]:
-            return 1
-        elif value == "Unknown" or value == "Not installed":
-            return 2
-        elif value == "Critical":
-            return 3
-        elif value == "Unsupported":
-            return 4
-        elif value == "Not Installed, Swapped":
-            return 5
-
-        unknown_enumerations.inc()
-        print(f"Unknown/new enclosure health state: {value}. Needs to be added to " +
-            " TrueNasCollector._enclosure_status_enum()", file=sys.stderr)
-        return 0
-
-    @smarttests_timer.time()
-    def _collect_smarttest(self):
-
-        # self.cache_smart = cache_smart
-        # self.last_smart_result = {}
-        # self.last_smart_time = 0
-
-        nowstamp = int(datetime.now().timestamp())
-        if (nowstamp - self.last_smart_time) > (self.cache_smart):
-            smarttests = self.request('smart/test/results')
-            if smarttests:
-                self.last_smart_time = nowstamp
-                self.last_smart_result = smarttests
-        else:
-            smarttests = self.last_smart_result
-
-        smarttest = GaugeMetricFamily(
-            'truenas_smarttest_status',
-            'TrueNAS SMART test result: 0=UNKNOWN 1=SUCCESS 2=RUNNING 3=FAILED',
-            labels=['disk', 'description'])
-        cachetime = GaugeMetricFamily(
-            'truenas_smarttest_cache_age_seconds',
-            'Seconds since last check of the smart/tests/results API.')
-        lifetime = CounterMetricFamily(
-            'truenas_smarttest_lifetime',
-            'TrueNAS SMART lifetime',
-            labels=['disk','description'])
-
-        cachetime.add_metric([], nowstamp-self.last_smart_time)
-
-        for disk in smarttests:
-            if (len(disk['tests']) > 0):
-                smarttest.add_metric(
-                    [disk['disk'], disk['tests'][0]['description']],
-                    self._smart_test_result_enum(disk['tests'][0]['status'])
-                )
-                if disk['tests'][0]['lifetime']:
-                    lifetime.add_metric(
-                        [disk['disk'], disk['tests'][0]['description']],
-                        disk['tests'][0]['lifetime']
-                    )
-
-        return [smarttest, cachetime, lifetime]
-
-    def _smart_test_result_enum(self, value):
-        if value == "SUCCESS":
-            return 1
-        elif value == "RUNNING":
-            return 2
-        elif value == "FAILED":
-            return 3
-
-        unknown_enumerations.inc()
-        print(f"Unknown/new SMART health state: {value}. Needs to be added to " +
-            " TrueNasCollector._smart_test_result_enum()", file=sys.stderr)
-        return 0
-
-    @stats_timer.time()
-    def _collect_stats(self):
-        """ Return all current data from CollectD collections """
-
-        # This is complicated for a bunch of performance reasons
-        # /api/v2.0/stats/get_sources and available metrics for the source
-        #
-        # You can get the definition for a source/metric from above by sending a
-        # POST like {"source": "zfs_arc", "type": "hash_collisions"} to
-        # /api/v2.0/stats/get_dataset_info
-        #
-        # Requesting that for all items in the get_sources results one at a time
-        # takes a prohibitively long time. Information from that process was
-        # used to build this function that cycles through the hardware inventory
-        # from /stats/get_sources and uses it to build a list of metrics to
-        # request data from
-        #
-        # The actual data from these sources can be done with a single request
-        # to /api/v2.0/stats/get_data, using the structure for each source
-        # derived above.
-        #
-        # After all that, there's no way to get "the most recent data point" for
-        # a given metric. As a result, we are requesting the metrics from 30s
-        # ago because those should exist by now. Requesting metrics for "now"
-        # will yield None for the values.
-
-        stats = self.request('stats/get_sources')
-
-        skip_df_regex = None
-
-        if self.skip_df_regex:
-            skip_df_regex = re.compile(self.skip_df_regex)
-
-        collectd = GaugeMetricFamily(
-            'truenas_collectd',
-            'TrueNAS CollectD Metrics',
-            labels=['source', 'metric', 'submetric', 'metrictype'])
-
-        sources = {}
-        sources['cpu'] = ['aggregation-cpu-average', 'aggregation-cpu-sum']
-        sources['temperature'] = []
-        sources['ctl'] = ['ctl-ioctl', 'ctl-tpc']
-        sources['df'] = []
-        sources['disk'] = []
-        sources['interface'] = []
-
-        disk_list = []
-
-        for source in stats:
-            if source.split('-')[0] == 'cpu':
-                sources['cpu'] += [source]
-            elif source.split('-')[0] == 'cputemp':
-                sources['temperature'] += [source]
-            elif source.split('-')[0] == 'df':
-                sources['df'] += [source]
-            elif source.split('-')[0] == 'disk':
-                sources['disk'] += [source]
-            elif source.split('-')[0] == 'disktemp':
-                sources['temperature'] += [source]
-            elif source.split('-')[0] == 'interface':
-                sources['interface'] += [source]
-
-        request_timestamp = int(datetime.now().timestamp())
-        sources_metadata = []
-        sources_request = {
-            "stats_list": [],
-            "stats-filter": {
-                "start": request_timestamp-900,
-                "end": request_timestamp
-            }
-        }
-
-        for source in sources['cpu']:
-            for metric in ['cpu-idle', 'cpu-nice', 'cpu-system', 'cpu-interrupt', 'cpu-user']:
-                sources_request['stats_list'] += [{
-                    "source": source,
-                    "type": metric,
-                    "dataset": "value"
-                }]
-                sources_metadata += [{
-                    "source": source,
-                    "metric": metric,
-                    "submetric": "value",
-                    "metrictype": "DERIVE"
-                }]
-        for source in sources['temperature']:
-            sources_request['stats_list'] += [{
-                "source": source,
-                "type": "temperature",
-                "dataset": "value"
-            }]
-            sources_metadata += [{
-                "source": source,
-                "metric": "temperature",
-                "submetric": "value",
-                "metrictype": "GAUGE"
-            }]
-        for source in sources['ctl']:
-            for metric in ['disk_octets', 'disk_octets-0-0', 'disk_ops', 'disk_ops-0-0', 'disk_time', 'disk_time-0-0']:
-                for submetric in ['read', 'write']:
-                    sources_request['stats_list'] += [{
-                        "source": source,
-                        "type": metric,
-                        "dataset": submetric
-                    }]
-                    sources_metadata += [{
-                        "source": source,
-                        "metric": metric,
-                        "submetric": submetric,
-                        "metrictype": "DERIVE"
-                    }]
-        for source in sources['df']:
-            for metric in ['df_complex-free', 'df_complex-reserved', 'df_complex-used']:
-                if self.skip_df_regex and not skip_df_regex.search(source):
-                    # Only get these metrics if they aren't in the optional skip_df_regex
-                    sources_request['stats_list'] += [{
-                        "source": source,
-                        "type": metric,
-                        "dataset": "value"
-                    }]
-                    sources_metadata += [{
-                        "source": source,
-                        "metric": metric,
-                        "submetric": "value",
-                        "metrictype": "GAUGE"
-                    }]
-        for source in sources['disk']:
-            disk_list += [source.split('-')[1]]
-            for metric in ['disk_octets', 'disk_ops', 'disk_time']:
-                for submetric in ['read', 'write']:
-                    sources_request['stats_list'] += [{
-                        "source": source,
-                        "type": metric,
-                        "dataset": submetric
-                    }]
-                    sources_metadata += [{
-                        "source": source,
-                        "metric": metric,
-                        "submetric": submetric,
-                        "metrictype": "DERIVE"
-                    }]
-        for source in sources['disk']:
-            for submetric in ['io_time', 'weighted_io_time']:
-                sources_request['stats_list'] += [{
-                    "source": source,
-                    "type": 'disk_io_time',
-                    "dataset": submetric
-                }]
-                sources_metadata += [{
-                    "source": source,
-                    "metric": 'disk_io_time',
-                    "submetric": submetric,
-                    "metrictype": "DERIVE"
-                }]
-        for disk in disk_list:
-            sources_request['stats_list'] += [{
-                "source": 'geom_stat',
-                "type": '-'.join(['geom_busy_percent', disk]),
-                "dataset": "value"
-            }]
-            sources_metadata += [{
-                "source": 'geom_stat',
-                "metric": '-'.join(['geom_busy_percent', disk]),
-                "submetric": "value",
-                "metrictype": "GAUGE"
-            }]
-        for disk in disk_list:
-            for metric in ['geom_ops', 'geom_queue']:
-                sources_request['stats_list'] += [{
-                    "source": 'geom_stat',
-                    "type": '-'.join([metric, disk]),
-                    "dataset": "length"
-                }]
-                sources_metadata += [{
-                    "source": 'geom_stat',
-                    "metric": '-'.join([metric, disk]),
-                    "submetric": "length",
-                    "metrictype": "GAUGE"
-                }]
-        for disk in disk_list:
-            for metric in ['geom_bw', 'geom_latency', 'geom_ops_rwd']:
-                for submetric in ['delete', 'read', 'write']:
-                    sources_request['stats_list'] += [{
-                        "source": 'geom_stat',
-                        "type": '-'.join([metric, disk]),
-                        "dataset": submetric
-                    }]
-                    sources_metadata += [{
-                        "source": 'geom_stat',
-                        "metric": '-'.join([metric, disk]),
-                        "submetric": submetric,
-                        "metrictype": "GAUGE"
-                    }]
-        if self.skip_snmp == False:
-            for source in sources['interface']:
-                for metric in ['if_errors', 'if_octets', 'if_packets']:
-                    for submetric in ['rx', 'tx']:
-                        sources_request['stats_list'] += [{
-                            "source": source,
-                            "type": metric,
-                            "dataset": submetric
-                        }]
-                        sources_metadata += [{
-                            "source": source,
-                            "metric": metric,
-                            "submetric": submetric,
-                            "metrictype": "DERIVE"
-                        }]
-        for submetric in ['longterm', 'midterm', 'shortterm']:
-            sources_request['stats_list'] += [{
-                "source": "load",
-                "type": 'load',
-                "dataset": submetric
-            }]
-            sources_metadata += [{
-                "source": "load",
-                "metric": 'load',
-                "submetric": submetric,
-                "metrictype": "GAUGE"
-            }]
-        for metric in ['active', 'cache', 'free', 'inactive', 'laundry', 'wired']:
-            sources_request['stats_list'] += [{
-                "source": "memory",
-                "type": '-'.join(['memory', metric]),
-                "dataset": 'value'
-            }]
-            sources_metadata += [{
-                "source": "memory",
-                "metric": '-'.join(['memory', metric]),
-                "submetric": 'value',
-                "metrictype": "GAUGE"
-            }]
-        for source in ['nfsstat-client', 'nfsstat-server']:
-            for metric in ['access', 'commit', 'create', 'fsinfo', 'fsstat', 'getattr', 'link', 'lookup', 'mkdir', 'mknod', 'pathconf', 'read', 'readdir', 'readirplus', 'readlink', 'remove', 'rename', 'rmdir', 'setattr', 'symlink', 'write']:
-                sources_request['stats_list'] += [{
-                    "source": source,
-                    "type": '-'.join(['nfsstat', metric]),
-                    "dataset": 'value'
-                }]
-                sources_metadata += [{
-                    "source": "memory",
-                    "metric": '-'.join(['memory', metric]),
-                    "submetric": 'value',
-                    "metrictype": "DERIVE"
-                }]
-        for metric in ['blocked', 'idle', 'running', 'sleeping', 'stopped', 'wait', 'zombies']:
-            sources_request['stats_list'] += [{
-                "source": "processes",
-                "type": '-'.join(['ps_state', metric]),
-                "dataset": 'value'
-            }]
-            sources_metadata += [{
-                "source": "processes",
-                "metric": '-'.join(['ps_state', metric]),
-                "submetric": 'value',
-                "metrictype": "GAUGE"
-            }]
-        for metric in ['swap-free', 'swap-used']:
-            sources_request['stats_list'] += [{
-                "source": "swap",
-                "type": metric,
-                "dataset": 'value'
-            }]
-            sources_metadata += [{
-                "source": "swap",
-                "metric": metric,
-                "submetric": 'value',
-                "metrictype": "GAUGE"
-            }]
-        sources_request['stats_list'] += [{
-            "source": "uptime",
-            "type": "uptime",
-            "dataset": 'value'
-        }]
-        sources_metadata += [{
-            "source": "uptime",
-            "metric": "uptime",
-            "submetric": 'value',
-            "metrictype": "GAUGE"
-        }]
-        for metric in ['cache_eviction-cached', 'cache_eviction-eligible', 'cache_eviction-ineligible', 'cache_operation-allocated', 'cache_operation-deleted', 'cache_result-demand_data-hit', 'cache_result-demand_data-miss', 'cache_result-demand_metadata-hit', 'cache_result-demand_metadata-miss', 'cache_result-mfu-hit', 'cache_result-mfu_ghost-hit', 'cache_result-mru-hit', 'cache_result-mru_ghost-hit', 'cache_result-prefetch_data-hit', 'cache_result-prefetch_data-miss', 'cache_result-prefetch_metadata-hit', 'cache_result-prefetch_metadata-miss', 'hash_collisions', 'memory_throttle_count', 'mutex_operations-miss']:
-            sources_request['stats_list'] += [{
-                "source": "zfs_arc",
-                "type": metric,
-                "dataset": 'value'
-            }]
-            sources_metadata += [{
-                "source": "zfs_arc",
-                "metric": metric,
-                "submetric": 'value',
-                "metrictype": "DERIVE"
-            }]
-        for metric in ['cache_ratio-arc', 'cache_ratio-L2', 'cache_size-anon_size', 'cache_size-arc', 'cache_size-c', 'cache_size-c_max', 'cache_size-c_min', 'cache_size-hdr_size', 'cache_size-L2', 'cache_size-metadata_size', 'cache_size-mfu_ghost_size', 'cache_size-mfu_size', 'cache_size-mru_ghost_size', 'cache_size-mru_size', 'cache_size-other_size', 'cache_size-p']:
-            sources_request['stats_list'] += [{
-                "source": "zfs_arc",
-                "type": metric,
-                "dataset": 'value'
-            }]
-            sources_metadata += [{
-                "source": "zfs_arc",
-                "metric": metric,
-                "submetric": 'value',
-                "metrictype": "GAUGE"
-            }]
-        for submetric in ['rx', 'tx',]:
-            sources_request['stats_list'] += [{
-                "source": "zfs_arc",
-                "type": "io_octets-L2",
-                "dataset": submetric
-            }]
-            sources_metadata += [{
-                "source": "zfs_arc",
-                "metric": "io_octets-L2",
-                "submetric": submetric,
-                "metrictype": "DERIVE"
-            }]
-        for metric in ['arcstat_ratio_arc-hits', 'arcstat_ratio_arc-l2_hits', 'arcstat_ratio_arc-l2_misses', 'arcstat_ratio_arc-misses', 'arcstat_ratio_data-demand_data_hits', 'arcstat_ratio_data-demand_data_misses', 'arcstat_ratio_data-prefetch_data_hits', 'arcstat_ratio_data-prefetch_data_misses', 'arcstat_ratio_metadata-demand_metadata_hits', 'arcstat_ratio_metadata-demand_metadata_misses', 'arcstat_ratio_metadata-prefetch_metadata_hits', 'arcstat_ratio_metadata-prefetch_metadata_misses', 'arcstat_ratio_mu-mfu_ghost_hits', 'arcstat_ratio_mu-mfu_hits', 'arcstat_ratio_mu-mru_ghost_hits', 'arcstat_ratio_mu-mru_hits', 'gauge_arcstats_raw-l2_asize', 'gauge_arcstats_raw-l2_hdr_size', 'gauge_arcstats_raw-l2_size', 'gauge_arcstats_raw_arcmeta-arc_meta_limit', 'gauge_arcstats_raw_arcmeta-arc_meta_max', 'gauge_arcstats_raw_arcmeta-arc_meta_min', 'gauge_arcstats_raw_arcmeta-arc_meta_used', 'gauge_arcstats_raw_counts-allocated', 'gauge_arcstats_raw_counts-deleted', 'gauge_arcstats_raw_counts-mutex_miss', 'gauge_arcstats_raw_counts-recycle_miss', 'gauge_arcstats_raw_counts-stolen', 'gauge_arcstats_raw_cp-c', 'gauge_arcstats_raw_cp-c_max', 'gauge_arcstats_raw_cp-c_min', 'gauge_arcstats_raw_cp-p', 'gauge_arcstats_raw_demand-demand_data_hits', 'gauge_arcstats_raw_demand-demand_data_misses', 'gauge_arcstats_raw_demand-demand_metadata_hits', 'gauge_arcstats_raw_demand-demand_metadata_misses', 'gauge_arcstats_raw_duplicate-duplicate_buffers', 'gauge_arcstats_raw_duplicate-duplicate_buffers_size', 'gauge_arcstats_raw_duplicate-duplicate_reads', 'gauge_arcstats_raw_evict-evict_l2_cached', 'gauge_arcstats_raw_evict-evict_l2_eligible', 'gauge_arcstats_raw_evict-evict_l2_ineligible', 'gauge_arcstats_raw_evict-evict_skip', 'gauge_arcstats_raw_hash-hash_chain_max', 'gauge_arcstats_raw_hash-hash_chains', 'gauge_arcstats_raw_hash-hash_collisions', 'gauge_arcstats_raw_hash-hash_elements', 'gauge_arcstats_raw_hash-hash_elements_max', 'gauge_arcstats_raw_hits_misses-hits', 'gauge_arcstats_raw_hits_misses-misses', 'gauge_arcstats_raw_l2-l2_cksum_bad', 'gauge_arcstats_raw_l2-l2_feeds', 'gauge_arcstats_raw_l2-l2_hits', 'gauge_arcstats_raw_l2-l2_io_error', 'gauge_arcstats_raw_l2-l2_misses', 'gauge_arcstats_raw_l2-l2_rw_clash', 'gauge_arcstats_raw_l2_compress-l2_compress_failures', 'gauge_arcstats_raw_l2_compress-l2_compress_successes', 'gauge_arcstats_raw_l2_compress-l2_compress_zeros', 'gauge_arcstats_raw_l2_free-l2_cdata_free_on_write', 'gauge_arcstats_raw_l2_free-l2_free_on_write', 'gauge_arcstats_raw_l2abort-l2_abort_lowmem', 'gauge_arcstats_raw_l2bytes-l2_read_bytes', 'gauge_arcstats_raw_l2bytes-l2_write_bytes', 'gauge_arcstats_raw_l2evict-l2_evict_lock_retry', 'gauge_arcstats_raw_l2evict-l2_evict_reading', 'gauge_arcstats_raw_l2write-l2_write_buffer_bytes_scanned', 'gauge_arcstats_raw_l2write-l2_write_buffer_iter', 'gauge_arcstats_raw_l2write-l2_write_buffer_list_iter', 'gauge_arcstats_raw_l2write-l2_write_buffer_list_null_iter', 'gauge_arcstats_raw_l2write-l2_write_full', 'gauge_arcstats_raw_l2write-l2_write_in_l2', 'gauge_arcstats_raw_l2write-l2_write_io_in_progress', 'gauge_arcstats_raw_l2write-l2_write_not_cacheable', 'gauge_arcstats_raw_l2write-l2_write_passed_headroom', 'gauge_arcstats_raw_l2write-l2_write_pios', 'gauge_arcstats_raw_l2write-l2_write_spa_mismatch', 'gauge_arcstats_raw_l2write-l2_write_trylock_fail', 'gauge_arcstats_raw_l2writes-l2_writes_done', 'gauge_arcstats_raw_l2writes-l2_writes_error', 'gauge_arcstats_raw_l2writes-l2_writes_hdr_miss', 'gauge_arcstats_raw_l2writes-l2_writes_sent', 'gauge_arcstats_raw_memcount-memory_throttle_count', 'gauge_arcstats_raw_mru-mfu_ghost_hits', 'gauge_arcstats_raw_mru-mfu_hits', 'gauge_arcstats_raw_mru-mru_ghost_hits', 'gauge_arcstats_raw_mru-mru_hits', 'gauge_arcstats_raw_prefetch-prefetch_data_hits', 'gauge_arcstats_raw_prefetch-prefetch_data_misses', 'gauge_arcstats_raw_prefetch-prefetch_metadata_hits', 'gauge_arcstats_raw_prefetch-prefetch_metadata_misses', 'gauge_arcstats_raw_size-data_size', 'gauge_arcstats_raw_size-hdr_size', 'gauge_arcstats_raw_size-other_size', 'gauge_arcstats_raw_size-size']:
-            sources_request['stats_list'] += [{
-                "source": "zfs_arc_v2",
-                "type": metric,
-                "dataset": 'value'
-            }]
-            sources_metadata += [{
-                "source": "zfs_arc_v2",
-                "metric": metric,
-                "submetric": 'value',
-                "metrictype": "GAUGE"
-            }]
-
-        data = self._stats_request(sources_request)
-        if len(data) and len(data['data']) > 0:
-            for index, metric in enumerate(sources_metadata):
-                value = self._stats_latest_data(index, data['data'])
-                if metric['source'].split('-')[0] == 'cputemp':
-                    """ value is in Kelvin, and it's off by a power of 10 """
-                    try:
-                        value = str(float(value)/10 - 273.15)
-                    except TypeError:
-                        value = None
-                if value:
-                    collectd.add_metric(
-                        [metric['source'], metric['metric'], metric['submetric'], metric['metrictype']],
-                        value
-                    )
-        else:
-            print("Empty response for collectd metadata for unknown reason", file=sys.stderr)
-
-        return [collectd]
-
-    def _stats_request(self, sources_request):
-        """ Make the API call(s) for stats"""
-
-        # If sources_request includes too many stats_list items in it, like if
-        # you have a lot of datasets, a single call to the API will fail. The
-        # middleware on the TrueNAS will run `rrdtool` with so many arguments
-        # that it will get an 'Argument list too long' error.
-
-        # This function will break it up into multiple calls when over 1200
-        # stats_list items, and recombine them as if they came from a single
-        # call.
-
-        # No way around it, if this has to make multiple calls, it will be slow
-
-        index = 0
-        max_items = 1200
-        return_data = {'data':[]}
-
-        while len(sources_request['stats_list']) > index:
-            this_sources_request = {
-                "stats_list": sources_request['stats_list'][index:index+max_items],
-                "stats-filter": sources_request['stats-filter']
-            }
-            if this_sources_request['stats_list']:
-                try:
-                    data = self.request("stats/get_data", this_sources_request)
-                    response = data['data']
-                except KeyError as e:
-                    print("Invalid response from TrueNAS API:")
-                    print(data)
-                    continue
-                if return_data['data']:
-                    # New metrics are appended to lists from old metrics
-                    # See _stats_latest_data comments for an explanation of how
-                    # this list of lists needs to look in the end
-                    return_data['data'] = [i[0]+i[1] for i in list(zip(return_data['data'],response))]
-                else:
-                    # First data returns needs to create the return_data['data'] structure
-                    return_data['data'] = response
-            index += max_items
-
-        return return_data
-
-    def _stats_latest_data(self, index, data):
-        """ find the latest data point for a given metric """
-
-        # Here's the structure of data:
-        #  "data": [ [29.0,29.98], [29.0,29.0], [29.0,29.02], [29.0,30.0] ]
-        # Each of the lists in the list represents a different timestamp with
-        # data. We reuested datapoints from the last 15 minutes.
-        # Each of the numbers in each  of those lists represents the different
-        # metrics requested. index is the one of these we want to return.
-
-        # Start at the last list (latest data), and traverse the data backwards
-        # until we find a valid data point for the metric.
-        latest = len(data) - 1
-        while latest >= 0:
-            if data[latest][index]:
-                return str(data[latest][index])
-            latest -= 1
-
-        return None
+        served = GaugeMetricFamily(
+            'truenas_exporter_target',
+            'Whether a --target address answered API requests during the scrape: 1=yes 0=no',
+            labels=["target"])
+        for target in self.targets:
+            served.add_metric([target], int(target in self.served_targets))
+
+        return [served]
+
+    def _collect_self(self):
+        """ What each collector costs the exporter, and its peak memory """
+        cpu = CounterMetricFamily(
+            'truenas_exporter_collector_cpu_seconds',
+            'CPU time spent in a collector',
+            labels=["collector"])
+        samples = CounterMetricFamily(
+            'truenas_exporter_collector_samples',
+            'Samples returned by a collector',
+            labels=["collector"])
+        decoded = CounterMetricFamily(
+            'truenas_exporter_collector_decoded_bytes',
+            'Bytes of API responses decoded by a collector',
+            labels=["collector"])
+        gc_collections = CounterMetricFamily(
+            'truenas_exporter_collector_gc_collections',
+            'Garbage collections triggered while a collector ran',
+            labels=["collector"])
+        gc_seconds = CounterMetricFamily(
+            'truenas_exporter_collector_gc_seconds',
+            'Time spent in garbage collections triggered while a collector ran',
+            labels=["collector"])
+        blocks = GaugeMetricFamily(
+            'truenas_exporter_collector_retained_blocks',
+            'Net change in allocated memory blocks over the last run of a collector, negative if it freed more',
+            labels=["collector"])
+        peak = GaugeMetricFamily(
+            'truenas_exporter_peak_rss_bytes',
+            'Peak resident set size of the exporter process since it started')
+        scrape_rss = GaugeMetricFamily(
+            'truenas_exporter_scrape_rss_bytes',
+            'Highest resident set size of the exporter process after a collector in this scrape')
+
+        with self.usage_lock:
+            for collection, usage in self.usage.items():
+                labels = [collection.replace('_collect_', '', 1)]
+                for (family, value) in zip([cpu, samples, decoded, gc_collections, gc_seconds, blocks], usage):
+                    family.add_metric(labels, value)
+        peak.add_metric([], peak_rss())
+        current = rss()
+        if current is not None:
+            scrape_rss.add_metric([], max(self.scrape_rss or 0, current))
+
+        return [cpu, samples, decoded, gc_collections, gc_seconds, blocks, peak, scrape_rss]
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+# The collectors of TrueNasCollector, one module per area of the API. A module
+# is only imported the first time one of its collectors is used, so the timers,
+# helpers and metric tables of collectors that aren't enabled (--collectors,
+# or another worker's with --workers) cost no import time or memory. Every
+# function in a module that takes `self` becomes a method of TrueNasCollector
+# when the module is loaded.
+
+import importlib, sys
+
+# Collector to module, in the order collectors run and export their metrics
+COLLECTORS = {
+    '_collect_rsynctask': 'tasks',
+    '_collect_cloudsync': 'tasks',
+    '_collect_alerts': 'alerts',
+    '_collect_disks': 'disks',
+    '_collect_disk_temperatures': 'disks',
+    '_collect_interfaces': 'interfaces',
+    '_collect_pool_datasets': 'pools',
+    '_collect_pool': 'pools',
+    '_collect_replications': 'tasks',
+    '_collect_pool_snapshot_tasks': 'snapshots',
+    '_collect_snapshot_inventory': 'snapshots',
+    '_collect_system_info': 'system',
+    '_collect_enclosure': 'enclosure',
+    '_collect_smarttest': 'smart',
+    '_collect_stats': 'stats',
+    '_collect_samples': 'samples'
+}
+
+# Names for --collectors
+NAMES = [collection[len('_collect_'):] for collection in COLLECTORS]
+
+def load(collection):
+    """ The module of a collector, imported if it wasn't yet """
+    return importlib.import_module(f'{__name__}.{COLLECTORS[collection]}')
+
+def loaded():
+    """ The collector modules imported so far """
+    return [module for (name, module) in list(sys.modules.items())
+        if name.startswith(__name__ + '.')]
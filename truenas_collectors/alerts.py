@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+# Alerts, by class and level.
+
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client import Summary
+
+alerts_timer = Summary('truenas_exporter_alerts_seconds', 'Time spent making alerts API requests')
+
+@alerts_timer.time()
+def _collect_alerts(self):
+    alerts = self.request('alert/list')
+
+    count = GaugeMetricFamily(
+        'truenas_alerts',
+        'Current count of un-dismissed alerts',
+        labels=["node", "klass", "level"])
+
+    counts = {}
+    for alert in alerts:
+        if alert['dismissed']:
+            continue
+        key = f"{alert['klass']}_{alert['level']}_{alert['node']}"
+        if not key in counts:
+            counts[key] = 0
+        counts[key] += 1
+
+    for metric in counts:
+        (klass, level, node) = metric.split('_', 2)
+        count.add_metric(
+            [node, klass, level],
+            counts[metric]
+        )
+    return [count]
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# Disk inventory and temperatures.
+
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client import Summary
+import operator, time
+from truenas_collector import LabelCache
+
+disks_timer = Summary('truenas_exporter_disks_seconds', 'Time spent making disks API requests')
+disk_temperatures_timer = Summary('truenas_exporter_disk_temperatures_seconds', 'Time spent making disk temperature API requests')
+
+@disks_timer.time()
+def _collect_disks(self):
+    disks = self.request('disk')
+
+    metrics = GaugeMetricFamily(
+        'truenas_disk_bytes',
+        'Disk size/info inventory',
+        labels=["name", "serial", "type", "model"])
+
+    top = self._top('disks', [operator.add])
+    for disk in disks:
+        labels = self.disk_labels.get(disk.name, disk.serial)
+        if labels is None:
+            labels = self.disk_labels.put(disk.name, disk.serial,
+                [disk.name, disk.serial, disk.type, disk.model])
+        if top:
+            top.offer(disk.size, labels, (disk.size,))
+        else:
+            LabelCache.add(metrics, labels, disk.size)
+    if disks:
+        self.disk_labels.sweep()
+    if top:
+        other = dict.fromkeys(self.disk_labels.labelnames, 'other')
+        for (labels, values) in top.series('disks', other):
+            LabelCache.add(metrics, labels, values[0])
+
+    return [metrics]
+
+@disk_temperatures_timer.time()
+def _collect_disk_temperatures(self):
+    """ Temperatures of all disks from one disk/temperatures call """
+
+    # These used to come from the disktemp-* collectd sources, one
+    # stats_list item per disk in the big stats/get_data request. The
+    # middleware reads them all in one go instead. Disks in standby are
+    # left alone rather than spun up, and come back as null.
+    now = time.monotonic()
+    if now - self.last_disk_temperatures_time >= self.cache_disk_temperatures:
+        temperatures = self.request('disk/temperatures', {'names': [], 'powermode': 'STANDBY'})
+        if isinstance(temperatures, dict) and temperatures:
+            self.last_disk_temperatures_time = now
+            self.last_disk_temperatures = temperatures
+    temperatures = self.last_disk_temperatures
+    # Serials and models from the disk call _collect_disks made, if it runs
+    # in this process, otherwise from one of our own
+    disks = self.disk_index()
+
+    metrics = GaugeMetricFamily(
+        'truenas_disk_temperature_celsius',
+        'Disk temperature',
+        labels=["name", "serial", "model"])
+
+    for name, temperature in sorted(temperatures.items()):
+        if temperature is None:
+            continue
+        disk = disks.get(name)
+        if disk is None:
+            metrics.add_metric([name, '', ''], temperature)
+        else:
+            metrics.add_metric([name, disk.serial or '', disk.model or ''], temperature)
+
+    return [metrics]
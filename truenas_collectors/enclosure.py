@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Enclosure element status and readings.
+
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client import Summary
+import re, sys, time
+from truenas_collector import LabelCache, unknown_enumerations
+
+enclosure_timer = Summary('truenas_exporter_enclosure_seconds', 'Time spent making enclosure API requests')
+
+# Parsers for enclosure element readings, by element type. Types not listed
+# here have no reading. The numbers come first: "4020 RPM", "25C", "12.10V".
+_ENCLOSURE_NUMBER = re.compile(r'\s*([-+]?\d*\.?\d+)')
+ENCLOSURE_VALUES = {
+    'Cooling': lambda value: float(_ENCLOSURE_NUMBER.match(value).group(1)),
+    'Temperature Sensor': lambda value: float(_ENCLOSURE_NUMBER.match(value).group(1)),
+    'Voltage Sensor': lambda value: float(_ENCLOSURE_NUMBER.match(value).group(1)),
+    'Enclosure Services Controller Electronics': lambda value: value
+}
+# _enclosure_status_enum() values from least to most severe
+ENCLOSURE_SEVERITY = [1, 5, 2, 4, 0, 3]
+
+def _worst_status(a, b):
+    return max(a, b, key=ENCLOSURE_SEVERITY.index)
+
+@enclosure_timer.time()
+def _collect_enclosure(self):
+    # Status and readings are read on every scrape, so a failed fan or power
+    # supply shows up right away. The layout only changes with hardware, so
+    # the labels and reading parser of each element are kept for
+    # --cache-enclosure seconds, or until an element shows up that isn't in
+    # there yet.
+    enclosure = self.request('enclosure')
+    now = time.monotonic()
+    if not self.enclosure_topology or now - self.enclosure_topology[0] >= self.cache_enclosure:
+        self.enclosure_topology = (now, {})
+    topology = self.enclosure_topology[1]
+    refresh = not topology
+
+    health_metrics = GaugeMetricFamily(
+        'truenas_enclosure_health',
+        'TrueNAS enclosure device metrics',
+        labels=["devicename", "devicemodel", "metrictype", "metricdevice", "metricelement"])
+    health_status = GaugeMetricFamily(
+        'truenas_enclosure_status',
+        'TrueNAS enclosure device health 0=UNKNOWN, 1=OK or (OK, Swapped), 2=Unknown/Not-installed 3=Critical, 4=Unsupported, 5=(Not Installed, Swapped)',
+        labels=["devicename", "devicemodel", "metrictype", "metricdevice", "metricelement"])
+
+    # With a --limit, the elements in the worst state are kept first. The
+    # 'other' bucket has the worst status of the rest, and no reading, since
+    # RPM, degrees and volts of different elements don't add up to anything.
+    top = self._top('enclosure', [_worst_status, None])
+    for device in enclosure:
+        devicename = device['name']
+        devicemodel = device['model']
+        deviceid = device.get('id', devicename)
+        for elementname, element in device['elements'].items():
+            for leafname, leaf in element.items():
+                key = (deviceid, elementname, leafname)
+                if key not in topology:
+                    labels = self.enclosure_labels.get(key, (devicemodel, leaf['descriptor']))
+                    if labels is None:
+                        labels = self.enclosure_labels.put(key, (devicemodel, leaf['descriptor']),
+                            [devicename, devicemodel, elementname, f"{elementname} {leafname}", leaf['descriptor']])
+                    topology[key] = (labels, ENCLOSURE_VALUES.get(elementname))
+                (labels, parse) = topology[key]
+                status = self._enclosure_status_enum(leaf['status'])
+
+                value = None
+                if parse and leaf['value'] and leaf['status'] not in ['Unknown', 'Not installed']:
+                    value = parse(leaf['value'])
+
+                if top:
+                    top.offer(ENCLOSURE_SEVERITY.index(status), labels, (status, value))
+                    continue
+                LabelCache.add(health_metrics, labels, status)
+                if value is not None:
+                    LabelCache.add(health_status, labels, value)
+    if enclosure and refresh:
+        self.enclosure_labels.sweep()
+    if top:
+        other = dict.fromkeys(self.enclosure_labels.labelnames, 'other')
+        for (labels, (status, value)) in top.series('enclosure', other):
+            LabelCache.add(health_metrics, labels, status)
+            if value is not None:
+                LabelCache.add(health_status, labels, value)
+
+    return [health_metrics, health_status]
+
+def _enclosure_status_enum(self, value):
+    if value in ["OK", "OK, Swapped"]:
+        return 1
+    elif value == "Unknown" or value == "Not installed":
+        return 2
+    elif value == "Critical":
+        return 3
+    elif value == "Unsupported":
+        return 4
+    elif value == "Not Installed, Swapped":
+        return 5
+
+    unknown_enumerations.inc()
+    print(f"Unknown/new enclosure health state: {value}. Needs to be added to " +
+        " TrueNasCollector._enclosure_status_enum()", file=sys.stderr)
+    return 0
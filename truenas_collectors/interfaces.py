@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+# Network interface link states.
+
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client import Summary
+import sys
+from truenas_collector import unknown_enumerations
+
+interfaces_timer = Summary('truenas_exporter_interfaces_seconds', 'Time spent making interfaces API requests')
+
+@interfaces_timer.time()
+def _collect_interfaces(self):
+    if self.skip_snmp:
+        return []
+
+    interfaces = self.request('interface')
+
+    metrics = GaugeMetricFamily(
+        'truenas_interface_state',
+        'Interface state/info inventory:  0==UNKNOWN, 1==LINK_STATE_UP, 2==LINK_STATE_DOWN',
+        labels=["name", "description", "type"])
+
+    for interface in interfaces:
+        metrics.add_metric(
+            [interface['name'], interface['description'] or "", interface['type']],
+            self._interfaces_state_enum(interface['state']['link_state'])
+        )            
+
+    return [metrics]
+
+def _interfaces_state_enum(self, value):
+    if value == "LINK_STATE_UP":
+        return 1
+    if value == "LINK_STATE_DOWN":
+        return 2
+
+    unknown_enumerations.inc()
+    print(f"Unknown/new Interface state: {value}. Needs to be added to " +
+        " TrueNasCollector._interfaces_state_enum()", file=sys.stderr)
+    return 0
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# Pools, their disks, and datasets.
+
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+from prometheus_client import Summary
+import operator, sys
+from truenas_collector import LabelCache, unknown_enumerations
+
+datasets_timer = Summary('truenas_exporter_datasets_seconds', 'Time spent making datasets API requests')
+pools_timer = Summary('truenas_exporter_pools_seconds', 'Time spent making pools API requests')
+
+@datasets_timer.time()
+def _collect_pool_datasets(self):
+    if self.skip_snmp:
+        return []
+
+    datasets = self.request('pool/dataset')
+
+    size = GaugeMetricFamily(
+        'truenas_pool_dataset_max_bytes',
+        'Dataset size in bytes',
+        labels=["name", "pool", "type"])
+    used = GaugeMetricFamily(
+        'truenas_pool_dataset_used_bytes',
+        'Dataset used in bytes',
+        labels=["name", "pool", "type"])
+    children = GaugeMetricFamily(
+        'truenas_pool_dataset_children',
+        'Number of children inside dataset',
+        labels=["name", "pool", "type"])
+    encrypted = GaugeMetricFamily(
+        'truenas_pool_dataset_encrypted',
+        'Dataset encryption enabled?',
+        labels=["name", "pool", "type"])
+    locked = GaugeMetricFamily(
+        'truenas_pool_dataset_locked',
+        'Dataset encryption locked?',
+        labels=["name", "pool", "type"])
+
+    # With a --limit, only the largest datasets by used bytes are kept
+    top = self._top('datasets', [operator.add]*5)
+    for dataset in datasets:
+        # A dataset's name includes its pool, so only the type can change
+        labels = self.dataset_labels.get(dataset.name, dataset.type)
+        if labels is None:
+            labels = self.dataset_labels.put(dataset.name, dataset.type,
+                [dataset.name, dataset.pool, dataset.type])
+        if top:
+            top.offer(dataset.used, labels, (
+                dataset.available,
+                dataset.used,
+                dataset.children,
+                int(dataset.encrypted),
+                int(dataset.locked)
+            ))
+            continue
+        LabelCache.add(size, labels, dataset.available)
+        LabelCache.add(used, labels, dataset.used)
+        LabelCache.add(children, labels, dataset.children)
+        LabelCache.add(encrypted, labels, int(dataset.encrypted))
+        LabelCache.add(locked, labels, int(dataset.locked))
+    if datasets:
+        self.dataset_labels.sweep()
+    if top:
+        other = dict.fromkeys(self.dataset_labels.labelnames, 'other')
+        for (labels, values) in top.series('datasets', other):
+            for family, value in zip([size, used, children, encrypted, locked], values):
+                LabelCache.add(family, labels, value)
+
+    return [size,used,children,encrypted,locked]
+
+@pools_timer.time()
+def _collect_pool(self):
+    if self.skip_snmp:
+        return []
+
+    pools = self.request('pool')
+
+    status = GaugeMetricFamily(
+        'truenas_pool_status',
+        'Pool status: 0=UNKNOWN, 1=ONLINE',
+        labels=["name", "path"])
+    healthy = GaugeMetricFamily(
+        'truenas_pool_healthy',
+        'Pool health',
+        labels=["name", "path"])
+    disk_status = GaugeMetricFamily(
+        'truenas_pool_disk_status',
+        'Status of disk in pool: 0=UNKNOWN, 1=ONLINE',
+        labels=["name", "path", "device", "spare"])
+    disk_errors = CounterMetricFamily(
+        'truenas_pool_disk_errors',
+        'Count of errors on disk in pool',
+        labels=["name", "path", "device", "errortype"])
+
+    for pool in pools:
+        labels = self.pool_labels.get(pool.name, pool.path)
+        if labels is None:
+            labels = self.pool_labels.put(pool.name, pool.path, [pool.name, pool.path])
+        LabelCache.add(status, labels, self._pool_health_enum(pool.status))
+        LabelCache.add(healthy, labels, int(pool.healthy))
+        for disk in pool.disks:
+            self._pool_disk_metrics(pool, disk, disk_status, disk_errors)
+    if pools:
+        self.pool_labels.sweep()
+        self.pool_disk_labels.sweep()
+        self.pool_disk_error_labels.sweep()
+
+    return [status, healthy, disk_status, disk_errors]
+
+def _pool_disk_metrics(self, pool, disk, disk_status, disk_errors):
+    """ Status and error counts of one disk in a pool's topology """
+    key = (pool.name, disk.label, disk.spare)
+    labels = self.pool_disk_labels.get(key, pool.path)
+    if labels is None:
+        labels = self.pool_disk_labels.put(key, pool.path,
+            [pool.name, pool.path, disk.label, disk.spare])
+    LabelCache.add(disk_status, labels, self._pool_health_enum(disk.status))
+
+    for (errortype, errors) in [("read", disk.read_errors), ("write", disk.write_errors),
+            ("checksum", disk.checksum_errors)]:
+        key = (pool.name, disk.label, errortype)
+        labels = self.pool_disk_error_labels.get(key, pool.path)
+        if labels is None:
+            labels = self.pool_disk_error_labels.put(key, pool.path,
+                [pool.name, pool.path, disk.label, errortype])
+        LabelCache.add(disk_errors, labels, errors)
+
+def _pool_health_enum(self, value):
+    if value == "ONLINE":
+        return 1
+    if value == "UNAVAIL":
+        return 2
+    if value == "DEGRADED":
+        return 3
+    if value == "REMOVED":
+        return 4
+    if value == "OFFLINE":
+        return 5
+
+    unknown_enumerations.inc()
+    print(f"Unknown/new Pool or Disk state: {value}. Needs to be added to " +
+        " TrueNasCollector._pool_health_enum()", file=sys.stderr)
+    return 0
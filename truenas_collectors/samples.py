@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+# Hot CollectD series sampled between scrapes, for --sample-interval.
+
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client import Counter, Summary
+from array import array
+import requests, sys, time, math, threading
+from truenas_collector import STATS_ROWS
+
+sampler_timer = Summary('truenas_exporter_sampler_seconds', 'Time spent making sampler API requests')
+sampler_failures = Counter('truenas_exporter_sampler_failures', 'Sampler ticks that failed')
+
+class RingBuffer(object):
+    """ The newest samples of one series, in a fixed-size array """
+
+    # Values and their timestamps go round-robin into preallocated arrays of
+    # doubles, so a series costs 16 bytes per slot however long the sampler
+    # runs. count is the number of samples ever appended.
+    __slots__ = ('values', 'times', 'count', 'latest')
+
+    def __init__(self, size):
+        self.values = array('d', bytes(8*size))
+        self.times = array('d', bytes(8*size))
+        self.count = 0
+        # Timestamp of the newest sample
+        self.latest = 0
+
+    def append(self, timestamp, value):
+        self.values[self.count % len(self.values)] = value
+        self.times[self.count % len(self.values)] = timestamp
+        self.count += 1
+        self.latest = timestamp
+
+    def newer(self, timestamp):
+        """ Values sampled after timestamp, as far as they're still here """
+        size = len(self.values)
+        return [self.values[slot % size] for slot in range(max(0, self.count - size), self.count)
+            if self.times[slot % size] > timestamp]
+
+class HotSampler(object):
+    """ A few hot collectd series, sampled into RingBuffers between scrapes """
+
+    # _collect_stats only exports the newest collectd value of every series,
+    # so a CPU, network or disk burst that comes and goes between two scrapes
+    # is never seen. With --sample-interval, a thread fetches the series below
+    # that often, all in one stats/get_data call per tick. Each call covers
+    # collectd's last STATS_ROWS steps and only rows newer than what a buffer
+    # already has are appended, so a slow or failed tick leaves no gap and
+    # ticking faster than collectd's step adds no duplicates. It doesn't add
+    # resolution either, so ticks are never closer than the step. A scrape
+    # summarizes what was sampled in the last --sample-window seconds, the
+    # same for every scraper, however often each of them comes by.
+
+    # Always sampled: (source, collectd type, dataset)
+    FIXED = [
+        ('aggregation-cpu-average', 'cpu-user', 'value'),
+        ('aggregation-cpu-average', 'cpu-system', 'value'),
+        ('aggregation-cpu-average', 'cpu-interrupt', 'value'),
+        ('zfs_arc', 'cache_ratio-arc', 'value')
+    ]
+    # Sampled for every source of a family: (collectd type, dataset)
+    PER_SOURCE = {
+        'interface': [('if_octets', 'rx'), ('if_octets', 'tx')],
+        'disk': [('disk_ops', 'read'), ('disk_ops', 'write')]
+    }
+    # stats/get_sources is read again this often, for new disks and interfaces
+    SOURCES_INTERVAL = 600
+    # Like _stats_request, stay clear of rrdtool's argument limit
+    MAX_ITEMS = 1200
+
+    def __init__(self, collector):
+        self.collector = collector
+        self.lock = threading.Lock()
+        self.plan = []
+        self.planned = None
+        self.step = 10
+        self.buffers = {}
+        self.warned = False
+
+    def run(self):
+        """ Tick every --sample-interval seconds, until the collector drops us """
+        while self.collector.sampler is self:
+            started = time.monotonic()
+            try:
+                self.tick(started)
+            except Exception as e:
+                sampler_failures.inc()
+                print(f'Sampling failed: {e}', file=sys.stderr)
+            time.sleep(max(0, self.interval() - (time.monotonic() - started)))
+
+    def interval(self):
+        """ --sample-interval, but no less than collectd's step """
+        if self.collector.sample_interval >= self.step:
+            return self.collector.sample_interval
+        if not self.warned:
+            print(f'--sample-interval {self.collector.sample_interval} is below collectd\'s ' +
+                f'step of {self.step}s, sampling every {self.step}s', file=sys.stderr)
+            self.warned = True
+        return self.step
+
+    def _call(self, apipath, data=None):
+        # Not request(): that one keeps a trace of the running scrape, and
+        # feeds circuit breakers and --throttle, which are about scrapes. It
+        # does take its turn under --api-concurrency.
+        collector = self.collector
+        url = f'https://{collector.target}/api/v2.0/{apipath}'
+        with collector.api_slot(apipath):
+            if data is None:
+                r = requests.get(url, auth=(collector.username, collector.password),
+                    verify=False, timeout=collector.timeout)
+            else:
+                r = requests.post(url, auth=(collector.username, collector.password),
+                    headers={'Content-Type': 'application/json'}, verify=False, json=data,
+                    timeout=collector.timeout)
+        r.raise_for_status()
+        return collector.json_loads(r.content)
+
+    def _plan(self, sources):
+        """ (source, collectd type, dataset) of every sampled series """
+        stats_filter = self.collector.stats_filter
+        plan = [item for item in self.FIXED if stats_filter.keep(item[0], item[1])]
+        for source in sorted(sources):
+            family = stats_filter.family(source)
+            if family == 'interface' and self.collector.skip_snmp:
+                continue
+            for (metric, submetric) in self.PER_SOURCE.get(family, []):
+                if stats_filter.keep(source, metric):
+                    plan.append((source, metric, submetric))
+        if len(plan) > self.MAX_ITEMS:
+            print(f'Sampling only the first {self.MAX_ITEMS} of {len(plan)} series', file=sys.stderr)
+            plan = plan[:self.MAX_ITEMS]
+        return plan
+
+    @sampler_timer.time()
+    def tick(self, now):
+        if self.planned is None or now - self.planned >= self.SOURCES_INTERVAL:
+            plan = self._plan(self._call('stats/get_sources'))
+            size = self.collector.sample_buffer
+            with self.lock:
+                self.buffers = {key: self.buffers.get(key) or RingBuffer(size) for key in plan}
+            self.plan = plan
+            self.planned = now
+        if not self.plan:
+            return
+
+        end = int(time.time())
+        response = self._call('stats/get_data', {
+            'stats_list': [{'source': source, 'type': metric, 'dataset': submetric}
+                for (source, metric, submetric) in self.plan],
+            'stats-filter': {'start': end - STATS_ROWS*self.step, 'end': end, 'step': self.step}
+        })
+        meta = response.get('meta') or {}
+        step = meta.get('step') or self.step
+        start = meta.get('start', end - STATS_ROWS*self.step)
+        self.step = step
+        with self.lock:
+            for (row, values) in enumerate(response.get('data') or []):
+                timestamp = start + row*step
+                for (key, value) in zip(self.plan, values):
+                    buffer = self.buffers[key]
+                    if value is not None and timestamp > buffer.latest:
+                        buffer.append(timestamp, value)
+
+    def window(self, seconds, now=None):
+        """ (series, values sampled in the last `seconds`) for every series """
+
+        # Reading doesn't move anything along, so /debug/profile, a second
+        # Prometheus or a --cache-payload refresh don't take samples away
+        # from anyone. Timestamps are the exporter's, from the stats-filter
+        # end of each tick.
+        cutoff = (now or time.time()) - seconds
+        with self.lock:
+            return [(key, buffer.newer(cutoff)) for key, buffer in self.buffers.items()]
+
+def _collect_samples(self):
+    """ Max, min and percentiles of the hot series sampled in the last --sample-window """
+    if not self.sample_interval:
+        return []
+    if self.sampler is None:
+        self.sampler = HotSampler(self)
+        threading.Thread(target=self.sampler.run, daemon=True).start()
+
+    labelnames = ['source', 'metric', 'submetric']
+    maximum = GaugeMetricFamily(
+        'truenas_collectd_max',
+        'Highest sampled value of a hot CollectD series in the last --sample-window seconds',
+        labels=labelnames)
+    minimum = GaugeMetricFamily(
+        'truenas_collectd_min',
+        'Lowest sampled value of a hot CollectD series in the last --sample-window seconds',
+        labels=labelnames)
+    quantile = GaugeMetricFamily(
+        'truenas_collectd_quantile',
+        'Percentiles of the sampled values of a hot CollectD series in the last --sample-window seconds',
+        labels=labelnames + ['quantile'])
+    count = GaugeMetricFamily(
+        'truenas_collectd_samples',
+        'Samples of a hot CollectD series in the last --sample-window seconds',
+        labels=labelnames)
+
+    for (labels, values) in self.sampler.window(self.sample_window):
+        if not values:
+            continue
+        values.sort()
+        labels = list(labels)
+        maximum.add_metric(labels, values[-1])
+        minimum.add_metric(labels, values[0])
+        count.add_metric(labels, len(values))
+        for q in ['0.5', '0.9', '0.99']:
+            # Nearest rank
+            quantile.add_metric(labels + [q], values[math.ceil(float(q)*len(values)) - 1])
+
+    return [maximum, minimum, quantile, count]
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+# Results of the latest SMART test of every disk.
+
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+from prometheus_client import Summary
+from datetime import datetime
+import sys
+from truenas_collector import unknown_enumerations
+
+smarttests_timer = Summary('truenas_exporter_smarttests_seconds', 'Time spent making SMART test API requests')
+
+@smarttests_timer.time()
+def _collect_smarttest(self):
+
+    # self.cache_smart = cache_smart
+    # self.last_smart_result = {}
+    # self.last_smart_time = 0
+
+    nowstamp = int(datetime.now().timestamp())
+    if (nowstamp - self.last_smart_time) > (self.cache_smart):
+        smarttests = self.request('smart/test/results')
+        if smarttests:
+            self.last_smart_time = nowstamp
+            self.last_smart_result = smarttests
+    else:
+        smarttests = self.last_smart_result
+
+    smarttest = GaugeMetricFamily(
+        'truenas_smarttest_status',
+        'TrueNAS SMART test result: 0=UNKNOWN 1=SUCCESS 2=RUNNING 3=FAILED',
+        labels=['disk', 'description'])
+    cachetime = GaugeMetricFamily(
+        'truenas_smarttest_cache_age_seconds',
+        'Seconds since last check of the smart/tests/results API.')
+    lifetime = CounterMetricFamily(
+        'truenas_smarttest_lifetime',
+        'TrueNAS SMART lifetime',
+        labels=['disk','description'])
+
+    cachetime.add_metric([], nowstamp-self.last_smart_time)
+
+    for result in smarttests:
+        smarttest.add_metric(
+            [result.disk, result.description],
+            self._smart_test_result_enum(result.status)
+        )
+        if result.lifetime:
+            lifetime.add_metric(
+                [result.disk, result.description],
+                result.lifetime
+            )
+
+    return [smarttest, cachetime, lifetime]
+
+def _smart_test_result_enum(self, value):
+    if value == "SUCCESS":
+        return 1
+    elif value == "RUNNING":
+        return 2
+    elif value == "FAILED":
+        return 3
+
+    unknown_enumerations.inc()
+    print(f"Unknown/new SMART health state: {value}. Needs to be added to " +
+        " TrueNasCollector._smart_test_result_enum()", file=sys.stderr)
+    return 0
@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+
+# CollectD statistics from stats/get_data.
+
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client import Summary
+from prometheus_client.samples import Sample
+from datetime import datetime
+import operator, sys
+from truenas_collector import STATS_ROWS
+
+stats_timer = Summary('truenas_exporter_stats_seconds', 'Time spent making stats API requests')
+stats_rows = Summary('truenas_exporter_stats_rows', 'Rows returned per stats/get_data request')
+stats_bytes = Summary('truenas_exporter_stats_bytes', 'Bytes returned per stats/get_data request')
+
+@stats_timer.time()
+def _collect_stats(self):
+    """ Return all current data from CollectD collections """
+
+    # This is complicated for a bunch of performance reasons
+    # /api/v2.0/stats/get_sources and available metrics for the source
+    #
+    # You can get the definition for a source/metric from above by sending a
+    # POST like {"source": "zfs_arc", "type": "hash_collisions"} to
+    # /api/v2.0/stats/get_dataset_info
+    #
+    # Requesting that for all items in the get_sources results one at a time
+    # takes a prohibitively long time. Information from that process was
+    # used to build this function that cycles through the hardware inventory
+    # from /stats/get_sources and uses it to build a list of metrics to
+    # request data from
+    #
+    # The actual data from these sources can be done with a single request
+    # to /api/v2.0/stats/get_data, using the structure for each source
+    # derived above.
+    #
+    # After all that, there's no way to get "the most recent data point" for
+    # a given metric. As a result, we are requesting the metrics from 30s
+    # ago because those should exist by now. Requesting metrics for "now"
+    # will yield None for the values.
+
+    stats = self.request('stats/get_sources')
+
+    collectd = GaugeMetricFamily(
+        'truenas_collectd',
+        'TrueNAS CollectD Metrics',
+        labels=['source', 'metric', 'submetric', 'metrictype'])
+
+    sources = {}
+    sources['cpu'] = []
+    sources['temperature'] = []
+    sources['ctl'] = []
+    sources['df'] = []
+    sources['disk'] = []
+    sources['interface'] = []
+
+    disk_list = []
+    disk_sources = {}
+
+    # --stats-include/--stats-exclude are applied here, so filtered
+    # sources never make it into the stats_list. The aggregation and ctl
+    # sources are always requested by name.
+    for source in ['aggregation-cpu-average', 'aggregation-cpu-sum', 'ctl-ioctl', 'ctl-tpc']:
+        family = self.stats_filter.family(source)
+        if family:
+            sources[family] += [source]
+    for source in stats:
+        if source.startswith(('aggregation-', 'ctl-')):
+            continue
+        family = self.stats_filter.family(source)
+        if family in sources:
+            sources[family] += [source]
+
+    # With --stats-rotate N, the high-cardinality families are split into
+    # N slices and only one slice is requested per scrape. The values for
+    # the other slices are served from stats_rotation_cache with the
+    # timestamp of the scrape that actually fetched them.
+    rotated_sources = {}
+    if self.stats_rotate > 1:
+        family_sources = sources['temperature'] + sources['df'] + sources['disk']
+        if self.skip_snmp == False:
+            family_sources += sources['interface']
+        current_slice = self.stats_rotation % self.stats_rotate
+        self.stats_rotation += 1
+        for index, source in enumerate(sorted(family_sources)):
+            rotated_sources[source] = (index % self.stats_rotate == current_slice)
+        for family in ['temperature', 'df', 'disk', 'interface']:
+            sources[family] = [source for source in sources[family] if rotated_sources.get(source, True)]
+
+    request_timestamp = int(datetime.now().timestamp())
+    sources_metadata = []
+    sources_request = {
+        "stats_list": [],
+        "stats-filter": {
+            "start": request_timestamp-900,
+            "end": request_timestamp
+        }
+    }
+
+    for source in sources['cpu']:
+        for metric in ['cpu-idle', 'cpu-nice', 'cpu-system', 'cpu-interrupt', 'cpu-user']:
+            sources_request['stats_list'] += [{
+                "source": source,
+                "type": metric,
+                "dataset": "value"
+            }]
+            sources_metadata += [{
+                "source": source,
+                "metric": metric,
+                "submetric": "value",
+                "metrictype": "DERIVE"
+            }]
+    for source in sources['temperature']:
+        sources_request['stats_list'] += [{
+            "source": source,
+            "type": "temperature",
+            "dataset": "value"
+        }]
+        sources_metadata += [{
+            "source": source,
+            "metric": "temperature",
+            "submetric": "value",
+            "metrictype": "GAUGE",
+            "rotate": source
+        }]
+    for source in sources['ctl']:
+        for metric in ['disk_octets', 'disk_octets-0-0', 'disk_ops', 'disk_ops-0-0', 'disk_time', 'disk_time-0-0']:
+            for submetric in ['read', 'write']:
+                sources_request['stats_list'] += [{
+                    "source": source,
+                    "type": metric,
+                    "dataset": submetric
+                }]
+                sources_metadata += [{
+                    "source": source,
+                    "metric": metric,
+                    "submetric": submetric,
+                    "metrictype": "DERIVE"
+                }]
+    for source in sources['df']:
+        for metric in ['df_complex-free', 'df_complex-reserved', 'df_complex-used']:
+            sources_request['stats_list'] += [{
+                "source": source,
+                "type": metric,
+                "dataset": "value"
+            }]
+            sources_metadata += [{
+                "source": source,
+                "metric": metric,
+                "submetric": "value",
+                "metrictype": "GAUGE",
+                "rotate": source
+            }]
+    for source in sources['disk']:
+        disk_list += [source.split('-')[1]]
+        disk_sources[source.split('-')[1]] = source
+        for metric in ['disk_octets', 'disk_ops', 'disk_time']:
+            for submetric in ['read', 'write']:
+                sources_request['stats_list'] += [{
+                    "source": source,
+                    "type": metric,
+                    "dataset": submetric
+                }]
+                sources_metadata += [{
+                    "source": source,
+                    "metric": metric,
+                    "submetric": submetric,
+                    "metrictype": "DERIVE",
+                    "rotate": source
+                }]
+    for source in sources['disk']:
+        for submetric in ['io_time', 'weighted_io_time']:
+            sources_request['stats_list'] += [{
+                "source": source,
+                "type": 'disk_io_time',
+                "dataset": submetric
+            }]
+            sources_metadata += [{
+                "source": source,
+                "metric": 'disk_io_time',
+                "submetric": submetric,
+                "metrictype": "DERIVE",
+                "rotate": source
+            }]
+    for disk in disk_list:
+        sources_request['stats_list'] += [{
+            "source": 'geom_stat',
+            "type": '-'.join(['geom_busy_percent', disk]),
+            "dataset": "value"
+        }]
+        sources_metadata += [{
+            "source": 'geom_stat',
+            "metric": '-'.join(['geom_busy_percent', disk]),
+            "submetric": "value",
+            "metrictype": "GAUGE",
+            "rotate": disk_sources[disk]
+        }]
+    for disk in disk_list:
+        for metric in ['geom_ops', 'geom_queue']:
+            sources_request['stats_list'] += [{
+                "source": 'geom_stat',
+                "type": '-'.join([metric, disk]),
+                "dataset": "length"
+            }]
+            sources_metadata += [{
+                "source": 'geom_stat',
+                "metric": '-'.join([metric, disk]),
+                "submetric": "length",
+                "metrictype": "GAUGE",
+                "rotate": disk_sources[disk]
+            }]
+    for disk in disk_list:
+        for metric in ['geom_bw', 'geom_latency', 'geom_ops_rwd']:
+            for submetric in ['delete', 'read', 'write']:
+                sources_request['stats_list'] += [{
+                    "source": 'geom_stat',
+                    "type": '-'.join([metric, disk]),
+                    "dataset": submetric
+                }]
+                sources_metadata += [{
+                    "source": 'geom_stat',
+                    "metric": '-'.join([metric, disk]),
+                    "submetric": submetric,
+                    "metrictype": "GAUGE",
+                    "rotate": disk_sources[disk]
+                }]
+    if self.skip_snmp == False:
+        for source in sources['interface']:
+            for metric in ['if_errors', 'if_octets', 'if_packets']:
+                for submetric in ['rx', 'tx']:
+                    sources_request['stats_list'] += [{
+                        "source": source,
+                        "type": metric,
+                        "dataset": submetric
+                    }]
+                    sources_metadata += [{
+                        "source": source,
+                        "metric": metric,
+                        "submetric": submetric,
+                        "metrictype": "DERIVE",
+                        "rotate": source
+                    }]
+    for submetric in ['longterm', 'midterm', 'shortterm']:
+        sources_request['stats_list'] += [{
+            "source": "load",
+            "type": 'load',
+            "dataset": submetric
+        }]
+        sources_metadata += [{
+            "source": "load",
+            "metric": 'load',
+            "submetric": submetric,
+            "metrictype": "GAUGE"
+        }]
+    for metric in ['active', 'cache', 'free', 'inactive', 'laundry', 'wired']:
+        sources_request['stats_list'] += [{
+            "source": "memory",
+            "type": '-'.join(['memory', metric]),
+            "dataset": 'value'
+        }]
+        sources_metadata += [{
+            "source": "memory",
+            "metric": '-'.join(['memory', metric]),
+            "submetric": 'value',
+            "metrictype": "GAUGE"
+        }]
+    for source in ['nfsstat-client', 'nfsstat-server']:
+        for metric in ['access', 'commit', 'create', 'fsinfo', 'fsstat', 'getattr', 'link', 'lookup', 'mkdir', 'mknod', 'pathconf', 'read', 'readdir', 'readirplus', 'readlink', 'remove', 'rename', 'rmdir', 'setattr', 'symlink', 'write']:
+            sources_request['stats_list'] += [{
+                "source": source,
+                "type": '-'.join(['nfsstat', metric]),
+                "dataset": 'value'
+            }]
+            sources_metadata += [{
+                "source": "memory",
+                "metric": '-'.join(['memory', metric]),
+                "submetric": 'value',
+                "metrictype": "DERIVE"
+            }]
+    for metric in ['blocked', 'idle', 'running', 'sleeping', 'stopped', 'wait', 'zombies']:
+        sources_request['stats_list'] += [{
+            "source": "processes",
+            "type": '-'.join(['ps_state', metric]),
+            "dataset": 'value'
+        }]
+        sources_metadata += [{
+            "source": "processes",
+            "metric": '-'.join(['ps_state', metric]),
+            "submetric": 'value',
+            "metrictype": "GAUGE"
+        }]
+    for metric in ['swap-free', 'swap-used']:
+        sources_request['stats_list'] += [{
+            "source": "swap",
+            "type": metric,
+            "dataset": 'value'
+        }]
+        sources_metadata += [{
+            "source": "swap",
+            "metric": metric,
+            "submetric": 'value',
+            "metrictype": "GAUGE"
+        }]
+    sources_request['stats_list'] += [{
+        "source": "uptime",
+        "type": "uptime",
+        "dataset": 'value'
+    }]
+    sources_metadata += [{
+        "source": "uptime",
+        "metric": "uptime",
+        "submetric": 'value',
+        "metrictype": "GAUGE"
+    }]
+    for metric in ['cache_eviction-cached', 'cache_eviction-eligible', 'cache_eviction-ineligible', 'cache_operation-allocated', 'cache_operation-deleted', 'cache_result-demand_data-hit', 'cache_result-demand_data-miss', 'cache_result-demand_metadata-hit', 'cache_result-demand_metadata-miss', 'cache_result-mfu-hit', 'cache_result-mfu_ghost-hit', 'cache_result-mru-hit', 'cache_result-mru_ghost-hit', 'cache_result-prefetch_data-hit', 'cache_result-prefetch_data-miss', 'cache_result-prefetch_metadata-hit', 'cache_result-prefetch_metadata-miss', 'hash_collisions', 'memory_throttle_count', 'mutex_operations-miss']:
+        sources_request['stats_list'] += [{
+            "source": "zfs_arc",
+            "type": metric,
+            "dataset": 'value'
+        }]
+        sources_metadata += [{
+            "source": "zfs_arc",
+            "metric": metric,
+            "submetric": 'value',
+            "metrictype": "DERIVE"
+        }]
+    for metric in ['cache_ratio-arc', 'cache_ratio-L2', 'cache_size-anon_size', 'cache_size-arc', 'cache_size-c', 'cache_size-c_max', 'cache_size-c_min', 'cache_size-hdr_size', 'cache_size-L2', 'cache_size-metadata_size', 'cache_size-mfu_ghost_size', 'cache_size-mfu_size', 'cache_size-mru_ghost_size', 'cache_size-mru_size', 'cache_size-other_size', 'cache_size-p']:
+        sources_request['stats_list'] += [{
+            "source": "zfs_arc",
+            "type": metric,
+            "dataset": 'value'
+        }]
+        sources_metadata += [{
+            "source": "zfs_arc",
+            "metric": metric,
+            "submetric": 'value',
+            "metrictype": "GAUGE"
+        }]
+    for submetric in ['rx', 'tx',]:
+        sources_request['stats_list'] += [{
+            "source": "zfs_arc",
+            "type": "io_octets-L2",
+            "dataset": submetric
+        }]
+        sources_metadata += [{
+            "source": "zfs_arc",
+            "metric": "io_octets-L2",
+            "submetric": submetric,
+            "metrictype": "DERIVE"
+        }]
+    for metric in ['arcstat_ratio_arc-hits', 'arcstat_ratio_arc-l2_hits', 'arcstat_ratio_arc-l2_misses', 'arcstat_ratio_arc-misses', 'arcstat_ratio_data-demand_data_hits', 'arcstat_ratio_data-demand_data_misses', 'arcstat_ratio_data-prefetch_data_hits', 'arcstat_ratio_data-prefetch_data_misses', 'arcstat_ratio_metadata-demand_metadata_hits', 'arcstat_ratio_metadata-demand_metadata_misses', 'arcstat_ratio_metadata-prefetch_metadata_hits', 'arcstat_ratio_metadata-prefetch_metadata_misses', 'arcstat_ratio_mu-mfu_ghost_hits', 'arcstat_ratio_mu-mfu_hits', 'arcstat_ratio_mu-mru_ghost_hits', 'arcstat_ratio_mu-mru_hits', 'gauge_arcstats_raw-l2_asize', 'gauge_arcstats_raw-l2_hdr_size', 'gauge_arcstats_raw-l2_size', 'gauge_arcstats_raw_arcmeta-arc_meta_limit', 'gauge_arcstats_raw_arcmeta-arc_meta_max', 'gauge_arcstats_raw_arcmeta-arc_meta_min', 'gauge_arcstats_raw_arcmeta-arc_meta_used', 'gauge_arcstats_raw_counts-allocated', 'gauge_arcstats_raw_counts-deleted', 'gauge_arcstats_raw_counts-mutex_miss', 'gauge_arcstats_raw_counts-recycle_miss', 'gauge_arcstats_raw_counts-stolen', 'gauge_arcstats_raw_cp-c', 'gauge_arcstats_raw_cp-c_max', 'gauge_arcstats_raw_cp-c_min', 'gauge_arcstats_raw_cp-p', 'gauge_arcstats_raw_demand-demand_data_hits', 'gauge_arcstats_raw_demand-demand_data_misses', 'gauge_arcstats_raw_demand-demand_metadata_hits', 'gauge_arcstats_raw_demand-demand_metadata_misses', 'gauge_arcstats_raw_duplicate-duplicate_buffers', 'gauge_arcstats_raw_duplicate-duplicate_buffers_size', 'gauge_arcstats_raw_duplicate-duplicate_reads', 'gauge_arcstats_raw_evict-evict_l2_cached', 'gauge_arcstats_raw_evict-evict_l2_eligible', 'gauge_arcstats_raw_evict-evict_l2_ineligible', 'gauge_arcstats_raw_evict-evict_skip', 'gauge_arcstats_raw_hash-hash_chain_max', 'gauge_arcstats_raw_hash-hash_chains', 'gauge_arcstats_raw_hash-hash_collisions', 'gauge_arcstats_raw_hash-hash_elements', 'gauge_arcstats_raw_hash-hash_elements_max', 'gauge_arcstats_raw_hits_misses-hits', 'gauge_arcstats_raw_hits_misses-misses', 'gauge_arcstats_raw_l2-l2_cksum_bad', 'gauge_arcstats_raw_l2-l2_feeds', 'gauge_arcstats_raw_l2-l2_hits', 'gauge_arcstats_raw_l2-l2_io_error', 'gauge_arcstats_raw_l2-l2_misses', 'gauge_arcstats_raw_l2-l2_rw_clash', 'gauge_arcstats_raw_l2_compress-l2_compress_failures', 'gauge_arcstats_raw_l2_compress-l2_compress_successes', 'gauge_arcstats_raw_l2_compress-l2_compress_zeros', 'gauge_arcstats_raw_l2_free-l2_cdata_free_on_write', 'gauge_arcstats_raw_l2_free-l2_free_on_write', 'gauge_arcstats_raw_l2abort-l2_abort_lowmem', 'gauge_arcstats_raw_l2bytes-l2_read_bytes', 'gauge_arcstats_raw_l2bytes-l2_write_bytes', 'gauge_arcstats_raw_l2evict-l2_evict_lock_retry', 'gauge_arcstats_raw_l2evict-l2_evict_reading', 'gauge_arcstats_raw_l2write-l2_write_buffer_bytes_scanned', 'gauge_arcstats_raw_l2write-l2_write_buffer_iter', 'gauge_arcstats_raw_l2write-l2_write_buffer_list_iter', 'gauge_arcstats_raw_l2write-l2_write_buffer_list_null_iter', 'gauge_arcstats_raw_l2write-l2_write_full', 'gauge_arcstats_raw_l2write-l2_write_in_l2', 'gauge_arcstats_raw_l2write-l2_write_io_in_progress', 'gauge_arcstats_raw_l2write-l2_write_not_cacheable', 'gauge_arcstats_raw_l2write-l2_write_passed_headroom', 'gauge_arcstats_raw_l2write-l2_write_pios', 'gauge_arcstats_raw_l2write-l2_write_spa_mismatch', 'gauge_arcstats_raw_l2write-l2_write_trylock_fail', 'gauge_arcstats_raw_l2writes-l2_writes_done', 'gauge_arcstats_raw_l2writes-l2_writes_error', 'gauge_arcstats_raw_l2writes-l2_writes_hdr_miss', 'gauge_arcstats_raw_l2writes-l2_writes_sent', 'gauge_arcstats_raw_memcount-memory_throttle_count', 'gauge_arcstats_raw_mru-mfu_ghost_hits', 'gauge_arcstats_raw_mru-mfu_hits', 'gauge_arcstats_raw_mru-mru_ghost_hits', 'gauge_arcstats_raw_mru-mru_hits', 'gauge_arcstats_raw_prefetch-prefetch_data_hits', 'gauge_arcstats_raw_prefetch-prefetch_data_misses', 'gauge_arcstats_raw_prefetch-prefetch_metadata_hits', 'gauge_arcstats_raw_prefetch-prefetch_metadata_misses', 'gauge_arcstats_raw_size-data_size', 'gauge_arcstats_raw_size-hdr_size', 'gauge_arcstats_raw_size-other_size', 'gauge_arcstats_raw_size-size']:
+        sources_request['stats_list'] += [{
+            "source": "zfs_arc_v2",
+            "type": metric,
+            "dataset": 'value'
+        }]
+        sources_metadata += [{
+            "source": "zfs_arc_v2",
+            "metric": metric,
+            "submetric": 'value',
+            "metrictype": "GAUGE"
+        }]
+
+    if self.stats_filter:
+        # Per-metric rules, and rules for the fixed sources above
+        keep = [self.stats_filter.keep(item['source'], item['type']) for item in sources_request['stats_list']]
+        sources_request['stats_list'] = [item for item, kept in zip(sources_request['stats_list'], keep) if kept]
+        sources_metadata = [metric for metric, kept in zip(sources_metadata, keep) if kept]
+
+    data = self._stats_request(sources_request)
+    if len(data) and len(data['data']) > 0:
+        for index, metric in enumerate(sources_metadata):
+            value = self._stats_latest_data(index, data['data'])
+            if metric['source'].split('-')[0] == 'cputemp':
+                """ value is in Kelvin, and it's off by a power of 10 """
+                try:
+                    value = str(float(value)/10 - 273.15)
+                except TypeError:
+                    value = None
+            if metric['source'] == 'load' and metric['submetric'] == 'shortterm' and value:
+                self.load_average = float(value)
+            labels = (metric['source'], metric['metric'], metric['submetric'], metric['metrictype'])
+            if metric.get('rotate') in rotated_sources:
+                if value:
+                    self.stats_rotation_cache[labels] = (metric['rotate'], value, request_timestamp)
+                else:
+                    self.stats_rotation_cache.pop(labels, None)
+            elif value:
+                collectd.add_metric(
+                    list(labels),
+                    value
+                )
+    else:
+        print("Empty response for collectd metadata for unknown reason", file=sys.stderr)
+
+    if rotated_sources:
+        for labels, (source, value, timestamp) in list(self.stats_rotation_cache.items()):
+            if source not in rotated_sources:
+                # Source is gone from stats/get_sources (or is filtered now)
+                del self.stats_rotation_cache[labels]
+                continue
+            collectd.add_metric(
+                list(labels),
+                value,
+                timestamp=timestamp
+            )
+
+    if self.limits.get('df'):
+        self._stats_limit_df(collectd)
+
+    return [collectd]
+
+def _stats_limit_df(self, collectd):
+    """ Keep the df sources with the most used bytes, fold the rest """
+
+    # The df values only exist once stats/get_data has answered, so this
+    # works on the finished family. Each source's free/reserved/used
+    # samples are regrouped, ranked by used and the remainder summed into
+    # source="other".
+    df_metrics = ['df_complex-free', 'df_complex-reserved', 'df_complex-used']
+    samples = []
+    df_sources = {}
+    for sample in collectd.samples:
+        source = sample.labels['source']
+        if source.startswith('df-') and sample.labels['metric'] in df_metrics:
+            df_sources.setdefault(source, {})[sample.labels['metric']] = sample
+        else:
+            samples.append(sample)
+
+    top = self._top('df', [operator.add]*3)
+    for source, metrics in df_sources.items():
+        used = metrics.get('df_complex-used')
+        top.offer(float(used.value) if used else 0, metrics,
+            [float(metrics[metric].value) if metric in metrics else None for metric in df_metrics])
+    for (metrics, values) in top.series('df', None):
+        if metrics is not None:
+            samples += [metrics[metric] for metric in df_metrics if metric in metrics]
+            continue
+        for metric, value in zip(df_metrics, values):
+            if value is not None:
+                samples.append(Sample(collectd.name, {
+                    'source': 'other',
+                    'metric': metric,
+                    'submetric': 'value',
+                    'metrictype': 'GAUGE'
+                }, value, None))
+    collectd.samples = samples
+
+def _stats_request(self, sources_request):
+    """ Make the API call(s) for stats"""
+
+    # If sources_request includes too many stats_list items in it, like if
+    # you have a lot of datasets, a single call to the API will fail. The
+    # middleware on the TrueNAS will run `rrdtool` with so many arguments
+    # that it will get an 'Argument list too long' error.
+
+    # This function will break it up into multiple calls when over 1200
+    # stats_list items, and recombine them as if they came from a single
+    # call.
+
+    # No way around it, if this has to make multiple calls, it will be slow
+
+    # Only the newest value of each item is used, so instead of the
+    # caller's window (15 minutes, 90 rows at collectd's 10s step), each
+    # family of sources is asked for just STATS_ROWS steps back from the
+    # end. That is enough for the newest rows, which aren't filled in yet,
+    # to be followed by real values. A family's step is learned from the
+    # 'meta' rrdtool sends back, in case its RRA is coarser than 10s, and
+    # families with different steps go in separate calls. Each call is
+    # reduced to one row with the latest value of each item, so calls with
+    # different windows still line up with the metadata.
+    #
+    # stats_list items also take a consolidation function, 'cf', which is
+    # left at the middleware's default of AVERAGE. At the RRA's own step
+    # every row is a single collectd reading, so there is nothing to
+    # consolidate and MAX or MIN would return the same values.
+
+    max_items = 1200
+    stats_filter = sources_request['stats-filter']
+    groups = {}
+    for index, item in enumerate(sources_request['stats_list']):
+        family = item['source'].split('-')[0]
+        step = self.stats_steps.get(family, 10)
+        groups.setdefault(step, []).append((index, family))
+
+    latest = [None]*len(sources_request['stats_list'])
+    rows = 0
+    for step, items in groups.items():
+        this_filter = {
+            "start": max(stats_filter['start'], stats_filter['end'] - STATS_ROWS*step),
+            "end": stats_filter['end'],
+            "step": step
+        }
+        for index in range(0, len(items), max_items):
+            chunk = items[index:index+max_items]
+            this_sources_request = {
+                "stats_list": [sources_request['stats_list'][item] for (item, family) in chunk],
+                "stats-filter": this_filter
+            }
+            try:
+                (data, trace) = self.request_traced("stats/get_data", this_sources_request)
+                response = data['data']
+            except KeyError as e:
+                print("Invalid response from TrueNAS API:")
+                print(data)
+                # The rest of the chunks can't be lined up with the
+                # metadata without this one, so give up on all of them.
+                return {'data':[]}
+            stats_rows.observe(len(response))
+            rows += len(response)
+            stats_bytes.observe(trace['bytes'])
+            if data.get('meta', {}).get('step'):
+                for (item, family) in chunk:
+                    self.stats_steps[family] = data['meta']['step']
+            for column, (item, family) in enumerate(chunk):
+                latest[item] = self._stats_latest_data(column, response)
+
+    if not rows:
+        return {'data':[]}
+    # See _stats_latest_data comments for an explanation of how this list
+    # of lists needs to look in the end
+    return {'data': [latest]}
+
+def _stats_latest_data(self, index, data):
+    """ find the latest data point for a given metric """
+
+    # Here's the structure of data:
+    #  "data": [ [29.0,29.98], [29.0,29.0], [29.0,29.02], [29.0,30.0] ]
+    # Each of the lists in the list represents a different timestamp with
+    # data. We reuested datapoints from the last few steps.
+    # Each of the numbers in each  of those lists represents the different
+    # metrics requested. index is the one of these we want to return.
+
+    # Start at the last list (latest data), and traverse the data backwards
+    # until we find a valid data point for the metric.
+    latest = len(data) - 1
+    while latest >= 0:
+        if data[latest][index]:
+            return str(data[latest][index])
+        latest -= 1
+
+    return None
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+# System and network information.
+
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily, InfoMetricFamily
+from prometheus_client import Summary
+
+systeminfo_timer = Summary('truenas_exporter_systeminfo_seconds', 'Time spent making systeminfo API requests')
+
+@systeminfo_timer.time()
+def _collect_system_info(self):
+    # Both at once rather than one after the other
+    self.prefetch(['network/configuration'])
+    info = self.request('system/info')
+    network = self.request('network/configuration')
+
+    uptime = CounterMetricFamily(
+        'truenas_uptime',
+        'TrueNAS uptime',
+        labels=["hostname"])
+    cores = GaugeMetricFamily(
+        'truenas_cores',
+        'TrueNAS CPU core count',
+        labels=["hostname"])
+    memory = GaugeMetricFamily(
+        'truenas_memory',
+        'TrueNAS physical memory',
+        labels=["hostname"])
+    infometric = InfoMetricFamily(
+        'truenas',
+        'TrueNAS Information',
+        labels=["hostname", "version", "serial", "serial_ha", "model", "product", "manufacturer"])
+    ha = GaugeMetricFamily(
+        'truenas_ha',
+        'TrueNAS High Availability Controller Status: 0=N/A 1=hostname_1 master 2=hostname_2 master',
+        labels=["hostname", "hostname_1", "hostname_2"])
+
+    self.cores = info['cores']
+
+    uptime.add_metric(
+        [info['hostname']],
+        info['uptime_seconds']
+    )
+    cores.add_metric(
+        [info['hostname']],
+        info['cores']
+    )
+    memory.add_metric(
+        [info['hostname']],
+        info['physmem']
+    )
+    infolabels = {
+        'hostname': info['hostname'],
+        'version': info['version'],
+        'serial': info['license']['system_serial'],
+        'serial_ha': info['license']['system_serial_ha'],
+        'model': info['license']['model'],
+        'product': info['system_product'],
+        'manufacturer': info['system_manufacturer']
+    }
+    infometric.add_metric(
+        infolabels.keys(),
+        infolabels
+    )
+    ha_status = 0
+    if network['hostname_virtual'] and network['hostname_local'] == network['hostname']:
+        ha_status = 1
+    elif network['hostname_virtual'] and network['hostname_local'] == network['hostname_b']:
+        ha_status = 2
+    ha.add_metric(
+        [info['hostname'], network['hostname'], network['hostname_b']],
+        ha_status
+    )
+
+    return [uptime, cores, memory, infometric, ha]
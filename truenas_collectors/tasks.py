@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+# Replication, rsync and cloudsync tasks, with their latest jobs from the
+# JobTracker.
+
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+from prometheus_client import Summary
+from datetime import datetime
+import sys, time
+from truenas_collector import JobTracker, LabelCache, Record, unknown_enumerations
+
+rsynctask_timer = Summary('truenas_exporter_rsynctask_seconds', 'Time spent making rsynctask API requests')
+cloudsync_timer = Summary('truenas_exporter_cloudsync_seconds', 'Time spent making cloudsync API requests')
+replications_timer = Summary('truenas_exporter_replications_seconds', 'Time spent making replications API requests')
+
+def _poll_jobs(self):
+    """ Bring the JobTracker up to date, once per scrape """
+    if self.jobs_polled == self.trace_start:
+        return
+    self.jobs_polled = self.trace_start
+    now = time.monotonic()
+    params = self.job_tracker.params(now)
+    jobs = self.request('core/get_jobs', params=params)
+    if isinstance(jobs, list):
+        self.jobs_updated |= self.job_tracker.update(jobs, params is None, now)
+
+def _tasks(self, kind):
+    """ (task, latest job) for all replication, rsync or cloudsync tasks """
+
+    # Task definitions hardly ever change, so they are only read again
+    # every --jobs-resync seconds, or when a job shows up for a task that
+    # wasn't there last time. The jobs come from the JobTracker. Only
+    # replications fall back to the job embedded in the definition, which
+    # the middleware takes from zettarepl rather than from core.get_jobs.
+    self._poll_jobs()
+    now = time.monotonic()
+    (fetched, tasks) = self.task_definitions.get(kind, (None, []))
+    known = {task_id(task) for task in tasks}
+    new_task = any(task_id not in known for (task_kind, task_id) in self.jobs_updated if task_kind == kind)
+    self.jobs_updated = {key for key in self.jobs_updated if key[0] != kind}
+    if fetched is None or now - fetched >= self.jobs_resync or new_task:
+        result = self.request(kind)
+        if isinstance(result, list):
+            tasks = result
+            self.task_definitions[kind] = (now, tasks)
+
+    for task in tasks:
+        job = self.job_tracker.job(kind, task_id(task))
+        if job is None and kind == 'replication':
+            job = task.job
+        yield (task, job)
+
+def task_id(task):
+    # Replications are records, rsync and cloudsync tasks plain dicts
+    return task.id if isinstance(task, Record) else task['id']
+
+def _job_counters(self, kind, labelnames):
+    """ Run, failure and transferred bytes counter families for a kind of task """
+    return [
+        CounterMetricFamily(
+            f'truenas_{kind}_runs',
+            f'Finished {kind} jobs',
+            labels=labelnames),
+        CounterMetricFamily(
+            f'truenas_{kind}_failures',
+            f'Failed {kind} jobs',
+            labels=labelnames),
+        CounterMetricFamily(
+            f'truenas_{kind}_transferred_bytes',
+            f'Bytes transferred by finished {kind} jobs, as reported in their progress',
+            labels=labelnames)
+    ]
+
+def _add_job_counters(self, counters, kind, task_id, labels):
+    tracker = self.job_tracker
+    for (family, counts) in zip(counters, [tracker.runs, tracker.failures, tracker.transferred]):
+        family.add_metric(labels, counts.get((kind, task_id), 0))
+
+@rsynctask_timer.time()
+def _collect_rsynctask(self):
+
+    progress = GaugeMetricFamily(
+        'truenas_rsynctask_progress',
+        'Progress of last rsynctask job',
+        labels=["description", "localpath", "remotehost", "remotepath", "direction", "enabled"])
+    state = GaugeMetricFamily(
+        'truenas_rsynctask_state',
+        'Current state of rsynctask job: 0==UNKNOWN, 1==RUNNING, 2==SUCCESS, 3==FAILED',
+        labels=["description", "localpath", "remotehost", "remotepath", "direction", "enabled"])
+    elapsed = GaugeMetricFamily(
+        'truenas_rsynctask_elapsed_seconds',
+        'Elapsed time in seconds of last rsynctask job',
+        labels=["description", "localpath", "remotehost", "remotepath", "direction", "enabled"])
+
+    counters = self._job_counters('rsynctask',
+        ["description", "localpath", "remotehost", "remotepath", "direction", "enabled"])
+
+    for (sync, job) in self._tasks('rsynctask'):
+        self._add_job_counters(counters, 'rsynctask', sync['id'],
+            [sync['desc'], sync['path'], sync['remotehost'], sync['remotepath'], sync['direction'], str(sync['enabled'])])
+        if job is None:
+            continue
+        if job['progress']['percent']:
+            progress.add_metric(
+                [sync['desc'], sync['path'], sync['remotehost'], sync['remotepath'], sync['direction'], str(sync['enabled'])],
+                job['progress']['percent']
+            )
+        state.add_metric(
+            [sync['desc'], sync['path'], sync['remotehost'], sync['remotepath'], sync['direction'], str(sync['enabled'])],
+            self._rsynctask_state_enum(job['state'])
+        )
+        if job['time_finished']:
+            elapsed.add_metric(
+                [sync['desc'], sync['path'], sync['remotehost'], sync['remotepath'], sync['direction'], str(sync['enabled'])],
+                job['time_finished']['$date'] - job['time_started']['$date']
+            )
+        else:
+            elapsed.add_metric(
+                [sync['desc'], sync['path'], sync['remotehost'], sync['remotepath'], sync['direction'], str(sync['enabled'])],
+                1000*datetime.now().timestamp() - job['time_started']['$date']
+            )
+
+
+    return [progress, state, elapsed] + counters
+
+def _rsynctask_state_enum(self, value):
+    if value == "RUNNING":
+        return 1
+    if value == "SUCCESS":
+        return 2
+    if value == "FAILED":
+        return 3
+
+    unknown_enumerations.inc()
+    print(f"Unknown/new rsynctask state: {value}. Needs to be added to " +
+        " TrueNasCollector._rsynctask_state_enum()", file=sys.stderr)
+    return 0
+
+@cloudsync_timer.time()
+def _collect_cloudsync(self):
+
+    progress = GaugeMetricFamily(
+        'truenas_cloudsync_progress',
+        'Progress of last CloudSync job',
+        labels=["description", "path"])
+    state = GaugeMetricFamily(
+        'truenas_cloudsync_state',
+        'Current state of CloudSync job: 0==UNKNOWN, 1==RUNNING, 2==SUCCESS, 3==NEVER, 4==FAILED, 5==ABORTED, 6==WAITING',
+        labels=["description", "path"])
+    result = GaugeMetricFamily(
+        'truenas_cloudsync_result',
+        'Result of last CloudSync job: 0==UNKNOWN, 1==None, 2==NEVER',
+        labels=["description", "path"])
+    elapsed = GaugeMetricFamily(
+        'truenas_cloudsync_elapsed_seconds',
+        'Elapsed time in seconds of last CloudSync job',
+        labels=["description", "path"])
+
+    counters = self._job_counters('cloudsync', ["description", "path"])
+
+    for (sync, job) in self._tasks('cloudsync'):
+        self._add_job_counters(counters, 'cloudsync', sync['id'], [sync['description'], sync['path']])
+        if job:
+            if job['progress']['percent']:
+                progress.add_metric(
+                    [sync['description'], sync['path']],
+                    job['progress']['percent']
+                )
+            else:
+                progress.add_metric(
+                    [sync['description'], sync['path']],
+                    -1
+                )
+            state.add_metric(
+                [sync['description'], sync['path']],
+                self._cloudsync_state_enum(job['state'])
+            )
+            result.add_metric(
+                [sync['description'], sync['path']],
+                self._cloudsync_result_enum(job['result'])
+            )
+            if job['time_finished']:
+                elapsed.add_metric(
+                    [sync['description'], sync['path']],
+                    job['time_finished']['$date'] - job['time_started']['$date'] 
+                )
+            else:
+                elapsed.add_metric(
+                    [sync['description'], sync['path']],
+                    1000*datetime.now().timestamp() - job['time_started']['$date']
+                )
+        else:
+            state.add_metric(
+                [sync['description'], sync['path']],
+                self._cloudsync_state_enum("NEVER")
+            )
+            result.add_metric(
+                [sync['description'], sync['path']],
+                self._cloudsync_result_enum("NEVER")
+            )                
+    
+    return [progress, state, result, elapsed] + counters
+
+def _cloudsync_state_enum(self, value):
+    if value == "RUNNING":
+        return 1
+    if value == "SUCCESS":
+        return 2
+    if value == "NEVER":
+        return 3
+    if value == "FAILED":
+        return 4
+    if value == "ABORTED":
+        return 5
+    if value == "WAITING":
+        return 6
+
+    unknown_enumerations.inc()
+    print(f"Unknown/new CloudSync state: {value}. Needs to be added to " +
+        " TrueNasCollector._cloudsync_state_enum()", file=sys.stderr)
+    return 0
+
+def _cloudsync_result_enum(self, value):
+    if value is None:
+        return 1
+    if value == "NEVER":
+        return 2
+
+    unknown_enumerations.inc()
+    print(f"Unknown/new CloudSync result: {value}. Needs to be added to " +
+        " TrueNasCollector._cloudsync_result_enum()", file=sys.stderr)
+    return 0
+
+@replications_timer.time()
+def _collect_replications(self):
+
+    state = GaugeMetricFamily(
+        'truenas_replication_state',
+        'Current replication state: 0=UNKNOWN 1=SUCCESS 2=RUNNING 3=FAILED 4=WAITING',
+        labels=["sources", "target", "target_system", "transport"])
+    last_finished = GaugeMetricFamily(
+        'truenas_replication_last_finished',
+        'Replication last finished',
+        labels=["sources", "target", "target_system", "transport"])
+    elapsed = GaugeMetricFamily(
+        'truenas_replication_last_elapsed',
+        'Last replication elapsed milliseconds',
+        labels=["sources", "target", "target_system", "transport"])
+    progress = GaugeMetricFamily(
+        'truenas_replication_progress',
+        'Current replication progress',
+        labels=["sources", "target", "target_system", "transport"])
+
+    counters = self._job_counters('replication', ["sources", "target", "target_system", "transport"])
+
+    replications = False
+    for (replication, job) in self._tasks('replication'):
+        replications = True
+        # Cached by replication id, rebuilt if the task was edited
+        check = (replication.source_datasets, replication.target_dataset, replication.target_system, replication.transport)
+        labels = self.replication_labels.get(replication.id, check)
+        if labels is None:
+            labels = self.replication_labels.put(replication.id, check,
+                [' '.join(replication.source_datasets), replication.target_dataset, replication.target_system, replication.transport])
+
+        for (family, counts) in zip(counters, [self.job_tracker.runs, self.job_tracker.failures, self.job_tracker.transferred]):
+            LabelCache.add(family, labels, counts.get(('replication', replication.id), 0))
+        if job and 'state' in job:
+            LabelCache.add(state, labels, self._replication_state_enum(job['state']))
+        if job is not None and job.get('time_finished') and job['state'] in JobTracker.FINISHED:
+            LabelCache.add(last_finished, labels, max(job['time_finished']['$date'], replication.finished or 0))
+        elif replication.finished is not None:
+            LabelCache.add(last_finished, labels, replication.finished)
+        if job is not None and job.get('time_started'):
+            if job['time_finished']:
+                LabelCache.add(elapsed, labels, job['time_finished']['$date'] - job['time_started']['$date'])
+            else:
+                LabelCache.add(elapsed, labels, 1000*datetime.now().timestamp() - job['time_started']['$date'])
+        if job is not None and job['progress']['percent']:
+            LabelCache.add(progress, labels, job['progress']['percent'])
+    if replications:
+        self.replication_labels.sweep()
+
+    return [state, last_finished, elapsed, progress] + counters
+
+def _replication_state_enum(self, value):
+    if value == "SUCCESS":
+        return 1
+    if value == "RUNNING":
+        return 2
+    if value == "FAILED":
+        return 3
+    if value == "WAITING":
+        return 4
+
+    unknown_enumerations.inc()
+    print(f"Unknown/new Replication state: {value}. Needs to be added to " +
+        " TrueNasCollector._replication_state_enum()", file=sys.stderr)
+    return 0
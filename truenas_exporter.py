@@ -1,23 +1,349 @@
 #!/usr/bin/env python3
 
 from prometheus_client.core import REGISTRY
-from prometheus_client import make_wsgi_app, Summary, Counter
-from wsgiref.simple_server import make_server, WSGIRequestHandler
-import argparse, os, sys
+from prometheus_client import make_wsgi_app, generate_latest, Summary, Counter, CONTENT_TYPE_LATEST
+from prometheus_client.exposition import choose_encoder, gzip_accepted
+from prometheus_client.parser import text_string_to_metric_families
+from wsgiref.simple_server import make_server, WSGIRequestHandler, WSGIServer
+import argparse, os, sys, gzip, hashlib, time, shlex, signal
 from urllib.parse import parse_qs
 import threading
-from truenas_collector import TrueNasCollector
+from truenas_collector import TrueNasCollector, StatsFilter, LIMIT_FAMILIES, JSON_DECODERS
+from truenas_workers import WorkerPool, exporter_metrics, Families
+import truenas_collectors
 import requests
+import cProfile, pstats, io, json, tracemalloc, ipaddress
 
 REQUESTS = Summary('truenas_exporter_requests_seconds', 'Time spent processing requests')
+RELOADS = Counter('truenas_exporter_config_reloads', 'Configuration reloads by result', ['result'])
+# Settings only a restart can change
+RESTART_SETTINGS = ['port', 'workers', 'push', 'push_interval', 'push_batch',
+    'push_resend', 'push_buffer', 'push_buffer_max', 'push_job']
 @REQUESTS.time()
 def truenas_exporter(environ, start_fn):
     if environ['PATH_INFO'] == '/metrics':
-        return metrics_app(environ, start_fn)
+        if 'name[]' in parse_qs(environ.get('QUERY_STRING', '')):
+            # Filtered output isn't worth caching
+            if pool:
+                return worker_metrics_app(environ, start_fn)
+            return metrics_app(environ, start_fn)
+        return cached_metrics_app(environ, start_fn)
+    if environ['PATH_INFO'] == '/-/reload':
+        if not debug_networks or not debug_allowed(environ):
+            start_fn('403 Forbidden', [])
+            return [b'Reloading is not allowed from this address']
+        if environ['REQUEST_METHOD'] != 'POST':
+            start_fn('405 Method Not Allowed', [('Allow', 'POST')])
+            return [b'Reload with a POST']
+        if not reload_config():
+            start_fn('400 Bad Request', [])
+            return [b'Invalid configuration, kept the current one']
+        start_fn('200 OK', [])
+        return [b'Reloaded']
+    if debug_networks and environ['PATH_INFO'].startswith('/debug/'):
+        if not debug_allowed(environ):
+            start_fn('403 Forbidden', [])
+            return [b'Debug endpoints are not allowed from this address']
+        if pool:
+            start_fn('501 Not Implemented', [])
+            return [b'Debug endpoints are not available with --workers']
+        if environ['PATH_INFO'] == '/debug/profile':
+            return debug_profile(environ, start_fn)
+        if environ['PATH_INFO'] == '/debug/scrape-trace':
+            return debug_scrape_trace(environ, start_fn)
 
     start_fn('404 Not Found', [])
     return [b'Usage: Metrics can be retrieved from /metrics']
 
+def worker_metrics_app(environ, start_fn):
+    """ /metrics with --workers: our own metrics, then what the workers sent """
+    payload = pool.scrape()
+    output = generate_latest(REGISTRY) + payload
+    start_fn('200 OK', [('Content-Type', CONTENT_TYPE_LATEST)])
+    return [output]
+
+class PayloadCache(object):
+    """ The rendered /metrics output of the latest collection """
+
+    # One collection is rendered at most once per content type (text or
+    # OpenMetrics) and encoding (identity or gzip), the first time a client
+    # asks for that combination, and the same bytes are handed to every
+    # scraper until the collection is more than --cache-payload seconds old.
+    # Each rendering gets an ETag, so a client that already has it gets a 304.
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.collected = None
+        self.families = []
+        self.payload = b''
+        self.rendered = {}
+
+    def refresh(self):
+        """ Collect again if the last collection is too old """
+        if self.collected is not None and time.monotonic() - self.collected < self.ttl:
+            return
+        # The workers' output is already text. Scrape them first so that the
+        # pool's own metrics come from this scrape.
+        self.payload = pool.scrape() if pool else b''
+        self.families = list(REGISTRY.collect())
+        self.collected = time.monotonic()
+        self.rendered = {}
+
+    def get(self, accept, gzipped):
+        """ (body, content type, ETag) for a client """
+        if pool:
+            # No OpenMetrics here, the workers' output can't be mixed into it
+            (encoder, content_type) = choose_encoder('')
+        else:
+            (encoder, content_type) = choose_encoder(accept)
+        key = (content_type, gzipped)
+        if key not in self.rendered:
+            if gzipped:
+                (body, content_type, etag) = self.get(accept, False)
+                self.rendered[key] = (gzip.compress(body), content_type, etag[:-1] + '-gzip"')
+            else:
+                body = encoder(Families(self.families)) + self.payload
+                etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+                self.rendered[key] = (body, content_type, etag)
+        return self.rendered[key]
+
+def cached_metrics_app(environ, start_fn):
+    """ /metrics served from the PayloadCache """
+    payload_cache.refresh()
+    gzipped = gzip_accepted(environ.get('HTTP_ACCEPT_ENCODING', ''))
+    (body, content_type, etag) = payload_cache.get(environ.get('HTTP_ACCEPT', ''), gzipped)
+    headers = [('ETag', etag), ('Vary', 'Accept, Accept-Encoding')]
+    if etag in [tag.strip() for tag in environ.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+        start_fn('304 Not Modified', headers)
+        return []
+    headers.append(('Content-Type', content_type))
+    if gzipped:
+        headers.append(('Content-Encoding', 'gzip'))
+    start_fn('200 OK', headers)
+    return [body]
+
+def push_collect():
+    """ Everything a scrape of /metrics would return, for --push """
+    if pool:
+        payload = pool.scrape()
+        yield from REGISTRY.collect()
+        yield from text_string_to_metric_families(payload.decode())
+    else:
+        yield from REGISTRY.collect()
+
+def debug_allowed(environ):
+    """ Only clients from --debug-allow networks may use /debug/ """
+    try:
+        address = ipaddress.ip_address(environ.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in network for network in debug_networks)
+
+def debug_profile(environ, start_fn):
+    """ Run one full scrape, including serialization, under cProfile """
+
+    # The scrape runs on a new collector with the same settings, like the
+    # first scrape after a start. Profiling the real one would move its stats
+    # rotation, snapshot walk and job cursor along, and change what the next
+    # scrape returns.
+
+    # Query parameters:
+    #   sort=cumulative|tottime|calls...  pstats sort order
+    #   limit=N                           number of functions/allocation sites
+    #   tracemalloc=1                     also report top allocation sites
+    params = parse_qs(environ.get('QUERY_STRING', ''))
+    sort = params.get('sort', ['cumulative'])[0]
+    limit = int(params.get('limit', ['40'])[0])
+    trace_memory = params.get('tracemalloc', ['0'])[0] not in ['0', '']
+
+    profiled = TrueNasCollector(**collector.settings)
+    # It still takes its turn under --api-concurrency
+    profiled.limiters = collector.limiters
+    if trace_memory:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        payload = generate_latest(profiled)
+    finally:
+        profiler.disable()
+        # Stops its --sample-interval thread, if it started one
+        profiled.sampler = None
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            (current_memory, peak_memory) = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    output = io.StringIO()
+    output.write(f'Scrape produced {len(payload)} bytes of metrics\n\n')
+    try:
+        pstats.Stats(profiler, stream=output).sort_stats(sort).print_stats(limit)
+    except KeyError:
+        start_fn('400 Bad Request', [])
+        return [f'Unknown sort order: {sort}'.encode()]
+    if trace_memory:
+        output.write(f'Peak traced memory during the scrape: {peak_memory} bytes\n')
+        output.write(f'Top {limit} allocation sites still held after the scrape:\n\n')
+        for stat in snapshot.statistics('lineno')[:limit]:
+            output.write(f'{stat}\n')
+
+    start_fn('200 OK', [('Content-Type', 'text/plain; charset=utf-8')])
+    return [output.getvalue().encode()]
+
+def debug_scrape_trace(environ, start_fn):
+    """ API calls made by the most recent scrape, with timings and sizes """
+    start_fn('200 OK', [('Content-Type', 'application/json')])
+    return [json.dumps(collector.last_scrape_trace, indent=2).encode()]
+
+
+def read_config(filename):
+    """ Options from a --config file: command line options, # for comments """
+    options = []
+    with open(filename) as config:
+        for line in config:
+            options.extend(shlex.split(line, comments=True))
+    return options
+
+def parse_settings(argv):
+    """ (options, collector settings) from the command line and --config """
+    config = argparse.ArgumentParser(add_help=False)
+    config.add_argument('--config', dest='config', default=None)
+    (known, rest) = config.parse_known_args(argv)
+    options = []
+    if known.config:
+        try:
+            options = read_config(known.config)
+        except (OSError, ValueError) as e:
+            parser.error(f'Unable to read --config {known.config}: {e}')
+    # The command line comes last, so it wins over the file
+    args = parser.parse_args(options + argv)
+
+    limits = {}
+    for limit in args.limits:
+        try:
+            (family, count) = limit.split('=')
+            if family not in LIMIT_FAMILIES:
+                raise ValueError
+            limits[family] = int(count)
+        except ValueError:
+            parser.error(f'Invalid --limit {limit}, expected one of ' +
+                ', '.join(LIMIT_FAMILIES) + ' followed by =N')
+    try:
+        StatsFilter(args.stats_include, args.stats_exclude)
+    except ValueError as e:
+        parser.error(f'{e}, expected FAMILY=REGEX or FAMILY/METRIC with one ' +
+            'of ' + ', '.join(StatsFilter.FAMILIES))
+    collectors = None
+    if args.collectors:
+        collectors = [name.strip() for name in args.collectors.split(',')]
+        for name in collectors:
+            if name not in truenas_collectors.NAMES:
+                parser.error(f'Invalid --collectors {name}, expected some of ' +
+                    ', '.join(truenas_collectors.NAMES))
+    try:
+        parse_networks(args.debug_allow)
+    except ValueError as e:
+        parser.error(f'Invalid --debug-allow: {e}')
+
+    settings = {'target': args.target,
+        'username': os.environ.get('TRUENAS_USER'),
+        'password': os.environ.get('TRUENAS_PASS'),
+        'cache_smart': args.cache_smart,
+        'skip_snmp': args.skip_snmp,
+        'skip_df_regex': args.skip_df_regex,
+        'stats_rotate': args.stats_rotate,
+        'circuit_breaker': args.circuit_breaker,
+        'circuit_breaker_max_backoff': args.circuit_breaker_max_backoff,
+        'throttle': args.throttle,
+        'throttle_load': args.throttle_load,
+        'throttle_latency': args.throttle_latency,
+        'throttle_max_interval': args.throttle_max_interval,
+        'limits': limits,
+        'json_decoder': args.json_decoder,
+        'stats_include': args.stats_include,
+        'stats_exclude': args.stats_exclude,
+        'snapshots_interval': args.snapshots_interval,
+        'snapshots_page_size': args.snapshots_page_size,
+        'snapshots_pages': args.snapshots_pages,
+        'cache_disk_temperatures': args.cache_disk_temperatures,
+        'jobs_resync': args.jobs_resync,
+        'failover_timeout': args.failover_timeout,
+        'cache_enclosure': args.cache_enclosure,
+        'sample_interval': args.sample_interval,
+        'sample_buffer': args.sample_buffer,
+        'sample_window': args.sample_window,
+        'collectors': collectors,
+        'api_concurrency': args.api_concurrency,
+        'api_concurrency_bulk': args.api_concurrency_bulk}
+    return (args, settings)
+
+def parse_networks(networks):
+    """ --debug-allow as a list of networks """
+    if not networks:
+        return []
+    return [ipaddress.ip_network(network.strip(), strict=False)
+        for network in networks.split(',')]
+
+def reload_config():
+    """ Read the command line and --config again and apply what changed """
+
+    # Collectors, filters and stats plans only get rebuilt where a changed
+    # setting affects them, see TrueNasCollector.reconfigure(). A bad
+    # configuration is reported and the running one kept.
+    global args, debug_networks
+    try:
+        (new_args, settings) = parse_settings(sys.argv[1:])
+    except SystemExit:
+        print('Reload failed, keeping the current configuration', file=sys.stderr)
+        RELOADS.labels('failure').inc()
+        return False
+
+    if pool and settings['collectors'] != pool.kwargs.get('collectors'):
+        # The workers' groups were made from the enabled collectors
+        print('Changing --collectors with --workers needs a restart, ignoring it', file=sys.stderr)
+        settings['collectors'] = pool.kwargs.get('collectors')
+    changed = (pool or collector).reconfigure(settings)
+    if changed:
+        # Don't serve output from the old settings any longer
+        payload_cache.collected = None
+    for name in ['cache_payload', 'debug_allow']:
+        if getattr(new_args, name) != getattr(args, name):
+            changed.append(name)
+    payload_cache.ttl = new_args.cache_payload
+    debug_networks = parse_networks(new_args.debug_allow)
+    for name in RESTART_SETTINGS:
+        if getattr(new_args, name) != getattr(args, name):
+            print(f'Changing --{name.replace("_", "-")} needs a restart, ignoring it', file=sys.stderr)
+            setattr(new_args, name, getattr(args, name))
+    args = new_args
+    print('Reloaded configuration, changed: ' + (', '.join(changed) or 'nothing'), file=sys.stderr)
+    RELOADS.labels('success').inc()
+    return True
+
+def request_reload(signum, frame):
+    """ SIGHUP handler: reload between scrapes, or between pushes with --push """
+    _ReloadingServer.reload_requested.set()
+    if writer:
+        writer.wake()
+
+def push_reload():
+    """ Apply a requested reload in --push mode, where there is no server """
+    if _ReloadingServer.reload_requested.is_set():
+        _ReloadingServer.reload_requested.clear()
+        if reload_config():
+            writer.collect = push_collect
+            writer.labels['instance'] = args.target.split(',')[0]
+
+class _ReloadingServer(WSGIServer):
+    """ WSGI server that reloads the configuration between requests on SIGHUP """
+
+    reload_requested = threading.Event()
+
+    def service_actions(self):
+        # Runs between requests, so never in the middle of a collection
+        if self.reload_requested.is_set():
+            self.reload_requested.clear()
+            reload_config()
 
 class _SilentHandler(WSGIRequestHandler):
     """WSGI handler that does not log requests."""
@@ -31,29 +357,145 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Return Prometheus metrics from querying the TrueNAS API.' +
         'Set TRUENAS_USER and TRUENAS_PASS as needed to reach the API.')
+    parser.add_argument('--config', dest='config', default=None,
+        help='File with more of these options, one or more per line as on ' +
+        'the command line, # for comments. The command line wins. Reloaded ' +
+        'on SIGHUP or a POST to /-/reload.')
     parser.add_argument('--port', dest='port', default='9912',
         help='Listening HTTP port for Prometheus exporter')
     parser.add_argument('--target', dest='target', required=True,
-        help='Target IP/Name of TrueNAS Device')
+        help='Target IP/Name of TrueNAS Device. For HA systems, a ' +
+        'comma-separated list of the virtual and both controllers\' ' +
+        'addresses to fail over between.')
+    parser.add_argument('--failover-timeout', dest='failover_timeout',
+        default=3, type=int, help='Connect timeout in seconds with more than ' +
+        'one --target, and timeout for probing them after a failure.')
     parser.add_argument('--skip-snmp', dest='skip_snmp', default=False,
         action='store_true', help='Skip metrics available via SNMP - may ' +
         'save about a second in scrape time')
     parser.add_argument('--cache-smart', dest='cache_smart', default=24,
         action='store_true', help='Time to cache SMART test results for in ' +
         'hours. These probably only update once a week.')
+    parser.add_argument('--cache-disk-temperatures', dest='cache_disk_temperatures',
+        default=60, type=int, help='Time to cache disk temperatures for in ' +
+        'seconds.')
+    parser.add_argument('--cache-enclosure', dest='cache_enclosure',
+        default=60, type=int, help='Time to cache the enclosure layout ' +
+        '(element labels) for in seconds. Status and readings are read on ' +
+        'every scrape.')
+    parser.add_argument('--jobs-resync', dest='jobs_resync', default=600,
+        type=int, help='Seconds between full reads of the job list and the ' +
+        'replication, rsync and cloudsync task definitions. In between, only ' +
+        'new and unfinished jobs are fetched.')
     parser.add_argument('--skip-df-regex', dest='skip_df_regex', default=None,
         help='Regular expression that will match filesystems to skip for costly' +
         'df metrics.')
+    parser.add_argument('--stats-include', dest='stats_include', action='append',
+        default=[], help='FAMILY=REGEX to only request collectd sources of a ' +
+        'family whose name matches, or FAMILY/METRIC to only request those ' +
+        'metrics. Families: ' + ', '.join(StatsFilter.FAMILIES) + '. May be ' +
+        'repeated.')
+    parser.add_argument('--stats-exclude', dest='stats_exclude', action='append',
+        default=[], help='FAMILY=REGEX or FAMILY/METRIC for collectd sources ' +
+        'or metrics not to request, like --stats-include. May be repeated.')
+    parser.add_argument('--stats-rotate', dest='stats_rotate', default=1,
+        type=int, help='Spread the costly df, disk, interface and temperature ' +
+        'stats over this many scrapes, serving the rest from memory.')
+    parser.add_argument('--snapshots-interval', dest='snapshots_interval',
+        default=0, type=int, help='Walk the full list of ZFS snapshots this ' +
+        'often, in seconds, for per-dataset snapshot counts, ages and sizes. ' +
+        'Disabled by default.')
+    parser.add_argument('--snapshots-page-size', dest='snapshots_page_size',
+        default=1000, type=int, help='Snapshots per zfs/snapshot request.')
+    parser.add_argument('--snapshots-pages', dest='snapshots_pages', default=10,
+        type=int, help='Most zfs/snapshot requests per scrape. A longer walk ' +
+        'continues on the next scrape.')
+    parser.add_argument('--sample-interval', dest='sample_interval', default=0,
+        type=float, help='Sample CPU, interface octets, disk ops and the ARC ' +
+        'hit ratio this often, in seconds, for min, max and percentiles ' +
+        'between scrapes. No shorter than collectd\'s step (usually 10). ' +
+        'Disabled by default.')
+    parser.add_argument('--sample-buffer', dest='sample_buffer', default=60,
+        type=int, help='Samples kept per series for --sample-interval. Older ' +
+        'ones are overwritten.')
+    parser.add_argument('--sample-window', dest='sample_window', default=60,
+        type=int, help='Seconds of samples that min, max and percentiles of ' +
+        '--sample-interval cover. Set it to the scrape interval.')
+    parser.add_argument('--api-concurrency', dest='api_concurrency', default=0,
+        type=int, help='Most API calls in flight to the TrueNAS at once. ' +
+        'Waiting health calls (alerts, pools, system info) get a free slot ' +
+        'first, then inventory, then bulk stats, enclosure and snapshot ' +
+        'calls. No limit by default.')
+    parser.add_argument('--api-concurrency-bulk', dest='api_concurrency_bulk',
+        default=1, type=int, help='Most bulk API calls in flight at once ' +
+        'under --api-concurrency.')
+    parser.add_argument('--circuit-breaker', dest='circuit_breaker', default=0,
+        type=int, help='Stop calling an API endpoint after this many ' +
+        'consecutive failures and serve its last good response instead.')
+    parser.add_argument('--circuit-breaker-max-backoff', dest='circuit_breaker_max_backoff',
+        default=300, type=int, help='Longest time in seconds an open circuit ' +
+        'waits before trying the endpoint again.')
+    parser.add_argument('--throttle', dest='throttle', default=False,
+        action='store_true', help='Refresh the costly dataset and stats ' +
+        'collectors less often while the TrueNAS is busy.')
+    parser.add_argument('--throttle-load', dest='throttle_load', default=1.0,
+        type=float, help='1-minute load average per core above which ' +
+        '--throttle starts stretching refresh intervals.')
+    parser.add_argument('--throttle-latency', dest='throttle_latency', default=2.0,
+        type=float, help='Average API response time in seconds above which ' +
+        '--throttle starts stretching refresh intervals.')
+    parser.add_argument('--throttle-max-interval', dest='throttle_max_interval',
+        default=300, type=int, help='Longest time in seconds --throttle will ' +
+        'go without refreshing a collector.')
+    parser.add_argument('--limit', dest='limits', action='append', default=[],
+        help='FAMILY=N to only export the N biggest objects of a family and ' +
+        'fold the rest into an "other" series. Families: ' +
+        ', '.join(LIMIT_FAMILIES) + '. May be repeated.')
+    parser.add_argument('--json-decoder', dest='json_decoder',
+        default=next(iter(JSON_DECODERS)), choices=JSON_DECODERS.keys(),
+        help='JSON decoder for API responses, defaults to the fastest one ' +
+        'installed.')
+    parser.add_argument('--debug-allow', dest='debug_allow', default=None,
+        help='Comma-separated networks (e.g. 127.0.0.1/32,::1/128) allowed ' +
+        'to use the /debug/profile and /debug/scrape-trace endpoints and ' +
+        '/-/reload. The endpoints are disabled without this.')
+    parser.add_argument('--collectors', dest='collectors', default=None,
+        help='Comma-separated collectors to run, all of them by default. ' +
+        'The others are never loaded. One or more of ' +
+        ', '.join(truenas_collectors.NAMES) + '.')
+    parser.add_argument('--workers', dest='workers', default=0, type=int,
+        help='Run the collectors in this many worker processes, spreading ' +
+        'the costly ones over several cores. 0 runs them in the exporter ' +
+        'process.')
+    parser.add_argument('--cache-payload', dest='cache_payload', default=0,
+        type=int, help='Serve the same rendered /metrics output to every ' +
+        'scrape for this many seconds after a collection, for several ' +
+        'Prometheus servers scraping one exporter. 0 collects on every scrape.')
+    parser.add_argument('--push', dest='push', default=None,
+        help='Prometheus remote-write URL to push metrics to on a schedule, ' +
+        'instead of serving them for scraping.')
+    parser.add_argument('--push-interval', dest='push_interval', default=60,
+        type=float, help='Seconds between pushes.')
+    parser.add_argument('--push-batch', dest='push_batch', default=5000,
+        type=int, help='Most series sent in one remote-write request.')
+    parser.add_argument('--push-resend', dest='push_resend', default=120,
+        type=float, help='Seconds after which a series that hasn\'t changed ' +
+        'is sent again. Keep this under the receiver\'s lookback.')
+    parser.add_argument('--push-buffer', dest='push_buffer', default=None,
+        help='Directory to keep requests in while the receiver is down, ' +
+        'dropped otherwise.')
+    parser.add_argument('--push-buffer-max', dest='push_buffer_max', default=100,
+        type=int, help='Most MiB of requests to keep in --push-buffer.')
+    parser.add_argument('--push-job', dest='push_job', default='truenas',
+        help='job label for pushed series. The instance label is the target.')
 
-    args = parser.parse_args()
+    (args, settings) = parse_settings(sys.argv[1:])
 
     metrics_app = make_wsgi_app()
-    username = os.environ.get('TRUENAS_USER')
-    password = os.environ.get('TRUENAS_PASS')
-    target = args.target
-    skip_snmp = args.skip_snmp
-    cache_smart = args.cache_smart
-    skip_df_regex = args.skip_df_regex
+    username = settings['username']
+    password = settings['password']
+    target = settings['target']
+    debug_networks = parse_networks(args.debug_allow)
 
     if (username == None or len(username) == 0):
         print("Make sure to set TRUENAS_USER environment variable to the API " +
@@ -66,25 +508,51 @@ if __name__ == '__main__':
         parser.print_help()
         exit(1)
 
-    try:
-        r = requests.get(
-            f'https://{target}/api/v2.0/core/ping',
-            auth=(username, password),
-            headers={'Content-Type': 'application/json'},
-            verify=False,
-            timeout=5
-        )
-        if r.status_code != 200 or r.text != '"pong"':
+    # With several --target addresses, one answering is enough
+    for address in target.split(','):
+        try:
+            r = requests.get(
+                f'https://{address}/api/v2.0/core/ping',
+                auth=(username, password),
+                headers={'Content-Type': 'application/json'},
+                verify=False,
+                timeout=5
+            )
+            if r.status_code == 200 and r.text == '"pong"':
+                break
             print("Unable to confirm TrueNAS connectivity: " + r.text +
-                f' at https://{target}/api/v2.0/core/ping', file=sys.stderr)
-            parser.print_help()
-            exit(1)
-    except Exception as e: 
+                f' at https://{address}/api/v2.0/core/ping', file=sys.stderr)
+        except Exception as e: 
             print("Unable to confirm TrueNAS connectivity: " + str(e), file=sys.stderr)
-            parser.print_help()
-            exit(1)
+    else:
+        parser.print_help()
+        exit(1)
 
-    REGISTRY.register(TrueNasCollector(target, username, password, cache_smart, skip_snmp, skip_df_regex))
+    pool = None
+    collector = None
+    payload_cache = PayloadCache(args.cache_payload)
+    if args.workers > 0:
+        pool = WorkerPool(args.workers, (), settings)
+        # The workers' copies of these are merged into the pool's output
+        for metric in exporter_metrics():
+            REGISTRY.unregister(metric)
+        REGISTRY.register(pool)
+    else:
+        collector = TrueNasCollector(**settings)
+        REGISTRY.register(collector)
+    writer = None
+    signal.signal(signal.SIGHUP, request_reload)
+    if args.push:
+        # Only imported here, so its truenas_exporter_push_* metrics are
+        # only registered in push mode
+        from truenas_remote_write import RemoteWriter
+        writer = RemoteWriter(args.push, push_collect,
+            labels={'job': args.push_job, 'instance': target.split(',')[0]},
+            batch=args.push_batch, resend=args.push_resend,
+            buffer_dir=args.push_buffer, buffer_max=args.push_buffer_max*1024*1024)
+        print(f"Pushing to {args.push} every {args.push_interval}s now...", file=sys.stderr)
+        writer.run(args.push_interval, between=push_reload)
     print(f"Starting listening on 0.0.0.0:{args.port} now...", file=sys.stderr)
-    httpd = make_server('', int(args.port), truenas_exporter, handler_class=_SilentHandler)
+    httpd = make_server('', int(args.port), truenas_exporter,
+        server_class=_ReloadingServer, handler_class=_SilentHandler)
     httpd.serve_forever()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# Load test driver for the exporter: runs a number of concurrent scrapers
+# against /metrics, like several Prometheus replicas would, and reports scrape
+# latency percentiles and throughput. Usually pointed at an exporter that is
+# itself pointed at truenas_mock.py.
+
+import argparse, math, sys, threading, time
+import urllib.request, urllib.error
+
+def percentile(values, fraction):
+    """ Nearest-rank percentile of an already sorted list """
+    if not values:
+        return float('nan')
+    index = min(len(values) - 1, max(0, math.ceil(fraction*len(values)) - 1))
+    return values[index]
+
+class Scraper(threading.Thread):
+    """ Scrapes the URL in a loop until told to stop """
+
+    def __init__(self, url, interval, timeout, deadline, remaining, lock):
+        super().__init__(daemon=True)
+        self.url = url
+        self.interval = interval
+        self.timeout = timeout
+        self.deadline = deadline
+        self.remaining = remaining
+        self.lock = lock
+        self.latencies = []
+        self.errors = 0
+        self.bytes = 0
+
+    def _take_one(self):
+        """ Claim one of the --requests scrapes, if there is a limit """
+        if self.remaining is None:
+            return True
+        with self.lock:
+            if self.remaining[0] <= 0:
+                return False
+            self.remaining[0] -= 1
+            return True
+
+    def run(self):
+        while time.monotonic() < self.deadline and self._take_one():
+            start = time.monotonic()
+            try:
+                with urllib.request.urlopen(self.url, timeout=self.timeout) as response:
+                    self.bytes += len(response.read())
+                self.latencies.append(time.monotonic() - start)
+            except (urllib.error.URLError, OSError) as e:
+                self.errors += 1
+                print(f'Scrape failed: {e}', file=sys.stderr)
+                if not self.interval:
+                    # Don't spin when the exporter is down
+                    time.sleep(1)
+            if self.interval:
+                time.sleep(max(0, self.interval - (time.monotonic() - start)))
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Run concurrent scrapers against the exporter and report ' +
+        'scrape latency percentiles and throughput.')
+    parser.add_argument('--url', dest='url', default='http://localhost:9912/metrics',
+        help='Exporter URL to scrape')
+    parser.add_argument('--concurrency', dest='concurrency', default=4, type=int,
+        help='Number of scrapers running at the same time')
+    parser.add_argument('--duration', dest='duration', default=60, type=float,
+        help='Seconds to run for')
+    parser.add_argument('--requests', dest='requests', default=None, type=int,
+        help='Stop after this many scrapes in total, even before --duration')
+    parser.add_argument('--interval', dest='interval', default=0, type=float,
+        help='Seconds between the starts of scrapes for each scraper, 0 to ' +
+        'scrape back to back')
+    parser.add_argument('--timeout', dest='timeout', default=120, type=float,
+        help='Scrape timeout in seconds')
+
+    args = parser.parse_args()
+
+    lock = threading.Lock()
+    remaining = [args.requests] if args.requests else None
+    started = time.monotonic()
+    deadline = started + args.duration
+    scrapers = [Scraper(args.url, args.interval, args.timeout, deadline, remaining, lock)
+        for i in range(args.concurrency)]
+    for scraper in scrapers:
+        scraper.start()
+    for scraper in scrapers:
+        scraper.join()
+    elapsed = time.monotonic() - started
+
+    latencies = sorted(latency for scraper in scrapers for latency in scraper.latencies)
+    errors = sum(scraper.errors for scraper in scrapers)
+    total_bytes = sum(scraper.bytes for scraper in scrapers)
+
+    print(f'Scrapers:    {args.concurrency}')
+    print(f'Elapsed:     {elapsed:.2f}s')
+    print(f'Scrapes:     {len(latencies)} ok, {errors} failed')
+    print(f'Throughput:  {len(latencies)/elapsed:.2f} scrapes/s, {total_bytes/elapsed/1024:.1f} KiB/s')
+    if latencies:
+        print(f'Latency:     min {latencies[0]:.3f}s  ' +
+            f'p50 {percentile(latencies, 0.50):.3f}s  ' +
+            f'p90 {percentile(latencies, 0.90):.3f}s  ' +
+            f'p99 {percentile(latencies, 0.99):.3f}s  ' +
+            f'max {latencies[-1]:.3f}s')
+    if errors:
+        exit(1)
@@ -0,0 +1,605 @@
+#!/usr/bin/env python3
+
+# A stand-in for the TrueNAS REST API, for load testing the exporter without a
+# real (or with a deliberately misbehaving) TrueNAS. It answers every endpoint
+# TrueNasCollector calls with generated data in the same shape as the real API,
+# and can be told to be slow, fail, hang or hit 'Argument list too long' on
+# big stats/get_data requests.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse, json, os, random, ssl, subprocess, sys, tempfile, time
+from urllib.parse import parse_qs, urlparse
+
+def _property(value, rawvalue=None):
+    """ A dataset property in the shape pool/dataset returns them """
+    if rawvalue is None:
+        rawvalue = str(value)
+    return {
+        'value': str(value),
+        'rawvalue': rawvalue,
+        'parsed': value,
+        'source': 'LOCAL'
+    }
+
+def _date(timestamp):
+    return {'$date': int(1000*timestamp)}
+
+def _job(index, now, state='SUCCESS', result=None, method=None, arguments=(), description=None):
+    return {
+        'id': index,
+        'method': method,
+        'arguments': list(arguments),
+        'state': state,
+        'result': result,
+        'progress': {'percent': 100 if state == 'SUCCESS' else 42, 'description': description, 'extra': None},
+        'time_started': _date(now - 3600 - index),
+        'time_finished': _date(now - 60 - index) if state != 'RUNNING' else None
+    }
+
+# Properties of a snapshot besides the ones the exporter asks for, so that
+# responses without field selection are as bloated as the real ones
+SNAPSHOT_PROPERTIES = ['type', 'compressratio', 'devices', 'exec', 'setuid',
+    'xattr', 'version', 'utf8only', 'normalization', 'casesensitivity',
+    'nbmand', 'primarycache', 'secondarycache', 'defer_destroy', 'userrefs',
+    'mlslabel', 'refcompressratio', 'written', 'clones', 'logicalreferenced',
+    'acltype', 'context', 'fscontext', 'defcontext', 'rootcontext',
+    'encryption', 'encryptionroot', 'keystatus', 'redact_snaps', 'guid',
+    'createtxg', 'objsetid']
+
+def snapshot(index, datasets, now):
+    """ The index-th snapshot in name order, as zfs/snapshot returns it """
+    dataset = datasets[index % len(datasets)]['name'] if datasets else 'pool0'
+    number = index // max(1, len(datasets))
+    name = '%s@auto-%08d' % (dataset, number)
+    creation = int(now) - 3600*(number + 1)
+    properties = {prop: _property('-') for prop in SNAPSHOT_PROPERTIES}
+    properties['creation'] = _property(creation, str(creation))
+    properties['referenced'] = _property(1048576*(1 + index % 1000), str(1048576*(1 + index % 1000)))
+    properties['used'] = _property(65536*(index % 17), str(65536*(index % 17)))
+    return {
+        'id': name,
+        'name': name,
+        'pool': dataset.split('/')[0],
+        'type': 'SNAPSHOT',
+        'snapshot_name': name.split('@')[1],
+        'dataset': dataset,
+        'createtxg': str(1000 + index),
+        'properties': properties
+    }
+
+def make_payloads(scale, now=None):
+    """ Generated responses for every GET endpoint, keyed by API path """
+
+    # scale is a dict of object counts: pools, datasets, disks, filesystems,
+    # interfaces, replications, rsynctasks, cloudsyncs, snapshottasks, alerts,
+    # enclosures and enclosure_elements.
+    if now is None:
+        now = time.time()
+    rng = random.Random(0)
+    payloads = {}
+    pools = ['pool%d' % i for i in range(scale['pools'])]
+    disks = ['da%d' % i for i in range(scale['disks'])]
+
+    payloads['core/ping'] = 'pong'
+    payloads['system/info'] = {
+        'version': 'TrueNAS-13.0-U6.1',
+        'hostname': 'truenas-a',
+        'physmem': 274877906944,
+        'model': 'Intel(R) Xeon(R) Silver 4114 CPU @ 2.20GHz',
+        'cores': 40,
+        'uptime_seconds': 1234567.8,
+        'system_serial': 'A1-00001',
+        'system_product': 'TRUENAS-X20-HA',
+        'system_manufacturer': 'iXsystems',
+        'license': {
+            'model': 'X20',
+            'system_serial': 'A1-00001',
+            'system_serial_ha': 'A1-00002'
+        }
+    }
+    payloads['network/configuration'] = {
+        'hostname': 'truenas-a',
+        'hostname_b': 'truenas-b',
+        'hostname_local': 'truenas-a',
+        'hostname_virtual': 'truenas',
+        'domain': 'example.net'
+    }
+    payloads['alert/list'] = [{
+        'uuid': '%032x' % i,
+        'node': 'Controller A',
+        'klass': ['ZpoolCapacityWarning', 'SMART', 'ReplicationFailed'][i % 3],
+        'level': ['WARNING', 'CRITICAL', 'INFO'][i % 3],
+        'dismissed': i % 4 == 0,
+        'formatted': 'Something happened'
+    } for i in range(scale['alerts'])]
+    payloads['disk'] = [{
+        'identifier': '{serial}S%08d' % i,
+        'name': name,
+        'serial': 'S%08d' % i,
+        'type': 'HDD' if i % 8 else 'SSD',
+        'model': 'HGST HUH721010AL4200',
+        'size': 10000831348736,
+        'pool': pools[i % len(pools)] if pools else None,
+        'togglesmart': True,
+        'description': ''
+    } for i, name in enumerate(disks)]
+    payloads['interface'] = [{
+        'id': 'ixl%d' % i,
+        'name': 'ixl%d' % i,
+        'type': 'PHYSICAL',
+        'description': None if i % 2 else 'Uplink %d' % i,
+        'state': {'name': 'ixl%d' % i, 'link_state': 'LINK_STATE_UP' if i % 5 else 'LINK_STATE_DOWN'}
+    } for i in range(scale['interfaces'])]
+
+    datasets = []
+    for i in range(scale['datasets']):
+        pool = pools[i % len(pools)]
+        name = pool if i < len(pools) else '%s/share%d' % (pool, i)
+        used = rng.randrange(1 << 20, 1 << 40)
+        available = rng.randrange(1 << 30, 1 << 44)
+        datasets.append({
+            'id': name,
+            'type': 'FILESYSTEM' if i % 10 else 'VOLUME',
+            'name': name,
+            'pool': pool,
+            'encrypted': i % 7 == 0,
+            'encryption_root': None,
+            'key_loaded': False,
+            'children': [],
+            'locked': False,
+            'mountpoint': '/mnt/' + name,
+            'comments': _property(''),
+            'sync': _property('STANDARD'),
+            'compression': _property('LZ4'),
+            'atime': _property('OFF'),
+            'exec': _property('ON'),
+            'quota': _property(None, '0'),
+            'refquota': _property(None, '0'),
+            'reservation': _property(None, '0'),
+            'refreservation': _property(None, '0'),
+            'copies': _property(1),
+            'readonly': _property('OFF'),
+            'recordsize': _property(131072, '131072'),
+            'casesensitivity': _property('SENSITIVE'),
+            'deduplication': _property('OFF'),
+            'snapdir': _property('HIDDEN'),
+            'used': _property(used),
+            'available': _property(available),
+            'usedbysnapshots': _property(used // 10),
+            'usedbydataset': _property(used // 2),
+            'usedbychildren': _property(used // 3),
+            'usedbyrefreservation': _property(0),
+            'compressratio': _property('1.50', '1.50'),
+            'origin': _property(''),
+            'xattr': _property('SA'),
+            'aclmode': _property('PASSTHROUGH'),
+            'acltype': _property('NFSV4')
+        })
+    payloads['pool/dataset'] = datasets
+
+    def vdev(disk):
+        return {
+            'type': 'DISK',
+            'path': '/dev/gptid/%s' % disk,
+            'disk': disk,
+            'status': 'ONLINE',
+            'stats': {'read_errors': 0, 'write_errors': 0, 'checksum_errors': rng.randrange(3)},
+            'children': []
+        }
+    payloads['pool'] = []
+    for p, pool in enumerate(pools):
+        pool_disks = disks[p::len(pools)]
+        spares = pool_disks[-1:]
+        pool_disks = pool_disks[:-1]
+        payloads['pool'].append({
+            'id': p + 1,
+            'name': pool,
+            'guid': str(1000 + p),
+            'path': '/mnt/' + pool,
+            'status': 'ONLINE',
+            'healthy': True,
+            'topology': {
+                'data': [{
+                    'type': 'RAIDZ2',
+                    'status': 'ONLINE',
+                    'children': [vdev(disk) for disk in pool_disks[v:v+8]]
+                } for v in range(0, len(pool_disks), 8)],
+                'log': [],
+                'cache': [],
+                'spare': [vdev(disk) for disk in spares],
+                'special': [],
+                'dedup': []
+            }
+        })
+
+    # core/get_jobs, with the latest job of each task in among the noise of
+    # other jobs. Tasks embed the same objects.
+    jobs = [_job(i, now, method=['cronjob.run', 'pool.scrub.scrub', 'certificate.renew_certs'][i % 3], arguments=[i])
+        for i in range(1, scale.get('jobs', 100) + 1)]
+    def task_job(method, task, state='SUCCESS', description=None):
+        jobs.append(_job(len(jobs) + 1, now, state, method=method, arguments=[task], description=description))
+        return jobs[-1]
+
+    payloads['replication'] = [{
+        'id': i,
+        'name': 'replication %d' % i,
+        'transport': 'LOCAL' if i % 3 == 0 else 'SSH+NETCAT',
+        'source_datasets': [datasets[i % len(datasets)]['name']] if datasets else ['pool0'],
+        'target_dataset': 'backup/replica%d' % i,
+        'ssh_credentials': {'attributes': {'host': 'backup.example.net'}},
+        'state': {'state': 'FINISHED', 'datetime': _date(now - 600)},
+        'job': task_job('replication.run', i, 'RUNNING' if i % 5 == 0 else 'SUCCESS',
+            'Sending 1 of 1: pool0/data@auto-1 (%d MiB / %d MiB)' % (i, 2*i)) if i % 4 else None
+    } for i in range(scale['replications'])]
+    payloads['rsynctask'] = [{
+        'id': i,
+        'desc': 'rsync %d' % i,
+        'path': '/mnt/pool0/rsync%d' % i,
+        'remotehost': 'rsync.example.net',
+        'remotepath': '/backup/rsync%d' % i,
+        'direction': 'PUSH',
+        'enabled': True,
+        'job': task_job('rsynctask.run', i)
+    } for i in range(scale['rsynctasks'])]
+    payloads['cloudsync'] = [{
+        'id': i,
+        'description': 'cloudsync %d' % i,
+        'path': '/mnt/pool0/cloud%d' % i,
+        'job': task_job('cloudsync.sync', i,
+            description='Transferred:   %d.5 GiB / %d.5 GiB, 100%%' % (i, i)) if i % 4 else None
+    } for i in range(scale['cloudsyncs'])]
+    payloads['core/get_jobs'] = jobs
+    payloads['pool/snapshottask'] = [{
+        'id': i,
+        'dataset': datasets[i % len(datasets)]['name'] if datasets else 'pool0',
+        'state': {'state': 'FINISHED', 'datetime': _date(now - 300)}
+    } for i in range(scale['snapshottasks'])]
+
+    payloads['enclosure'] = []
+    for e in range(scale['enclosures']):
+        elements = {
+            'Array Device Slot': {},
+            'Cooling': {},
+            'Temperature Sensor': {},
+            'Voltage Sensor': {},
+            'Enclosure Services Controller Electronics': {}
+        }
+        for i in range(scale['enclosure_elements']):
+            elements['Array Device Slot'][str(i + 1)] = {'descriptor': 'SLOT %03d' % i, 'status': 'OK', 'value': None, 'value_raw': '0x1000000'}
+            if i % 6 == 0:
+                elements['Cooling'][str(i + 1)] = {'descriptor': 'Fan %d' % i, 'status': 'OK', 'value': '%d RPM' % (4000 + i), 'value_raw': '0x1000000'}
+                elements['Temperature Sensor'][str(i + 1)] = {'descriptor': 'Temp %d' % i, 'status': 'OK', 'value': '%dC' % (25 + i % 10), 'value_raw': '0x1000000'}
+                elements['Voltage Sensor'][str(i + 1)] = {'descriptor': 'Voltage %d' % i, 'status': 'OK', 'value': '%.2fV' % (12 + (i % 3)/10), 'value_raw': '0x1000000'}
+            if i % 12 == 0:
+                elements['Enclosure Services Controller Electronics'][str(i + 1)] = {'descriptor': 'ESCE %d' % i, 'status': 'OK', 'value': None, 'value_raw': '0x1000000'}
+        payloads['enclosure'].append({
+            'id': '5000ccab0%07d' % e,
+            'name': 'HGST H4102-J 3010',
+            'model': 'ES102',
+            'controller': e == 0,
+            'elements': elements
+        })
+
+    payloads['smart/test/results'] = [{
+        'disk': disk,
+        'tests': [{
+            'num': 1,
+            'description': 'Short offline',
+            'status': 'SUCCESS' if i % 20 else 'FAILED',
+            'status_verbose': 'Completed without error',
+            'remaining': 0.0,
+            'lifetime': 40000 + i,
+            'lba_of_first_error': None
+        }]
+    } for i, disk in enumerate(disks)]
+
+    sources = {}
+    for i in range(4):
+        sources['cpu-%d' % i] = ['cpu-idle', 'cpu-nice', 'cpu-system', 'cpu-interrupt', 'cpu-user']
+        sources['cputemp-%d' % i] = ['temperature']
+    for source in ['aggregation-cpu-average', 'aggregation-cpu-sum', 'ctl-ioctl', 'ctl-tpc', 'load', 'memory', 'processes', 'swap', 'uptime', 'zfs_arc', 'zfs_arc_v2', 'geom_stat', 'nfsstat-client', 'nfsstat-server']:
+        sources[source] = []
+    for i in range(scale['filesystems']):
+        sources['df-mnt-%s-share%d' % (pools[i % len(pools)], i)] = ['df_complex-free', 'df_complex-reserved', 'df_complex-used']
+    for disk in disks:
+        sources['disk-%s' % disk] = ['disk_io_time', 'disk_octets', 'disk_ops', 'disk_time']
+        sources['disktemp-%s' % disk] = ['temperature']
+    # Every 16th disk is spun down
+    payloads['disk/temperatures'] = {disk: None if i % 16 == 15 else 30 + i % 15
+        for i, disk in enumerate(disks)}
+    for i in range(scale['interfaces']):
+        sources['interface-ixl%d' % i] = ['if_errors', 'if_octets', 'if_packets']
+    payloads['stats/get_sources'] = sources
+
+    return payloads
+
+def stats_data(request, rng):
+    """ A stats/get_data response for the requested stats_list and window """
+
+    # Like rrdtool, one row per step in the window with one column per
+    # stats_list item. The newest rows aren't filled in yet and are null.
+    stats_filter = request.get('stats-filter', {})
+    step = stats_filter.get('step', 10)
+    start = stats_filter.get('start', int(time.time()) - 900)
+    end = stats_filter.get('end', int(time.time()))
+    columns = len(request.get('stats_list', []))
+    rows = max(1, (end - start) // step)
+    data = []
+    for row in range(rows):
+        if row >= rows - 3:
+            data.append([None]*columns)
+        else:
+            data.append([round(rng.uniform(0, 1000), 2) for column in range(columns)])
+    return {
+        'meta': {
+            'start': start,
+            'end': end,
+            'step': step,
+            'legend': ['%s/%s' % (item['source'], item['type']) for item in request['stats_list']]
+        },
+        'data': data
+    }
+
+class MockTrueNasHandler(BaseHTTPRequestHandler):
+    """ Answers /api/v2.0/ calls from the payloads on the server """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self._handle(None)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._respond(400, {'message': 'Invalid JSON'})
+        self._handle(body)
+
+    def _handle(self, body):
+        server = self.server
+        prefix = '/api/v2.0/'
+        if not self.path.startswith(prefix):
+            return self._respond(404, {'message': 'Not found'})
+        apipath = self.path[len(prefix):].split('?')[0].strip('/')
+        server.count(apipath)
+
+        # Faults, in the order a real TrueNAS would hit them
+        time.sleep(server.latency_for(apipath))
+        if server.roll(server.drop_rate, apipath):
+            # Hang up without an answer, like a middleware restart
+            self.close_connection = True
+            self.connection.shutdown(2)
+            return
+        if server.roll(server.timeout_rate, apipath):
+            time.sleep(server.timeout_seconds)
+        if server.roll(server.error_rate, apipath):
+            return self._respond(500, {'message': 'Injected failure', 'errno': 14})
+
+        if apipath == 'zfs/snapshot':
+            return self._respond(200, self._snapshots())
+        if apipath == 'core/get_jobs':
+            query = parse_qs(urlparse(self.path).query)
+            first = int(query.get('id__gte', ['0'])[0])
+            return self._respond(200, [job for job in server.payloads[apipath] if job['id'] >= first])
+        if apipath == 'stats/get_data':
+            if body is None:
+                return self._respond(405, {'message': 'Method not allowed'})
+            if server.arg_max and len(body.get('stats_list', [])) > server.arg_max:
+                return self._respond(500, {
+                    'error': 'rrdtool failed: [Errno 7] Argument list too long',
+                    'errno': 7,
+                    'type': 'OSError'
+                })
+            return self._respond(200, stats_data(body, server.rng))
+        if apipath not in server.payloads:
+            return self._respond(404, {'message': 'Not found'})
+        return self._respond(200, server.rendered[apipath])
+
+    def _snapshots(self):
+        """ A page of zfs/snapshot, with limit, offset and select """
+        server = self.server
+        query = parse_qs(urlparse(self.path).query)
+        offset = int(query.get('offset', ['0'])[0])
+        limit = int(query.get('limit', [str(server.snapshots)])[0])
+        select = query.get('select')
+        page = []
+        for index in range(offset, min(server.snapshots, offset + limit)):
+            item = snapshot(index, server.payloads['pool/dataset'], server.started)
+            if select:
+                selected = {}
+                for field in select:
+                    (key, _, subkey) = field.partition('.')
+                    if subkey:
+                        selected.setdefault(key, {})[subkey] = item[key][subkey]
+                    else:
+                        selected[key] = item[key]
+                item = selected
+            page.append(item)
+        return page
+
+    def _respond(self, status, payload):
+        if isinstance(payload, bytes):
+            body = payload
+        else:
+            body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class MockTrueNasServer(ThreadingHTTPServer):
+    """ Threaded HTTP(S) server with fault injection settings """
+
+    daemon_threads = True
+
+    def __init__(self, address, scale, latency=0.0, endpoint_latency=None,
+            jitter=0.0, error_rate=0.0, endpoint_error_rate=None,
+            timeout_rate=0.0, timeout_seconds=20.0, drop_rate=0.0,
+            arg_max=0, seed=None, verbose=False, failover_status='SINGLE'):
+        super().__init__(address, MockTrueNasHandler)
+        self.started = time.time()
+        self.snapshots = scale.get('snapshots', 0)
+        self.payloads = make_payloads(scale)
+        self.payloads['failover/status'] = failover_status
+        # Pre-render the static payloads so the mock itself isn't the
+        # bottleneck in a load test
+        self.rendered = {path: json.dumps(payload).encode() for path, payload in self.payloads.items()}
+        self.latency = latency
+        self.endpoint_latency = endpoint_latency or {}
+        self.jitter = jitter
+        self.error_rate = {None: error_rate}
+        self.error_rate.update(endpoint_error_rate or {})
+        self.timeout_rate = {None: timeout_rate}
+        self.timeout_seconds = timeout_seconds
+        self.drop_rate = {None: drop_rate}
+        self.arg_max = arg_max
+        self.rng = random.Random(seed)
+        self.verbose = verbose
+        self.calls = {}
+
+    def latency_for(self, apipath):
+        latency = self.endpoint_latency.get(apipath, self.latency)
+        if self.jitter:
+            latency *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(0, latency)
+
+    def roll(self, rates, apipath):
+        # The exporter won't start if core/ping fails, so the global rates
+        # leave it alone. A per-endpoint rate still applies.
+        rate = rates.get(apipath, 0 if apipath == 'core/ping' else rates[None])
+        return rate > 0 and random.random() < rate
+
+    def count(self, apipath):
+        self.calls[apipath] = self.calls.get(apipath, 0) + 1
+
+def _self_signed_context():
+    """ TLS context with a throwaway self-signed certificate from openssl """
+    directory = tempfile.mkdtemp(prefix='truenas_mock_')
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+        '-days', '1', '-subj', '/CN=localhost', '-keyout', keyfile,
+        '-out', certfile], check=True, capture_output=True)
+    return _tls_context(certfile, keyfile)
+
+def _tls_context(certfile, keyfile):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile, keyfile)
+    return context
+
+def _per_endpoint(values):
+    """ Parse repeated PATH=VALUE options """
+    result = {}
+    for value in values or []:
+        (path, number) = value.rsplit('=', 1)
+        result[path.strip('/')] = float(number)
+    return result
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Mock TrueNAS API server for load testing the exporter. ' +
+        'Point the exporter at it with --target localhost:PORT.')
+    parser.add_argument('--port', dest='port', default=8443, type=int,
+        help='Listening HTTPS port')
+    parser.add_argument('--tls-cert', dest='tls_cert', default=None,
+        help='TLS certificate, a self-signed one is generated if not given')
+    parser.add_argument('--tls-key', dest='tls_key', default=None,
+        help='TLS private key for --tls-cert')
+    parser.add_argument('--latency', dest='latency', default=0.0, type=float,
+        help='Seconds to wait before answering every call')
+    parser.add_argument('--endpoint-latency', dest='endpoint_latency',
+        action='append', help='PATH=SECONDS latency for one endpoint, ' +
+        'e.g. stats/get_data=3. May be repeated.')
+    parser.add_argument('--jitter', dest='jitter', default=0.0, type=float,
+        help='Randomize latencies by +/- this fraction')
+    parser.add_argument('--error-rate', dest='error_rate', default=0.0,
+        type=float, help='Fraction of calls answered with HTTP 500')
+    parser.add_argument('--endpoint-error-rate', dest='endpoint_error_rate',
+        action='append', help='PATH=FRACTION error rate for one endpoint. ' +
+        'May be repeated.')
+    parser.add_argument('--timeout-rate', dest='timeout_rate', default=0.0,
+        type=float, help='Fraction of calls that hang for --timeout-seconds')
+    parser.add_argument('--timeout-seconds', dest='timeout_seconds',
+        default=20.0, type=float, help='How long a hanging call hangs, the ' +
+        'exporter gives up after 15')
+    parser.add_argument('--drop-rate', dest='drop_rate', default=0.0,
+        type=float, help='Fraction of calls where the connection is dropped')
+    parser.add_argument('--arg-max', dest='arg_max', default=0, type=int,
+        help='Fail stats/get_data calls with more stats_list items than this ' +
+        'with "Argument list too long", like rrdtool does')
+    parser.add_argument('--failover-status', dest='failover_status',
+        default='SINGLE', choices=['SINGLE', 'MASTER', 'BACKUP', 'ELECTING', 'IMPORTING', 'ERROR'],
+        help='What failover/status answers, to test HA failover')
+    parser.add_argument('--pools', dest='pools', default=2, type=int)
+    parser.add_argument('--datasets', dest='datasets', default=200, type=int)
+    parser.add_argument('--disks', dest='disks', default=48, type=int)
+    parser.add_argument('--filesystems', dest='filesystems', default=200,
+        type=int, help='Number of df-* stats sources')
+    parser.add_argument('--interfaces', dest='interfaces', default=4, type=int)
+    parser.add_argument('--replications', dest='replications', default=10, type=int)
+    parser.add_argument('--rsynctasks', dest='rsynctasks', default=5, type=int)
+    parser.add_argument('--cloudsyncs', dest='cloudsyncs', default=5, type=int)
+    parser.add_argument('--snapshottasks', dest='snapshottasks', default=20, type=int)
+    parser.add_argument('--snapshots', dest='snapshots', default=1000, type=int,
+        help='Number of snapshots served by zfs/snapshot')
+    parser.add_argument('--alerts', dest='alerts', default=10, type=int)
+    parser.add_argument('--enclosures', dest='enclosures', default=2, type=int)
+    parser.add_argument('--enclosure-elements', dest='enclosure_elements',
+        default=24, type=int, help='Device slots per enclosure')
+    parser.add_argument('--seed', dest='seed', default=None, type=int,
+        help='Random seed for stats values')
+    parser.add_argument('--verbose', dest='verbose', default=False,
+        action='store_true', help='Log every request')
+
+    args = parser.parse_args()
+
+    scale = {
+        'pools': max(1, args.pools),
+        'datasets': args.datasets,
+        'disks': args.disks,
+        'filesystems': args.filesystems,
+        'interfaces': args.interfaces,
+        'replications': args.replications,
+        'rsynctasks': args.rsynctasks,
+        'cloudsyncs': args.cloudsyncs,
+        'snapshottasks': args.snapshottasks,
+        'snapshots': args.snapshots,
+        'alerts': args.alerts,
+        'enclosures': args.enclosures,
+        'enclosure_elements': args.enclosure_elements
+    }
+    httpd = MockTrueNasServer(('', args.port), scale,
+        latency=args.latency,
+        endpoint_latency=_per_endpoint(args.endpoint_latency),
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        endpoint_error_rate=_per_endpoint(args.endpoint_error_rate),
+        timeout_rate=args.timeout_rate,
+        timeout_seconds=args.timeout_seconds,
+        drop_rate=args.drop_rate,
+        arg_max=args.arg_max,
+        seed=args.seed,
+        verbose=args.verbose,
+        failover_status=args.failover_status)
+
+    if args.tls_cert:
+        context = _tls_context(args.tls_cert, args.tls_key)
+    else:
+        context = _self_signed_context()
+    httpd.socket = context.wrap_socket(httpd.socket, server_side=True)
+
+    print(f"Mock TrueNAS listening on https://0.0.0.0:{args.port}/api/v2.0/ now...", file=sys.stderr)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print("Calls per endpoint:", file=sys.stderr)
+    for apipath, calls in sorted(httpd.calls.items()):
+        print(f"  {apipath}: {calls}", file=sys.stderr)
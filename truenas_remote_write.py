@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+
+# Push mode for the exporter: instead of waiting to be scraped, it collects on
+# its own schedule and sends the samples to a Prometheus remote-write endpoint.
+# Remote-write bodies are a protobuf WriteRequest compressed with snappy's
+# block format. Both are simple enough to write by hand for the few message
+# types involved, so python-snappy (or cramjam) is only used if installed and
+# protobuf isn't needed at all.
+#
+# Run on its own, this is a stand-in remote-write receiver for testing push
+# mode without a Prometheus, see --help.
+
+from prometheus_client import Counter, Gauge
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse, json, math, os, random, struct, sys, threading, time
+import requests
+
+# Snappy compressors, fastest first. The fallback writes valid snappy made of
+# literals only, which any receiver can read, but doesn't compress at all.
+try:
+    import snappy
+    snappy_compress = snappy.compress
+    snappy_decompress = snappy.uncompress
+except ImportError:
+    try:
+        import cramjam
+        snappy_compress = lambda data: bytes(cramjam.snappy.compress_raw(data))
+        snappy_decompress = lambda data: bytes(cramjam.snappy.decompress_raw(data))
+    except ImportError:
+        snappy_compress = None
+        snappy_decompress = None
+
+push_samples = Counter('truenas_exporter_push_samples', 'Samples sent to the remote-write endpoint')
+push_unchanged = Counter('truenas_exporter_push_unchanged', 'Samples not sent because the series had not changed since it was last sent')
+push_failures = Counter('truenas_exporter_push_failures', 'Remote-write requests that failed after all retries')
+push_dropped = Counter('truenas_exporter_push_dropped', 'Remote-write requests rejected by the receiver or evicted from the buffer')
+push_buffered = Gauge('truenas_exporter_push_buffered_bytes', 'Size of the remote-write requests waiting in the on-disk buffer')
+
+def _varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def _field(number, payload):
+    """ A length-delimited protobuf field """
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+def encode_labels(labels):
+    """ The Label fields of a TimeSeries, sorted by name as receivers expect """
+    return b''.join(_field(1, _field(1, name.encode()) + _field(2, value.encode()))
+        for (name, value) in sorted(labels.items()))
+
+def encode_write_request(series):
+    """ WriteRequest for [(encoded labels, value, timestamp in ms)] """
+    out = bytearray()
+    for (labels, value, timestamp) in series:
+        # Sample: 1 double value, 2 int64 timestamp
+        sample = b'\x09' + struct.pack('<d', value) + b'\x10' + _varint(timestamp)
+        out += _field(1, labels + _field(2, sample))
+    return bytes(out)
+
+def snappy_literal(data):
+    """ Snappy block format without any compression """
+    out = bytearray(_varint(len(data)))
+    for start in range(0, len(data), 65536):
+        chunk = data[start:start + 65536]
+        length = len(chunk) - 1
+        if length < 60:
+            out.append(length << 2)
+        elif length < 256:
+            out += bytes([60 << 2, length])
+        else:
+            out += bytes([61 << 2]) + struct.pack('<H', length)
+        out += chunk
+    return bytes(out)
+
+def compress(data):
+    if snappy_compress:
+        return snappy_compress(data)
+    return snappy_literal(data)
+
+class RemoteWriter(object):
+    """ Sends collected metrics to a remote-write endpoint in batches """
+
+    # Every push collects all metrics, turns them into one sample per series
+    # and sends them in batches of at most `batch` series. A batch that still
+    # fails after `retries` retries (with exponential backoff) is saved in
+    # `buffer_dir` if there is one, and the saved batches are sent first, in
+    # order, on the following pushes. Once a batch has failed, the rest of
+    # that push goes straight to the buffer instead of waiting out more
+    # retries.
+    #
+    # Most of what the exporter collects is inventory that hardly ever
+    # changes: sizes, states, serial numbers. A series whose value hasn't
+    # changed is only sent again every `resend` seconds, which has to stay
+    # under the receiver's lookback (5 minutes for Prometheus) so it doesn't
+    # go stale.
+
+    def __init__(self, url, collect, labels = None, batch = 5000, retries = 3, resend = 120, buffer_dir = None, buffer_max = 100*1024*1024, timeout = 30):
+        self.url = url
+        self.collect = collect
+        self.labels = labels or {}
+        self.batch = batch
+        self.retries = retries
+        self.resend = resend
+        self.buffer_dir = buffer_dir
+        self.buffer_max = buffer_max
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Content-Type': 'application/x-protobuf',
+            'Content-Encoding': 'snappy',
+            'X-Prometheus-Remote-Write-Version': '0.1.0',
+            'User-Agent': 'truenas_exporter'
+        })
+        # series key -> (encoded labels, last value sent, when it was sent)
+        self.sent = {}
+        # Set by wake() to cut the sleep between two pushes short
+        self.woken = threading.Event()
+        if self.buffer_dir:
+            os.makedirs(self.buffer_dir, exist_ok=True)
+            push_buffered.set(sum(size for (path, size) in self._buffered()))
+
+    def run(self, interval, between = None):
+        """ Push every `interval` seconds, forever, calling between() after wake() """
+        while True:
+            start = time.monotonic()
+            try:
+                self.push()
+            except Exception as e:
+                print(f'Push failed: {e}', file=sys.stderr)
+            while self.woken.wait(max(0, interval - (time.monotonic() - start))):
+                self.woken.clear()
+                if between:
+                    between()
+
+    def wake(self):
+        """ Have run() call its between() now rather than after the next push """
+        self.woken.set()
+
+    def push(self):
+        # A series only counts as sent once its batch was accepted or saved
+        # to the buffer. Anything else is sent again next time, even if its
+        # value hasn't changed.
+        (series, now) = self.series()
+        healthy = self._drain()
+        for start in range(0, len(series), self.batch):
+            batch = series[start:start + self.batch]
+            body = compress(encode_write_request([sample for (key, sample) in batch]))
+            delivered = False
+            if healthy:
+                result = self._send(body, len(batch))
+                healthy = result is not None
+                delivered = bool(result)
+            if not healthy:
+                delivered = self._save(body, len(batch))
+            if delivered:
+                for (key, (encoded, value, timestamp)) in batch:
+                    self.sent[key] = (encoded, value, now)
+
+    def series(self):
+        """ (series key, (encoded labels, value, timestamp)) for every series worth sending, and the time """
+        now = time.time()
+        now_ms = int(1000*now)
+        result = []
+        seen = set()
+        unchanged = 0
+        for family in self.collect():
+            for sample in family.samples:
+                labels = dict(sample.labels, __name__=sample.name, **self.labels)
+                key = tuple(sorted(labels.items()))
+                seen.add(key)
+                timestamp = now_ms if sample.timestamp is None else int(1000*float(sample.timestamp))
+                # Some collectd values come through as strings
+                value = float(sample.value)
+                last = self.sent.get(key)
+                if last is not None and (last[1] == value or
+                        (math.isnan(last[1]) and math.isnan(value))) and now - last[2] < self.resend:
+                    unchanged += 1
+                    continue
+                encoded = last[0] if last is not None else encode_labels(labels)
+                result.append((key, (encoded, value, timestamp)))
+        for key in self.sent.keys() - seen:
+            del self.sent[key]
+        push_unchanged.inc(unchanged)
+        return (result, now)
+
+    def _send(self, body, samples):
+        """ POST one request, retrying. True if accepted, False if rejected, None if the receiver is unreachable. """
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(min(30, 2**(attempt - 1))*random.uniform(0.5, 1.5))
+            try:
+                r = self.session.post(self.url, data=body, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                print(f'Remote write to {self.url} failed: {e}', file=sys.stderr)
+                continue
+            if r.status_code < 300:
+                push_samples.inc(samples)
+                return True
+            if r.status_code < 500 and r.status_code != 429:
+                # Retrying won't help, e.g. samples too old for the receiver
+                print(f'Remote write to {self.url} rejected: {r.status_code} {r.text[:200]}', file=sys.stderr)
+                push_dropped.inc()
+                return False
+            print(f'Remote write to {self.url} failed: {r.status_code} {r.text[:200]}', file=sys.stderr)
+        push_failures.inc()
+        return None
+
+    def _buffered(self):
+        """ (path, size) of saved requests, oldest first """
+        if not self.buffer_dir:
+            return []
+        names = sorted(name for name in os.listdir(self.buffer_dir) if name.endswith('.rw'))
+        paths = [os.path.join(self.buffer_dir, name) for name in names]
+        return [(path, os.path.getsize(path)) for path in paths]
+
+    def _save(self, body, samples):
+        """ Buffer a request for later, False if it had to be dropped """
+        if not self.buffer_dir:
+            push_dropped.inc()
+            return False
+        path = os.path.join(self.buffer_dir, f'{time.time_ns():020d}-{samples}.rw')
+        with open(path + '.tmp', 'wb') as saved:
+            saved.write(body)
+        os.rename(path + '.tmp', path)
+
+        # Make room by dropping the oldest requests
+        buffered = self._buffered()
+        total = sum(size for (path, size) in buffered)
+        while total > self.buffer_max and len(buffered) > 1:
+            (oldest, size) = buffered.pop(0)
+            os.remove(oldest)
+            total -= size
+            push_dropped.inc()
+            # Which series it had isn't known, so send them all again
+            self.sent = {}
+        push_buffered.set(total)
+        return True
+
+    def _drain(self):
+        """ Send saved requests. False if the receiver is still unreachable. """
+        buffered = self._buffered()
+        for (path, size) in buffered:
+            with open(path, 'rb') as saved:
+                body = saved.read()
+            samples = int(os.path.basename(path)[:-3].split('-')[1])
+            if self._send(body, samples) is None:
+                return False
+            os.remove(path)
+            push_buffered.dec(size)
+        return True
+
+def _read_varint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            return (value, offset)
+
+def snappy_decode(data):
+    """ Decompress snappy's block format, for when no library is installed """
+    (length, offset) = _read_varint(data, 0)
+    out = bytearray()
+    while offset < len(data):
+        tag = data[offset]
+        offset += 1
+        if tag & 3 == 0:
+            size = tag >> 2
+            if size >= 60:
+                extra = size - 59
+                size = int.from_bytes(data[offset:offset + extra], 'little')
+                offset += extra
+            out += data[offset:offset + size + 1]
+            offset += size + 1
+            continue
+        if tag & 3 == 1:
+            size = 4 + ((tag >> 2) & 7)
+            distance = ((tag >> 5) << 8) | data[offset]
+            offset += 1
+        elif tag & 3 == 2:
+            size = (tag >> 2) + 1
+            distance = int.from_bytes(data[offset:offset + 2], 'little')
+            offset += 2
+        else:
+            size = (tag >> 2) + 1
+            distance = int.from_bytes(data[offset:offset + 4], 'little')
+            offset += 4
+        # Copies may overlap what they produce
+        for i in range(size):
+            out.append(out[-distance])
+    if len(out) != length:
+        raise ValueError(f'Snappy data decoded to {len(out)} bytes instead of {length}')
+    return bytes(out)
+
+def _fields(data):
+    """ (field number, wire type, value) of a protobuf message """
+    offset = 0
+    while offset < len(data):
+        (key, offset) = _read_varint(data, offset)
+        (number, wire) = (key >> 3, key & 7)
+        if wire == 0:
+            (value, offset) = _read_varint(data, offset)
+        elif wire == 1:
+            value = data[offset:offset + 8]
+            offset += 8
+        elif wire == 2:
+            (size, offset) = _read_varint(data, offset)
+            value = data[offset:offset + size]
+            offset += size
+        elif wire == 5:
+            value = data[offset:offset + 4]
+            offset += 4
+        else:
+            raise ValueError(f'Unsupported protobuf wire type {wire}')
+        yield (number, wire, value)
+
+def decode_write_request(data):
+    """ [(labels, [(value, timestamp)])] from a WriteRequest """
+    result = []
+    for (number, wire, timeseries) in _fields(data):
+        if number != 1:
+            continue
+        labels = {}
+        samples = []
+        for (number, wire, value) in _fields(timeseries):
+            if number == 1:
+                label = {number: value.decode() for (number, wire, value) in _fields(value)}
+                labels[label.get(1, '')] = label.get(2, '')
+            elif number == 2:
+                sample = {number: value for (number, wire, value) in _fields(value)}
+                samples.append((struct.unpack('<d', sample.get(1, bytes(8)))[0], sample.get(2, 0)))
+        result.append((labels, samples))
+    return result
+
+class ReceiverHandler(BaseHTTPRequestHandler):
+    """ Accepts remote-write requests and remembers the latest samples """
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if random.random() < server.error_rate:
+            return self._respond(503, b'Injected failure')
+        try:
+            if snappy_decompress:
+                body = snappy_decompress(body)
+            else:
+                body = snappy_decode(body)
+            timeseries = decode_write_request(body)
+        except (ValueError, IndexError, struct.error) as e:
+            return self._respond(400, f'Bad remote-write request: {e}'.encode())
+        with server.lock:
+            server.requests += 1
+            for (labels, samples) in timeseries:
+                server.samples += len(samples)
+                server.latest[tuple(sorted(labels.items()))] = samples[-1]
+        return self._respond(204, b'')
+
+    def do_GET(self):
+        """ What was received so far, as JSON """
+        server = self.server
+        with server.lock:
+            summary = {
+                'requests': server.requests,
+                'samples': server.samples,
+                'series': len(server.latest),
+                'latest': [{'labels': dict(labels), 'value': value, 'timestamp': timestamp}
+                    for (labels, (value, timestamp)) in sorted(server.latest.items())]
+                    if self.path.startswith('/series') else None
+            }
+        self._respond(200, json.dumps(summary, indent=2).encode())
+
+    def _respond(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class ReceiverServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, error_rate=0.0, verbose=False):
+        super().__init__(address, ReceiverHandler)
+        self.lock = threading.Lock()
+        self.error_rate = error_rate
+        self.verbose = verbose
+        self.requests = 0
+        self.samples = 0
+        self.latest = {}
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Stand-in Prometheus remote-write receiver for testing ' +
+        'the exporter\'s push mode. Point the exporter at it with ' +
+        '--push http://localhost:PORT/api/v1/write. GET / returns counts ' +
+        'of what was received, GET /series also the latest sample of every ' +
+        'series.')
+    parser.add_argument('--port', dest='port', default=9201, type=int,
+        help='Listening HTTP port')
+    parser.add_argument('--error-rate', dest='error_rate', default=0.0, type=float,
+        help='Fraction of requests to answer with HTTP 503')
+    parser.add_argument('--verbose', dest='verbose', default=False,
+        action='store_true', help='Log every request')
+
+    args = parser.parse_args()
+
+    httpd = ReceiverServer(('', args.port), args.error_rate, args.verbose)
+    print(f"Receiving remote writes on 0.0.0.0:{args.port}...", file=sys.stderr)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"Received {httpd.requests} requests, {httpd.samples} samples, " +
+        f"{len(httpd.latest)} series", file=sys.stderr)
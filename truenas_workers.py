@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+# Runs the TrueNasCollector's collectors in a pool of worker processes, for
+# --workers. Each worker process owns a fixed group of collectors, so their
+# caches (SMART results, stats rotation, label sets, circuit breakers...) stay
+# in one place, and the costly collectors end up in different processes and
+# on different cores. A worker returns its metrics already serialized in the
+# text exposition format, which the front end only has to concatenate.
+#
+# The exporter's own metrics (the module-level timers and counters, circuit
+# breaker and throttle state) exist in every worker, so those come back as
+# plain samples instead and are merged by the front end.
+
+from prometheus_client import generate_latest, Counter, Summary
+from prometheus_client.metrics_core import Metric
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import signal, sys
+import truenas_collector, truenas_collectors
+from truenas_collector import TrueNasCollector, RequestLimiter
+
+# Collectors spread over the workers first, most expensive first
+COSTLY = ['_collect_stats', '_collect_pool_datasets', '_collect_enclosure', '_collect_pool', '_collect_disks']
+# Collectors that must run in the same process as another one. --throttle
+# needs the core count from system info to make sense of the load average,
+# disk temperatures are labeled from the disk inventory, and the task
+# collectors share one job tracker.
+AFFINITY = {'_collect_system_info': '_collect_stats', '_collect_disk_temperatures': '_collect_disks',
+    '_collect_rsynctask': '_collect_replications', '_collect_cloudsync': '_collect_replications'}
+
+def exporter_metrics():
+    """ The module-level metrics of truenas_collector and its loaded collectors """
+    return [metric for module in [truenas_collector] + truenas_collectors.loaded()
+        for metric in vars(module).values() if isinstance(metric, (Counter, Summary))]
+
+def assign_collections(workers, collectors=None):
+    """ Split the enabled collectors into at most `workers` groups """
+    collector = TrueNasCollector(None, None, None, collectors=collectors)
+    collections = [collection for collection in collector._collections()
+        if collection not in TrueNasCollector.process_collections]
+
+    ordered = [collection for collection in COSTLY if collection in collections]
+    ordered += [collection for collection in collections
+        if collection not in COSTLY and collection not in AFFINITY]
+    groups = [[] for i in range(workers)]
+    for index, collection in enumerate(ordered):
+        groups[index % workers].append(collection)
+    for collection, partner in AFFINITY.items():
+        if collection not in collections:
+            continue
+        # Next to its partner, or wherever there is the least to do if the
+        # partner isn't enabled
+        group = next((group for group in groups if partner in group),
+            min(groups, key=len))
+        group.append(collection)
+
+    # Keep the usual collector order within a worker
+    return [sorted(group, key=collections.index) for group in groups if group]
+
+class Families(object):
+    """ Just enough of a registry for generate_latest() """
+    def __init__(self, families):
+        self.families = families
+
+    def collect(self):
+        return self.families
+
+_collector = None
+
+def _init_worker(args, kwargs, collections, shared_limits, index):
+    global _collector
+    # Ctrl-C and reloads are the front end's to handle
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    _collector = TrueNasCollector(*args, collections=collections, **kwargs)
+    _collector.shared_limits = shared_limits
+    _collector.shared_process = index
+
+def _scrape():
+    """ Run this worker's collectors: (exposition bytes, exporter samples) """
+    families = []
+    internal = []
+    for family in _collector.collect():
+        if family.name.startswith('truenas_exporter_'):
+            internal.append(family)
+        else:
+            families.append(family)
+    for metric in exporter_metrics():
+        internal.extend(metric.collect())
+
+    return (generate_latest(Families(families)),
+        [(family.name, family.documentation, family.type, family.unit,
+            [(sample.name, sample.labels, sample.value) for sample in family.samples])
+            for family in internal])
+
+def _reconfigure(settings):
+    return _collector.reconfigure(settings)
+
+class WorkerPool(object):
+    """ Collector groups in their own processes, registered like a collector """
+
+    def __init__(self, workers, args, kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        self.groups = assign_collections(workers, kwargs.get('collectors'))
+        # --api-concurrency counts calls of all workers together, per target
+        # address given at startup
+        self.shared_limits = self._shared_limits()
+        self.executors = [self._start(index) for index in range(len(self.groups))]
+        self.internal = []
+
+    def _shared_limits(self):
+        return {target: RequestLimiter.shared(len(self.groups))
+            for target in (self.kwargs.get('target') or '').split(',') if target}
+
+    def _start(self, index):
+        return ProcessPoolExecutor(max_workers=1, initializer=_init_worker,
+            initargs=(self.args, self.kwargs, self.groups[index], self.shared_limits, index))
+
+    def _restart(self, index):
+        """ Replace a worker that died, giving back the API slots it held """
+        for shared in self.shared_limits.values():
+            if not RequestLimiter.release(shared, index):
+                # It died holding the lock of the counts, so start every
+                # worker over with new ones
+                print('Worker died holding the --api-concurrency lock, restarting all workers', file=sys.stderr)
+                self.shared_limits = self._shared_limits()
+                for executor in self.executors:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                self.executors = [self._start(index) for index in range(len(self.groups))]
+                return
+        self.executors[index] = self._start(index)
+
+    def _submit(self, index, fn=_scrape, *args):
+        try:
+            return self.executors[index].submit(fn, *args)
+        except BrokenProcessPool:
+            # Died since the last scrape
+            self._restart(index)
+            return self.executors[index].submit(fn, *args)
+
+    def reconfigure(self, settings):
+        """ Apply reloaded settings in every worker, keeping their caches """
+
+        # A worker busy with a scrape gets to it afterwards. Workers started
+        # later, after one died, get the new settings from the start.
+        self.kwargs = dict(self.kwargs, **settings)
+        futures = [self._submit(index, _reconfigure, settings) for index in range(len(self.executors))]
+        changed = set()
+        for index, future in enumerate(futures):
+            try:
+                changed.update(future.result())
+            except Exception as e:
+                print(f'Worker for {", ".join(self.groups[index])} failed to reload: {e}', file=sys.stderr)
+        return sorted(changed)
+
+    def scrape(self):
+        """ Scrape all workers at once and return their serialized metrics """
+        futures = [self._submit(index) for index in range(len(self.executors))]
+        payloads = []
+        self.internal = []
+        for index, future in enumerate(futures):
+            try:
+                (payload, internal) = future.result()
+            except BrokenProcessPool:
+                print(f'Worker for {", ".join(self.groups[index])} died, restarting it', file=sys.stderr)
+                self._restart(index)
+                continue
+            except Exception as e:
+                print(f'Worker for {", ".join(self.groups[index])} failed: {e}', file=sys.stderr)
+                continue
+            payloads.append(payload)
+            self.internal.extend(internal)
+        return b''.join(payloads)
+
+    def collect(self):
+        """ The exporter's own metrics from the last scrape, merged over workers """
+
+        # Counters and summaries add up, except for their _created timestamps.
+        # Gauges (circuit breaker state, stale seconds, throttle pressure) take
+        # the worst value any worker reported.
+        families = {}
+        for (name, documentation, typ, unit, samples) in self.internal:
+            if name not in families:
+                families[name] = (Metric(name, documentation, typ, unit), {})
+            (family, merged) = families[name]
+            for (sample_name, labels, value) in samples:
+                key = (sample_name, tuple(sorted(labels.items())))
+                if key not in merged:
+                    merged[key] = value
+                elif sample_name.endswith('_created'):
+                    merged[key] = min(merged[key], value)
+                elif typ in ['counter', 'summary']:
+                    merged[key] += value
+                else:
+                    merged[key] = max(merged[key], value)
+
+        for (family, merged) in families.values():
+            for ((sample_name, labels), value) in merged.items():
+                family.add_sample(sample_name, dict(labels), value)
+            yield family